@@ -0,0 +1,82 @@
+""" Compares the cost of extracting the fields of S3 access, ALB, NLB and CLB log lines with the format regular
+expressions and with the tokenizer, and of VPC flow log and CloudFront standard access log lines with the format
+regular expressions and with the columns described by their header, on synthetic corpora. Both are checked to produce
+the same fields on every line.
+
+Usage: python benchmarks/bench_parsers.py
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'log_forwarder'))
+
+from config import (S3_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_TYPE, NLB_ACCESS_LOG_TYPE,  # noqa: E402
+                    CLASSIC_LB_ACCESS_LOG_TYPE, VPC_FLOW_LOG_TYPE, CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE)
+from generators import (CORPORA as GENERATED_CORPORA, VPC_FLOW_LOG_HEADERS, s3_access_log,  # noqa: E402
+                        alb_access_log, nlb_access_log, clb_access_log, vpc_flow_log, cf_standard_access_log)
+from parser import Parser, ParserFactory  # noqa: E402
+
+LINES_PER_CORPUS = 20000
+
+CORPORA = {
+    S3_ACCESS_LOG_TYPE: s3_access_log,
+    ALB_ACCESS_LOG_TYPE: alb_access_log,
+    NLB_ACCESS_LOG_TYPE: nlb_access_log,
+    CLASSIC_LB_ACCESS_LOG_TYPE: clb_access_log,
+}
+
+
+# headers describing the default formats, read by the parsers before the rows
+COLUMN_MAPPED_CORPORA = {
+    VPC_FLOW_LOG_TYPE: (VPC_FLOW_LOG_HEADERS[2], vpc_flow_log(2)),
+    CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE: (GENERATED_CORPORA[CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE].header[-1],
+                                          cf_standard_access_log),
+}
+
+
+def _time_per_line(function, lines):
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    return (time.perf_counter() - start) / len(lines)
+
+
+def _parse_with_regex(parser, line):
+    fields = Parser.match(parser, line)
+    return json.dumps(fields) if fields is not None else line
+
+
+def _print_timings(log_type, parser, lines):
+    regex = _time_per_line(lambda line: Parser.match(parser, line), lines)
+    tokenizer = _time_per_line(parser.match, lines)
+    # including the JSON serialization of the fields, i.e. the whole cost of parsing a line
+    regex_parse = _time_per_line(lambda line: _parse_with_regex(parser, line), lines)
+    tokenizer_parse = _time_per_line(parser.parse, lines)
+    print(f'{log_type:>22} {regex * 1e6:>9.2f} {tokenizer * 1e6:>13.2f} {regex / tokenizer:>7.1f}x '
+          f'{regex_parse / tokenizer_parse:>13.1f}x')
+
+
+def main():
+    print(f'{"log_type":>22} {"regex_us":>9} {"tokenizer_us":>13} {"speedup":>8} {"parse_speedup":>14}')
+    for log_type, generate in CORPORA.items():
+        rnd = random.Random(42)
+        lines = [generate(rnd) for _ in range(0, LINES_PER_CORPUS)]
+        parser = ParserFactory.get_parser(log_type, None)
+        for line in lines:
+            assert parser.tokenize_fields(line) == Parser.match(parser, line)
+        _print_timings(log_type, parser, lines)
+    for log_type, (header, generate) in COLUMN_MAPPED_CORPORA.items():
+        rnd = random.Random(42)
+        lines = [generate(rnd) for _ in range(0, LINES_PER_CORPUS)]
+        parser = ParserFactory.get_parser(log_type, None)
+        assert parser.read_header(header)
+        for line in lines:
+            assert parser.match(line) == Parser.match(parser, line)
+        _print_timings(log_type, parser, lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+""" Compares the cost of routing S3 keys with the `paths_regex` rules, as the number of rules grows, between the
+PathRouter and trying each rule one after the other.
+
+Usage: python benchmarks/bench_router.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'log_forwarder'))
+
+from router import PathRouter  # noqa: E402
+
+RULE_COUNTS = [1, 10, 100, 1000]
+ROUTES_PER_RUN = 1000
+
+
+def _paths_regex(rule_count):
+    return [{'pattern': f'tenant-{i}/logs/(?P<dest_config_id>[^/]+)/'} for i in range(0, rule_count)]
+
+
+def _route_sequentially(paths_regex, key):
+    for path_regex_config in paths_regex:
+        matches = re.compile(path_regex_config.get('pattern')).match(key)
+        if matches is not None:
+            return matches.group('dest_config_id')
+    return None
+
+
+def main():
+    print(f'{"rules":>6} {"sequential_us":>14} {"router_us":>10}')
+    for rule_count in RULE_COUNTS:
+        paths_regex = _paths_regex(rule_count)
+        router = PathRouter(paths_regex)
+        # the last rule is the worst case for sequential matching
+        key = f'tenant-{rule_count - 1}/logs/my_config_id/2024/10/25/file.log.gz'
+        assert router.route(key) == (rule_count - 1, _route_sequentially(paths_regex, key))
+        sequential = timeit.timeit(lambda: _route_sequentially(paths_regex, key), number=ROUTES_PER_RUN)
+        routed = timeit.timeit(lambda: router.route(key), number=ROUTES_PER_RUN)
+        print(f'{rule_count:>6} {sequential / ROUTES_PER_RUN * 1e6:>14.2f} {routed / ROUTES_PER_RUN * 1e6:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
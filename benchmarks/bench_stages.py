@@ -0,0 +1,249 @@
+""" Measures the throughput and the peak memory of each stage of an export on its own, for the synthetic corpora of
+`generators.py`: reading lines from plaintext and gzip files, parsing them with the parser of their `log_type`,
+aggregating them with each aggregator, formatting them into batches, and compressing batch payloads. Every stage is
+fed with the output of the previous one, computed beforehand.
+
+Results are written as JSON, one entry per corpus and stage with its input `lines` and `bytes`, `lines_per_sec`,
+`mb_per_sec` and `peak_rss_mb`, so that the results of two releases can be compared with `--baseline`. Peak RSS is
+the high-water mark of the resident memory of the process while the stage runs. It is reset before each stage on
+Linux, and is the high-water mark of the whole run elsewhere.
+
+Usage: python benchmarks/bench_stages.py [--lines 50000] [--corpus alb_access_log] [--output results.json]
+                                         [--baseline previous_results.json]
+"""
+import argparse
+import gc
+import gzip
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'log_forwarder'))
+
+from aggregator import AggregatorFactory  # noqa: E402
+from clients import Batch  # noqa: E402
+from compression import DEFAULT_COMPRESSION_LEVEL, PayloadCompressor  # noqa: E402
+from config import DestinationConfig  # noqa: E402
+from generators import CORPORA, DEFAULT_SEED, generate_lines  # noqa: E402
+from logfile import GZipFile, LogFile, PlaintextFile  # noqa: E402
+from parser import ParserFactory  # noqa: E402
+
+DEFAULT_LINES_PER_CORPUS = 50000
+DEFAULT_REPEAT = 3
+# aggregators by the label of their stage
+AGGREGATORS = {
+    'default': 'default',
+    'java_stack_trace': 'java_stack_trace',
+    'all_patterns': 'java_stack_trace,python_traceback,go_panic,dotnet_exception',
+}
+ATTRIBUTES = {'service': 'benchmark', 'environment': 'production'}
+
+
+class _LinesFile(LogFile):
+    """ Log file whose lines are already in memory, so that parsers are measured without reading files """
+
+    def __init__(self, lines: List[str]):
+        super().__init__(None)
+        self.lines = lines
+
+    def get_lines(self):
+        return iter(self.lines)
+
+
+def _reset_peak_rss() -> bool:
+    # writing 5 to clear_refs resets the high-water mark of the resident memory of the process
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # in kilobytes on Linux, in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _measure(corpus_name: str, stage: str, run: Callable, lines: int, size: int, repeat: int) -> Dict:
+    """ Runs a stage `repeat` times and keeps the fastest run """
+    gc.collect()
+    _reset_peak_rss()
+    seconds = None
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    seconds = max(seconds, 1e-9)
+    return {
+        'corpus': corpus_name,
+        'log_type': CORPORA[corpus_name].log_type,
+        'stage': stage,
+        'lines': lines,
+        'bytes': size,
+        'seconds': seconds,
+        'lines_per_sec': lines / seconds,
+        'mb_per_sec': size / seconds / 1e6,
+        'peak_rss_mb': _peak_rss() / 1e6,
+    }
+
+
+def _size(lines: List[str]) -> int:
+    # the size of lines encoded with their new line
+    return sum(len(line.encode()) + 1 for line in lines)
+
+
+def _consume(chunks):
+    for _ in chunks:
+        pass
+
+
+def _read(log_file_class, filepath) -> Callable:
+    def run():
+        log_file = log_file_class(filepath)
+        _consume(log_file.get_line_chunks())
+        log_file.get_file().close()
+    return run
+
+
+def _parse(log_type, lines: List[str]) -> Callable:
+    return lambda: _consume(ParserFactory.get_parser(log_type, _LinesFile(lines)).get_parsed_chunks())
+
+
+def _aggregate(aggregator_name, lines: List[str]) -> Callable:
+    def run():
+        aggregator = AggregatorFactory.get_aggregator(aggregator_name)
+        aggregator.add_lines(lines)
+        aggregator.finish()
+    return run
+
+
+def _fill_batches(lines: List[str], max_batch_size: int, on_full: Callable):
+    batch = Batch(max_batch_size, attributes=ATTRIBUTES)
+    start = 0
+    while start < len(lines):
+        start = batch.add_lines(lines, start)
+        on_full(batch.get_formatted_data())
+        batch.reset()
+
+
+def _payloads(lines: List[str], max_batch_size: int) -> List[bytes]:
+    payloads = []
+    _fill_batches(lines, max_batch_size, lambda data: payloads.append(bytes(data)))
+    return payloads
+
+
+def _compress(payloads: List[bytes], level: int) -> Callable:
+    def run():
+        compressor = PayloadCompressor(level)
+        for payload in payloads:
+            compressor.compress(payload)
+    return run
+
+
+def benchmark_corpus(corpus_name: str, line_count: int, directory: str, args) -> List[Dict]:
+    corpus = CORPORA[corpus_name]
+    lines = '\n'.join(generate_lines(corpus_name, line_count, args.seed)).split('\n')
+    size = _size(lines)
+    plaintext_path = os.path.join(directory, f'{corpus_name}.log')
+    gzip_path = plaintext_path + '.gz'
+    with open(plaintext_path, 'w') as f:
+        f.writelines(line + '\n' for line in lines)
+    with gzip.open(gzip_path, 'wt') as f:
+        f.writelines(line + '\n' for line in lines)
+
+    results = [
+        _measure(corpus_name, 'read_plaintext', _read(PlaintextFile, plaintext_path), len(lines), size, args.repeat),
+        _measure(corpus_name, 'read_gzip', _read(GZipFile, gzip_path), len(lines), size, args.repeat),
+        _measure(corpus_name, 'parse', _parse(corpus.log_type, lines), len(lines), size, args.repeat),
+    ]
+    parsed_lines = [line for chunk in ParserFactory.get_parser(corpus.log_type, _LinesFile(lines)).get_parsed_chunks()
+                    for line in chunk]
+    parsed_size = _size(parsed_lines)
+    for label, aggregator_name in AGGREGATORS.items():
+        results.append(_measure(corpus_name, f'aggregate[{label}]', _aggregate(aggregator_name, parsed_lines),
+                                len(parsed_lines), parsed_size, args.repeat))
+    results.append(_measure(corpus_name, 'batch', lambda: _fill_batches(parsed_lines, args.max_batch_size, len),
+                            len(parsed_lines), parsed_size, args.repeat))
+    payloads = _payloads(parsed_lines, args.max_batch_size)
+    results.append(_measure(corpus_name, f'compress[{args.compression_level}]',
+                            _compress(payloads, args.compression_level), len(parsed_lines),
+                            sum(len(payload) for payload in payloads), args.repeat))
+    os.remove(plaintext_path)
+    os.remove(gzip_path)
+    return results
+
+
+def _print_header(baseline: Dict):
+    print(f'{"corpus":>22} {"stage":>28} {"lines/s":>11} {"MB/s":>8} {"peak_rss_mb":>12}'
+          + (f' {"speedup":>8}' if baseline else ''))
+
+
+def _print_results(results: List[Dict], baseline: Dict):
+    for result in results:
+        row = (f'{result["corpus"]:>22} {result["stage"]:>28} {result["lines_per_sec"]:>11.0f} '
+               f'{result["mb_per_sec"]:>8.1f} {result["peak_rss_mb"]:>12.1f}')
+        previous = baseline.get((result['corpus'], result['stage']))
+        if previous is not None:
+            row += f' {result["lines_per_sec"] / previous["lines_per_sec"]:>7.2f}x'
+        print(row)
+
+
+def _read_baseline(filepath) -> Dict:
+    if filepath is None:
+        return {}
+    with open(filepath) as f:
+        return {(result['corpus'], result['stage']): result for result in json.load(f)['results']}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--lines', type=int, default=DEFAULT_LINES_PER_CORPUS, help='lines per corpus')
+    arg_parser.add_argument('--corpus', action='append', choices=sorted(CORPORA), help='corpora to run, all by default')
+    arg_parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    arg_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per stage, the fastest is kept')
+    arg_parser.add_argument('--max-batch-size', type=int, default=DestinationConfig.ONE_MB)
+    arg_parser.add_argument('--compression-level', type=int, default=DEFAULT_COMPRESSION_LEVEL)
+    arg_parser.add_argument('--output', default='bench_stages.json', help='file the JSON results are written to')
+    arg_parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    args = arg_parser.parse_args()
+
+    baseline = _read_baseline(args.baseline)
+    results = []
+    _print_header(baseline)
+    with tempfile.TemporaryDirectory() as directory:
+        for corpus_name in args.corpus or CORPORA:
+            corpus_results = benchmark_corpus(corpus_name, args.lines, directory, args)
+            _print_results(corpus_results, baseline)
+            results += corpus_results
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'lines_per_corpus': args.lines,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'max_batch_size': args.max_batch_size,
+            'compression_level': args.compression_level,
+            'results': results,
+        }, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
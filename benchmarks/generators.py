@@ -0,0 +1,222 @@
+""" Deterministic generators of synthetic log files, for every supported `log_type`. Files generated with the same
+seed and number of lines are identical across runs and releases, so that benchmark results can be compared.
+
+Usage: python benchmarks/generators.py <corpus> <line_count> [<seed>] > file.log
+"""
+import json
+import os
+import random
+import sys
+from collections import namedtuple
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'log_forwarder'))
+
+from config import (S3_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_TYPE, NLB_ACCESS_LOG_TYPE,  # noqa: E402
+                    CLASSIC_LB_ACCESS_LOG_TYPE, VPC_FLOW_LOG_TYPE, CLOUDTRAIL_LOG_TYPE,
+                    CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, CLOUDFRONT_REALTIME_ACCESS_LOG_TYPE)
+
+DEFAULT_SEED = 42
+CLOUDTRAIL_RECORDS_PER_LINE = 10
+
+USER_AGENTS = ['curl/7.46.0', 'aws-cli/2.15.0 Python/3.11.6 Linux/6.1 exe/x86_64', '-',
+               'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0']
+METHODS = ['GET', 'PUT', 'POST', 'HEAD', 'DELETE']
+EVENT_NAMES = ['GetObject', 'PutObject', 'AssumeRole', 'DescribeInstances', 'ListBuckets', 'Decrypt']
+JAVA_FRAMES = ['com.example.orders.OrderService.placeOrder(OrderService.java:{})',
+               'com.example.orders.OrderController.post(OrderController.java:{})',
+               'org.springframework.web.servlet.FrameworkServlet.service(FrameworkServlet.java:{})',
+               'jakarta.servlet.http.HttpServlet.service(HttpServlet.java:{})',
+               'java.base/java.lang.Thread.run(Thread.java:{})']
+
+# a corpus is made of `header` lines followed by lines returned by `generate_line(rnd)`
+Corpus = namedtuple('Corpus', ['log_type', 'header', 'generate_line'])
+
+
+def _ip(rnd):
+    return '.'.join(str(rnd.randint(1, 254)) for _ in range(0, 4))
+
+
+def _path(rnd):
+    return '/' + '/'.join(f'segment{rnd.randint(0, 99)}' for _ in range(0, rnd.randint(1, 4)))
+
+
+def s3_access_log(rnd):
+    user_agent = rnd.choice(USER_AGENTS)
+    method = rnd.choice(METHODS)
+    key = _path(rnd)[1:]
+    return (f'79a59df900b949e55d96a1e698fbacedfd6e09d98eacf8f8d5218e7cd47ef2be my-bucket '
+            f'[06/Feb/2019:00:00:{rnd.randint(10, 59)} +0000] {_ip(rnd)} '
+            f'arn:aws:iam::123456789012:user/user{rnd.randint(0, 9)} {rnd.getrandbits(64):016X} '
+            f'REST.{method}.OBJECT {key} "{method} /my-bucket/{key}?x-id={method} HTTP/1.1" '
+            f'{rnd.choice(["200", "304", "404"])} - {rnd.randint(0, 100000)} {rnd.randint(0, 100000)} '
+            f'{rnd.randint(1, 200)} {rnd.randint(1, 100)} "-" "{user_agent}" - '
+            f'{rnd.getrandbits(128):032x}= SigV4 ECDHE-RSA-AES128-GCM-SHA256 AuthHeader '
+            f'my-bucket.s3.us-west-1.amazonaws.com TLSv1.2 - -')
+
+
+def alb_access_log(rnd):
+    target_ip = _ip(rnd)
+    return (f'https 2018-07-02T22:23:00.{rnd.randint(100000, 999999)}Z app/my-loadbalancer/50dc6c495c0c9188 '
+            f'{_ip(rnd)}:{rnd.randint(1024, 65535)} {target_ip}:80 0.{rnd.randint(0, 999):03} '
+            f'0.{rnd.randint(0, 999):03} 0.{rnd.randint(0, 999):03} 200 200 {rnd.randint(0, 5000)} '
+            f'{rnd.randint(0, 50000)} "{rnd.choice(METHODS)} https://www.example.com:443{_path(rnd)}?id='
+            f'{rnd.randint(0, 1000)} HTTP/1.1" "{rnd.choice(USER_AGENTS)}" ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 '
+            f'arn:aws:elasticloadbalancing:us-east-2:123456789012:targetgroup/my-targets/73e2d6bc24d8a067 '
+            f'"Root=1-58337281-{rnd.getrandbits(96):024x}" "www.example.com" '
+            f'"arn:aws:acm:us-east-2:123456789012:certificate/12345678-1234-1234-1234-123456789012" 1 '
+            f'2018-07-02T22:22:48.364000Z "forward" "-" "-" "{target_ip}:80" "200" "-" "-" '
+            f'TID_{rnd.getrandbits(64):016x}')
+
+
+def nlb_access_log(rnd):
+    return (f'tls 2.0 2020-04-01T08:51:{rnd.randint(10, 59)} net/my-network-loadbalancer/c6e77e28c25b2234 '
+            f'g3d4b5e8bb8464cd {_ip(rnd)}:{rnd.randint(1024, 65535)} {_ip(rnd)}:443 {rnd.randint(1, 5000)} '
+            f'{rnd.randint(1, 50)} {rnd.randint(0, 5000)} {rnd.randint(0, 50000)} - '
+            f'arn:aws:acm:us-east-2:671290407336:certificate/2a108f19-aded-46b0-8493-c63eb1ef4a99 - '
+            f'ECDHE-RSA-AES128-SHA tlsv12 - my-network-loadbalancer-c6e77e28c25b2234.elb.us-east-2.amazonaws.com '
+            f'h2 h2 "h2","http/1.1" 2020-04-01T08:51:20')
+
+
+def clb_access_log(rnd):
+    return (f'2015-05-13T23:39:43.{rnd.randint(100000, 999999)}Z my-loadbalancer '
+            f'{_ip(rnd)}:{rnd.randint(1024, 65535)} {_ip(rnd)}:80 0.000086 0.001048 0.001337 200 200 '
+            f'{rnd.randint(0, 5000)} {rnd.randint(0, 50000)} "{rnd.choice(METHODS)} https://www.example.com:443'
+            f'{_path(rnd)} HTTP/1.1" "{rnd.choice(USER_AGENTS)}" DHE-RSA-AES128-SHA TLSv1.2')
+
+
+def _vpc_flow_log_fields(rnd, version):
+    fields = [str(version), '123456789010', f'eni-{rnd.getrandbits(68):017x}', _ip(rnd), _ip(rnd),
+              str(rnd.randint(1024, 65535)), rnd.choice(['22', '80', '443']), '6', str(rnd.randint(1, 100)),
+              str(rnd.randint(40, 100000)), str(1418530010 + rnd.randint(0, 60)),
+              str(1418530070 + rnd.randint(0, 60)), rnd.choice(['ACCEPT', 'REJECT']), 'OK']
+    if version >= 3:
+        fields += [f'vpc-{rnd.getrandbits(32):08x}', f'subnet-{rnd.getrandbits(32):08x}',
+                   f'i-{rnd.getrandbits(68):017x}', rnd.choice(['2', '3', '18', '19']), 'IPv4', _ip(rnd), _ip(rnd)]
+    if version >= 4:
+        fields += ['us-east-1', 'use1-az2', '-', '-']
+    if version >= 5:
+        fields += [rnd.choice(['-', 'AMAZON', 'S3']), '-', rnd.choice(['ingress', 'egress']),
+                   rnd.choice(['-', '1', '8'])]
+    return ' '.join(fields)
+
+
+def vpc_flow_log(version):
+    return lambda rnd: _vpc_flow_log_fields(rnd, version)
+
+
+VPC_FLOW_LOG_HEADERS = {
+    2: 'version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action '
+       'log-status',
+    3: 'version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action '
+       'log-status vpc-id subnet-id instance-id tcp-flags type pkt-srcaddr pkt-dstaddr',
+    4: 'version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action '
+       'log-status vpc-id subnet-id instance-id tcp-flags type pkt-srcaddr pkt-dstaddr region az-id sublocation-type '
+       'sublocation-id',
+    5: 'version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action '
+       'log-status vpc-id subnet-id instance-id tcp-flags type pkt-srcaddr pkt-dstaddr region az-id sublocation-type '
+       'sublocation-id pkt-src-aws-service pkt-dst-aws-service flow-direction traffic-path',
+}
+
+
+def _cloudtrail_record(rnd):
+    event_name = rnd.choice(EVENT_NAMES)
+    return {
+        'eventVersion': '1.08',
+        'userIdentity': {'type': 'AssumedRole', 'principalId': f'AROA{rnd.getrandbits(64):016X}:session',
+                         'arn': f'arn:aws:sts::123456789012:assumed-role/my-role/session{rnd.randint(0, 99)}',
+                         'accountId': '123456789012'},
+        'eventTime': f'2024-10-25T12:{rnd.randint(10, 59)}:{rnd.randint(10, 59)}Z',
+        'eventSource': 's3.amazonaws.com' if 'Object' in event_name else 'ec2.amazonaws.com',
+        'eventName': event_name,
+        'awsRegion': 'us-east-1',
+        'sourceIPAddress': _ip(rnd),
+        'userAgent': rnd.choice(USER_AGENTS),
+        'requestParameters': {'bucketName': 'my-bucket', 'key': _path(rnd)[1:]},
+        'responseElements': None,
+        'requestID': f'{rnd.getrandbits(64):016X}',
+        'eventID': f'{rnd.getrandbits(128):032x}',
+        'readOnly': event_name.startswith(('Get', 'Describe', 'List')),
+        'eventType': 'AwsApiCall',
+        'recipientAccountId': '123456789012',
+    }
+
+
+def cloudtrail_log(rnd):
+    # CloudTrail files hold a JSON object listing records
+    return json.dumps({'Records': [_cloudtrail_record(rnd) for _ in range(0, CLOUDTRAIL_RECORDS_PER_LINE)]})
+
+
+def cf_standard_access_log(rnd):
+    return '\t'.join([
+        '2019-12-04', f'21:02:{rnd.randint(10, 59)}', 'LAX1-C3', str(rnd.randint(0, 100000)), _ip(rnd),
+        rnd.choice(METHODS), 'd111111abcdef8.cloudfront.net', _path(rnd), rnd.choice(['200', '304', '404']), '-',
+        rnd.choice(USER_AGENTS).replace(' ', '%20'), '-', '-', 'Hit', f'{rnd.getrandbits(128):032x}==',
+        'd111111abcdef8.cloudfront.net', 'https', str(rnd.randint(20, 500)), f'0.{rnd.randint(0, 999):03}', '-',
+        'TLSv1.2', 'ECDHE-RSA-AES128-GCM-SHA256', 'Hit', 'HTTP/2.0', '-', '-', str(rnd.randint(1024, 65535)),
+        f'0.{rnd.randint(0, 999):03}', 'Hit', 'text/html', str(rnd.randint(0, 100000)), '-', '-'])
+
+
+def cf_realtime_access_log(rnd):
+    return '\t'.join([
+        f'1575493320.{rnd.randint(100, 999)}', _ip(rnd), f'0.{rnd.randint(0, 999):03}',
+        rnd.choice(['200', '304', '404']), str(rnd.randint(0, 100000)), rnd.choice(METHODS), 'https',
+        'd111111abcdef8.cloudfront.net', _path(rnd), str(rnd.randint(20, 500)), 'LAX1-C3',
+        f'{rnd.getrandbits(128):032x}==', 'd111111abcdef8.cloudfront.net', f'0.{rnd.randint(0, 999):03}', 'HTTP/2.0',
+        'IPv4', rnd.choice(USER_AGENTS).replace(' ', '%20'), '-', '-', '-', 'Hit', '-', 'TLSv1.2',
+        'ECDHE-RSA-AES128-GCM-SHA256', 'Hit', '-', '-', 'text/html', str(rnd.randint(0, 100000)), '-', '-',
+        str(rnd.randint(1024, 65535)), 'Hit', 'US', 'gzip', '*/*', '*', '-', '-', '0'])
+
+
+def java_stack_trace(rnd):
+    # about one entry out of ten is an exception followed by its stack trace
+    timestamp = f'2024-10-25 12:{rnd.randint(10, 59)}:{rnd.randint(10, 59)}.{rnd.randint(100, 999)}'
+    if rnd.random() >= 0.1:
+        return (f'{timestamp} INFO [http-nio-8080-exec-{rnd.randint(1, 10)}] c.e.orders.OrderController - '
+                f'Order {rnd.getrandbits(32):08x} placed in {rnd.randint(1, 500)} ms')
+    lines = [f'{timestamp} ERROR [http-nio-8080-exec-{rnd.randint(1, 10)}] c.e.orders.OrderController - '
+             f'Failed to place order {rnd.getrandbits(32):08x}',
+             'java.lang.IllegalStateException: Inventory service unavailable']
+    lines += [f'\tat {frame.format(rnd.randint(10, 999))}' for frame in JAVA_FRAMES]
+    if rnd.random() < 0.5:
+        lines += ['Caused by: java.net.SocketTimeoutException: Read timed out',
+                  f'\tat {JAVA_FRAMES[0].format(rnd.randint(10, 999))}', f'\t... {len(JAVA_FRAMES) - 1} more']
+    return '\n'.join(lines)
+
+
+CORPORA: Dict[str, Corpus] = {
+    S3_ACCESS_LOG_TYPE: Corpus(S3_ACCESS_LOG_TYPE, [], s3_access_log),
+    ALB_ACCESS_LOG_TYPE: Corpus(ALB_ACCESS_LOG_TYPE, [], alb_access_log),
+    NLB_ACCESS_LOG_TYPE: Corpus(NLB_ACCESS_LOG_TYPE, [], nlb_access_log),
+    CLASSIC_LB_ACCESS_LOG_TYPE: Corpus(CLASSIC_LB_ACCESS_LOG_TYPE, [], clb_access_log),
+    **{f'{VPC_FLOW_LOG_TYPE}_v{version}': Corpus(VPC_FLOW_LOG_TYPE, [header], vpc_flow_log(version))
+       for version, header in VPC_FLOW_LOG_HEADERS.items()},
+    CLOUDTRAIL_LOG_TYPE: Corpus(CLOUDTRAIL_LOG_TYPE, [], cloudtrail_log),
+    CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE: Corpus(CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, [
+        '#Version: 1.0',
+        '#Fields: date time x-edge-location sc-bytes c-ip cs-method cs(Host) cs-uri-stem sc-status cs(Referer) '
+        'cs(User-Agent) cs-uri-query cs(Cookie) x-edge-result-type x-edge-request-id x-host-header cs-protocol '
+        'cs-bytes time-taken x-forwarded-for ssl-protocol ssl-cipher x-edge-response-result-type cs-protocol-version '
+        'fle-status fle-encrypted-fields c-port time-to-first-byte x-edge-detailed-result-type sc-content-type '
+        'sc-content-len sc-range-start sc-range-end'], cf_standard_access_log),
+    CLOUDFRONT_REALTIME_ACCESS_LOG_TYPE: Corpus(CLOUDFRONT_REALTIME_ACCESS_LOG_TYPE, [], cf_realtime_access_log),
+    # application logs, parsed by the default parser and aggregated by the `java_stack_trace` aggregator
+    'java_stack_trace': Corpus(None, [], java_stack_trace),
+}
+
+
+def generate_lines(corpus_name: str, line_count: int, seed=DEFAULT_SEED) -> List[str]:
+    """ Returns the header and `line_count` generated lines of a corpus. Stack traces count as a single line. """
+    corpus = CORPORA[corpus_name]
+    rnd = random.Random(seed)
+    return corpus.header + [corpus.generate_line(rnd) for _ in range(0, line_count)]
+
+
+def main():
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_SEED
+    for line in generate_lines(sys.argv[1], int(sys.argv[2]), seed):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+""" Replays synthetic S3 notification, EventBridge and CloudWatch events through `forward.forward_logs`, against a
+local S3 stand-in and a local stand-in for the ingestion endpoint (see `stubs.py`), to size the memory and the
+concurrency of the Lambda function before changing production settings.
+
+Events are dispatched at `--rate` events per second (or as fast as they are processed if 0) to `--concurrency` worker
+processes, each standing in for a warm Lambda instance processing one event at a time. Objects and CloudWatch
+payloads are generated from the corpora of `generators.py`, with `--object-size` bytes of log data each. The settings
+of the forwarder are read from the environment as usual (e.g. `max_batch_size=500000 python ...`), except for the
+endpoints, the API key, `destination_config` and `paths_regex`, which are set by the simulator.
+
+The report gives end-to-end throughput, the duration, queueing delay and CPU time of invocations, the peak RSS of the
+workers, and the count, statuses, sizes and latency of ingestion requests. It is printed and written as JSON to
+`--output`.
+
+Usage: python benchmarks/load_simulator.py [--event-type s3|eventbridge|cloudwatch] [--corpus alb_access_log]
+                                           [--events 100] [--rate 10] [--concurrency 4] [--object-size 5000000]
+                                           [--latency-ms 50] [--throttle-rate 0.05] [--error-rate 0.01]
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'log_forwarder'))
+
+from forward import forward_logs  # noqa: E402
+from generators import CORPORA, DEFAULT_SEED  # noqa: E402
+from stubs import Faults, IngestionServer, LocalS3Server  # noqa: E402
+
+BUCKET = 'load-simulator-logs'
+ACCOUNT_ID = '123456789012'
+LOG_GROUP = '/aws/lambda/load-simulator'
+COLLECTION = 'load-simulator'
+EVENT_TYPES = ['s3', 'eventbridge', 'cloudwatch']
+DEFAULT_TIMEOUT_SEC = 900
+
+# S3 keys of the objects of a corpus, which select the data retriever of its log type, the data ID the retriever
+# extracts from them, and whether objects are gzipped, as expected by the log file of the log type
+S3Source = namedtuple('S3Source', ['key_template', 'data_id', 'compressed'])
+
+_LB_PREFIX = (f'AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/us-east-1/2024/10/25/'
+              f'{ACCOUNT_ID}_elasticloadbalancing_us-east-1_')
+_VPC_FLOW_LOG_SOURCE = S3Source(f'AWSLogs/{ACCOUNT_ID}/vpcflowlogs/us-east-1/2024/10/25/{ACCOUNT_ID}_vpcflowlogs_'
+                                'us-east-1_fl-1234abcd_20241025T1200Z_{index:08x}.log.gz', 'vpc_flow_log', True)
+S3_SOURCES: Dict[str, S3Source] = {
+    's3_access_log': S3Source('s3-access-logs/my-bucket/2024-10-25-12-00-00-{index:016X}', 'my-bucket', False),
+    'alb_access_log': S3Source(_LB_PREFIX + 'app.my-loadbalancer.50dc6c495c0c9188_20241025T1200Z_10.0.0.1_'
+                               '{index:08x}.log.gz', 'my-loadbalancer', True),
+    'nlb_access_log': S3Source(_LB_PREFIX + 'net.my-network-loadbalancer.c6e77e28c25b2234_20241025T1200Z_'
+                               '{index:08x}.log.gz', 'my-network-loadbalancer', True),
+    'vpc_flow_log_v2': _VPC_FLOW_LOG_SOURCE,
+    'vpc_flow_log_v3': _VPC_FLOW_LOG_SOURCE,
+    'vpc_flow_log_v4': _VPC_FLOW_LOG_SOURCE,
+    'vpc_flow_log_v5': _VPC_FLOW_LOG_SOURCE,
+    'cloudtrail_log': S3Source(f'AWSLogs/{ACCOUNT_ID}/CloudTrail/us-east-1/2024/10/25/{ACCOUNT_ID}_CloudTrail_'
+                               'us-east-1_20241025T1200Z_{index:016x}.json.gz', 'cloudtrail', True),
+    'cf_standard_access_log': S3Source('cloudfront/E2EXAMPLE.2024-10-25-12.{index:08x}.gz', 'E2EXAMPLE', True),
+    # routed by `paths_regex`
+    'java_stack_trace': S3Source('apps/my-app/2024/10/25/{index:08x}.log', 'my-app', False),
+}
+PATHS_REGEX = [{'pattern': 'apps/(?P<dest_config_id>[^/]+)/'}]
+
+# an event along with the amount of log data it carries
+Event = namedtuple('Event', ['index', 'event_type', 'corpus', 'payload', 'size', 'lines'])
+InvocationResult = namedtuple('InvocationResult', ['index', 'pid', 'cold', 'scheduled_at', 'started_at', 'ended_at',
+                                                   'cpu_sec', 'error'])
+WorkerResult = namedtuple('WorkerResult', ['pid', 'peak_rss'])
+_WORKER_READY = 'ready'
+
+
+class _LambdaContext:
+    """ Context of an invocation, telling how much time it has left before timing out """
+
+    def __init__(self, timeout_sec):
+        self.expires_at = time.monotonic() + timeout_sec
+        self.function_name = 'load-simulator'
+
+    def get_remaining_time_in_millis(self):
+        return int(max(0.0, self.expires_at - time.monotonic()) * 1000)
+
+
+def _generate_data(corpus_name: str, size: int, seed: int) -> Tuple[bytes, int]:
+    """ Returns about `size` bytes of lines of a corpus, and their number of lines """
+    corpus = CORPORA[corpus_name]
+    rnd = random.Random(seed)
+    lines = list(corpus.header)
+    data_size = sum(len(line) + 1 for line in lines)
+    while data_size < size:
+        line = corpus.generate_line(rnd)
+        lines.append(line)
+        data_size += len(line) + 1
+    data = ''.join(line + '\n' for line in lines).encode()
+    return data, data.count(b'\n')
+
+
+def _s3_record(key: str, s3_object_size: int, etag: str) -> Dict:
+    return {'eventVersion': '2.1', 'eventSource': 'aws:s3', 'awsRegion': 'us-east-1', 'eventName': 'ObjectCreated:Put',
+            's3': {'s3SchemaVersion': '1.0', 'bucket': {'name': BUCKET, 'arn': f'arn:aws:s3:::{BUCKET}'},
+                   'object': {'key': key, 'size': s3_object_size, 'eTag': etag}}}
+
+
+def _eventbridge_event(key: str, s3_object_size: int, etag: str) -> Dict:
+    return {'version': '0', 'detail-type': 'Object Created', 'source': 'aws.s3', 'account': ACCOUNT_ID,
+            'region': 'us-east-1', 'resources': [f'arn:aws:s3:::{BUCKET}'],
+            'detail': {'version': '0', 'bucket': {'name': BUCKET},
+                       'object': {'key': key, 'size': s3_object_size, 'etag': etag}, 'reason': 'PutObject'}}
+
+
+def _cloudwatch_event(data: bytes, index: int) -> Dict:
+    messages = data.decode().rstrip('\n').split('\n')
+    payload = {'messageType': 'DATA_MESSAGE', 'owner': ACCOUNT_ID, 'logGroup': LOG_GROUP,
+               'logStream': f'2024/10/25/[$LATEST]{index:032x}', 'subscriptionFilters': ['load-simulator'],
+               'logEvents': [{'id': str(i), 'timestamp': 1729857600000 + i, 'message': message}
+                             for i, message in enumerate(messages)]}
+    return {'awslogs': {'data': base64.b64encode(gzip.compress(json.dumps(payload).encode())).decode()}}
+
+
+class EventGenerator:
+    """ Generates events of `event_types` about objects of `corpora`, in turns. Objects of a corpus share the same
+    data, which is generated once, but each S3 record refers to an object of its own. """
+
+    def __init__(self, s3_server: LocalS3Server, event_types: List[str], corpora: List[str], object_size: int,
+                 records_per_event: int, seed: int):
+        self.s3_server = s3_server
+        self.event_types = event_types
+        self.corpora = corpora
+        self.records_per_event = records_per_event
+        self.data = {corpus_name: _generate_data(corpus_name, object_size, seed) for corpus_name in corpora}
+        self.s3_objects = {}
+        for corpus_name, (data, _) in self.data.items():
+            s3_object = gzip.compress(data, 6) if S3_SOURCES[corpus_name].compressed else data
+            self.s3_objects[corpus_name] = s3_object, hashlib.md5(s3_object).hexdigest()
+        self.object_count = 0
+
+    def _put_object(self, corpus_name: str) -> Tuple[str, int, str]:
+        s3_object, etag = self.s3_objects[corpus_name]
+        key = S3_SOURCES[corpus_name].key_template.format(index=self.object_count)
+        self.object_count += 1
+        self.s3_server.put_object(BUCKET, key, s3_object)
+        return key, len(s3_object), etag
+
+    def generate(self, index: int) -> Event:
+        event_type = self.event_types[index % len(self.event_types)]
+        corpus_name = self.corpora[index % len(self.corpora)]
+        data, lines = self.data[corpus_name]
+        if event_type == 'cloudwatch':
+            return Event(index, event_type, corpus_name, _cloudwatch_event(data, index), len(data), lines)
+        if event_type == 'eventbridge':
+            return Event(index, event_type, corpus_name, _eventbridge_event(*self._put_object(corpus_name)),
+                         len(data), lines)
+        records = [_s3_record(*self._put_object(corpus_name)) for _ in range(0, self.records_per_event)]
+        return Event(index, event_type, corpus_name, {'Records': records}, len(data) * len(records),
+                     lines * len(records))
+
+
+def _destination_config(corpora: List[str]) -> Dict:
+    destination_config = {LOG_GROUP: {'dataset': 'cloudwatch', 'collection': COLLECTION}}
+    for corpus_name in corpora:
+        log_type = CORPORA[corpus_name].log_type
+        # the versions of VPC flow logs share a destination
+        destination = {'dataset': log_type or corpus_name, 'collection': COLLECTION}
+        if log_type is not None:
+            destination['log_type'] = log_type
+        destination_config[S3_SOURCES[corpus_name].data_id] = destination
+    return destination_config
+
+
+def _configure_environment(s3_url: str, ingestion_url: str, corpora: List[str]):
+    """ Points the forwarder at the stand-ins. Worker processes inherit the environment. """
+    os.environ['AWS_ENDPOINT_URL_S3'] = s3_url
+    os.environ['AWS_ACCESS_KEY_ID'] = 'load-simulator'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'load-simulator'
+    os.environ['AWS_EC2_METADATA_DISABLED'] = 'true'
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['bronto_endpoint'] = ingestion_url
+    os.environ['bronto_api_key'] = 'load-simulator'
+    os.environ['destination_config'] = base64.b64encode(json.dumps(_destination_config(corpora)).encode()).decode()
+    os.environ['paths_regex'] = base64.b64encode(json.dumps(PATHS_REGEX).encode()).decode()
+
+
+def _run_worker(tasks, results, log_level: str, timeout_sec: float):
+    """ Processes events one at a time, as a warm Lambda instance does """
+    logging.getLogger().setLevel(log_level)
+    results.put(_WORKER_READY)
+    cold = True
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, scheduled_at, event = task
+        started_at = time.monotonic()
+        cpu_start = time.process_time()
+        error = None
+        try:
+            forward_logs(event, _LambdaContext(timeout_sec))
+        except Exception as e:
+            error = repr(e)
+        results.put(InvocationResult(index, os.getpid(), cold, scheduled_at, started_at, time.monotonic(),
+                                     time.process_time() - cpu_start, error))
+        cold = False
+    # in kilobytes on Linux, in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put(WorkerResult(os.getpid(), max_rss if sys.platform == 'darwin' else max_rss * 1024))
+
+
+def _distribution(values: List[float]) -> Dict:
+    if len(values) == 0:
+        return {'count': 0}
+    values = sorted(values)
+
+    def percentile(p):
+        # nearest rank
+        return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+    return {'count': len(values), 'mean': sum(values) / len(values), 'min': values[0], 'p50': percentile(50),
+            'p90': percentile(90), 'p99': percentile(99), 'max': values[-1]}
+
+
+def _dispatch(events: List[Event], tasks, rate: float) -> float:
+    """ Queues events at `rate` events per second, or all at once if 0. Returns the time dispatching started at. """
+    start = time.monotonic()
+    for i, event in enumerate(events):
+        scheduled_at = start + i / rate if rate > 0 else start
+        delay_sec = scheduled_at - time.monotonic()
+        if delay_sec > 0:
+            time.sleep(delay_sec)
+        tasks.put((event.index, scheduled_at, event.payload))
+    return start
+
+
+def _collect(results, worker_count: int) -> Tuple[List[InvocationResult], List[WorkerResult]]:
+    invocations = []
+    workers = []
+    while len(workers) < worker_count:
+        result = results.get()
+        if isinstance(result, WorkerResult):
+            workers.append(result)
+        else:
+            invocations.append(result)
+    return invocations, workers
+
+
+def _report(args, events: List[Event], start: float, invocations: List[InvocationResult],
+            workers: List[WorkerResult], ingestion_server: IngestionServer, s3_server: LocalS3Server) -> Dict:
+    wall_sec = max(invocation.ended_at for invocation in invocations) - start
+    size = sum(event.size for event in events)
+    lines = sum(event.lines for event in events)
+    requests = ingestion_server.get_requests()
+    accepted = [request for request in requests if request.status == 200]
+    statuses = {}
+    datasets = {}
+    for request in requests:
+        statuses[str(request.status)] = statuses.get(str(request.status), 0) + 1
+        datasets[request.dataset] = datasets.get(request.dataset, 0) + 1
+    errors = {}
+    for invocation in invocations:
+        if invocation.error is not None:
+            errors[invocation.error] = errors.get(invocation.error, 0) + 1
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'forwarder_environment': {key: value for key, value in os.environ.items() if key.islower()
+                                  and key not in ('destination_config', 'paths_regex', 'bronto_api_key')},
+        'throughput': {
+            'wall_sec': wall_sec,
+            'events_per_sec': len(invocations) / wall_sec,
+            'input_mb': size / 1e6,
+            'input_mb_per_sec': size / wall_sec / 1e6,
+            'input_lines_per_sec': lines / wall_sec,
+            'sent_mb_per_sec': sum(request.size for request in accepted) / wall_sec / 1e6,
+        },
+        'invocations': {
+            'count': len(invocations),
+            'failed': sum(1 for invocation in invocations if invocation.error is not None),
+            'cold': sum(1 for invocation in invocations if invocation.cold),
+            'timed_out': sum(1 for invocation in invocations
+                             if invocation.ended_at - invocation.started_at > args.timeout_sec),
+            'duration_sec': _distribution([invocation.ended_at - invocation.started_at for invocation in invocations]),
+            'queue_delay_sec': _distribution([invocation.started_at - invocation.scheduled_at
+                                              for invocation in invocations]),
+            'latency_sec': _distribution([invocation.ended_at - invocation.scheduled_at for invocation in invocations]),
+            'cpu_sec': _distribution([invocation.cpu_sec for invocation in invocations]),
+            'errors': errors,
+        },
+        'workers': {
+            'count': len(workers),
+            'peak_rss_mb': max(worker.peak_rss for worker in workers) / 1e6,
+            'peak_rss_mb_by_worker': sorted(worker.peak_rss / 1e6 for worker in workers),
+        },
+        'ingestion': {
+            'requests': len(requests),
+            'statuses': statuses,
+            'requests_by_dataset': datasets,
+            'payload_bytes': _distribution([request.size for request in accepted]),
+            'latency_sec': _distribution([request.latency_sec for request in requests]),
+        },
+        's3': {
+            'requests': dict(s3_server.request_counts),
+            'mb_transferred': s3_server.bytes_transferred / 1e6,
+        },
+    }
+    if args.verify_payloads:
+        report['ingestion']['lines'] = sum(request.lines for request in accepted)
+        report['ingestion']['uncompressed_mb'] = sum(request.uncompressed_size for request in accepted) / 1e6
+    return report
+
+
+def _print_report(report: Dict):
+    throughput = report['throughput']
+    invocations = report['invocations']
+    ingestion = report['ingestion']
+    print(f'events: {invocations["count"]} ({invocations["failed"]} failed, {invocations["timed_out"]} over the '
+          f'timeout) in {throughput["wall_sec"]:.2f} s, {throughput["events_per_sec"]:.2f} events/s, '
+          f'{throughput["input_mb_per_sec"]:.2f} MB/s, {throughput["input_lines_per_sec"]:.0f} lines/s')
+    for name in ['duration_sec', 'queue_delay_sec', 'latency_sec', 'cpu_sec']:
+        distribution = invocations[name]
+        print(f'{name:>16}: p50={distribution["p50"]:.3f} p90={distribution["p90"]:.3f} '
+              f'p99={distribution["p99"]:.3f} max={distribution["max"]:.3f}')
+    print(f'     peak_rss_mb: {report["workers"]["peak_rss_mb"]:.1f}')
+    payload_bytes = ingestion['payload_bytes']
+    print(f'ingestion requests: {ingestion["requests"]} {ingestion["statuses"]}, accepted payloads: '
+          f'mean={payload_bytes.get("mean", 0):.0f} max={payload_bytes.get("max", 0)} bytes, latency: '
+          f'p50={ingestion["latency_sec"].get("p50", 0):.3f} p99={ingestion["latency_sec"].get("p99", 0):.3f} s')
+    print(f's3 requests: {report["s3"]["requests"]}')
+    for error, count in invocations['errors'].items():
+        print(f'error ({count} invocations): {error}')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--event-type', action='append', choices=EVENT_TYPES,
+                            help='types of the events, replayed in turns, s3 by default')
+    arg_parser.add_argument('--corpus', action='append', choices=sorted(S3_SOURCES),
+                            help='corpora of the objects, used in turns, alb_access_log by default')
+    arg_parser.add_argument('--events', type=int, default=100, help='number of events to replay')
+    arg_parser.add_argument('--rate', type=float, default=0, help='events per second, 0 to replay them at once')
+    arg_parser.add_argument('--concurrency', type=int, default=1, help='number of concurrent Lambda instances')
+    arg_parser.add_argument('--object-size', type=int, default=1000000,
+                            help='bytes of log data per object or CloudWatch event')
+    arg_parser.add_argument('--records-per-event', type=int, default=1, help='records per S3 notification event')
+    arg_parser.add_argument('--timeout-sec', type=float, default=DEFAULT_TIMEOUT_SEC,
+                            help='timeout of the Lambda function')
+    arg_parser.add_argument('--latency-ms', type=float, default=0, help='latency of ingestion requests')
+    arg_parser.add_argument('--latency-jitter-ms', type=float, default=0, help='random latency added to it')
+    arg_parser.add_argument('--throttle-rate', type=float, default=0, help='ratio of requests throttled with a 429')
+    arg_parser.add_argument('--retry-after-sec', type=float, help='Retry-After header of throttled requests')
+    arg_parser.add_argument('--error-rate', type=float, default=0, help='ratio of requests failing with a 5xx')
+    arg_parser.add_argument('--read-kbps', type=float, help='rate ingestion request bodies are read at, in KB/s')
+    arg_parser.add_argument('--s3-latency-ms', type=float, default=0, help='latency of S3 requests')
+    arg_parser.add_argument('--verify-payloads', action='store_true',
+                            help='decompress payloads to count the lines ingested')
+    arg_parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    arg_parser.add_argument('--log-level', default='WARNING', help='log level of the forwarder')
+    arg_parser.add_argument('--output', default='load_simulation.json', help='file the JSON report is written to')
+    args = arg_parser.parse_args()
+    args.event_type = args.event_type or ['s3']
+    args.corpus = args.corpus or ['alb_access_log']
+
+    faults = Faults(args.latency_ms / 1000, args.latency_jitter_ms / 1000, args.throttle_rate, args.error_rate,
+                    args.retry_after_sec, int(args.read_kbps * 1000) if args.read_kbps else None, args.seed)
+    ingestion_server = IngestionServer(faults, args.verify_payloads)
+    s3_server = LocalS3Server(args.s3_latency_ms / 1000)
+    _configure_environment(s3_server.start(), ingestion_server.start(), args.corpus)
+    generator = EventGenerator(s3_server, args.event_type, args.corpus, args.object_size, args.records_per_event,
+                               args.seed)
+    events = [generator.generate(i) for i in range(0, args.events)]
+
+    # workers are spawned rather than forked, since the stand-ins run in threads of this process
+    context = multiprocessing.get_context('spawn')
+    tasks = context.Queue()
+    results = context.Queue()
+    workers = [context.Process(target=_run_worker, args=(tasks, results, args.log_level, args.timeout_sec))
+               for _ in range(0, args.concurrency)]
+    for worker in workers:
+        worker.start()
+    # invocations are timed once all the instances are up
+    for _ in workers:
+        results.get()
+    start = _dispatch(events, tasks, args.rate)
+    for _ in workers:
+        tasks.put(None)
+    invocations, worker_results = _collect(results, len(workers))
+    for worker in workers:
+        worker.join()
+    ingestion_server.stop()
+    s3_server.stop()
+
+    report = _report(args, events, start, invocations, worker_results, ingestion_server, s3_server)
+    _print_report(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
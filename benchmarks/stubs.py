@@ -0,0 +1,267 @@
+""" Local stand-ins for S3 and for the BrontoBytes ingestion endpoint, serving HTTP on the loopback interface so that
+exports can be run end to end without AWS or BrontoBytes. The ingestion stand-in can inject latency, throttling, server
+errors and slow reads of request bodies.
+
+boto3 clients are pointed at the S3 stand-in with the `AWS_ENDPOINT_URL_S3` environment variable, and exports at the
+ingestion stand-in with the `bronto_endpoint` one.
+"""
+import gzip
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+_RANGE = re.compile(r'bytes=(\d+)-(\d*)$')
+SERVER_ERROR_STATUSES = [500, 502, 503, 504]
+
+# `latency_sec` is the time taken to handle a request, from its first byte to its response
+IngestionRequest = namedtuple('IngestionRequest', ['dataset', 'status', 'size', 'uncompressed_size', 'lines',
+                                                   'latency_sec'])
+S3Object = namedtuple('S3Object', ['data', 'etag', 'last_modified'])
+
+
+class _StubServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    # request queue size, above the default of 5 so that concurrent exports do not get their connections refused
+    request_queue_size = 128
+
+    def start(self) -> str:
+        """ Serves requests in a background thread and returns the URL of the server """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+
+    # keep-alive connections, as with actual endpoints
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, headers: Dict[str, str], body: bytes = b''):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class Faults:
+    """ Faults injected by the ingestion stand-in. Each request is delayed by `latency_sec` plus up to
+    `latency_jitter_sec`, and is throttled (`429`) with probability `throttle_rate` or fails with a `5xx` status with
+    probability `error_rate`. Throttled requests get a `Retry-After` header if `retry_after_sec` is set. When
+    `read_bytes_per_sec` is set, request bodies are read at that rate, as by a congested endpoint. """
+
+    def __init__(self, latency_sec=0.0, latency_jitter_sec=0.0, throttle_rate=0.0, error_rate=0.0,
+                 retry_after_sec: Optional[float] = None, read_bytes_per_sec: Optional[int] = None, seed=42):
+        self.latency_sec = latency_sec
+        self.latency_jitter_sec = latency_jitter_sec
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after_sec = retry_after_sec
+        self.read_bytes_per_sec = read_bytes_per_sec
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self) -> Tuple[float, int]:
+        """ Returns the latency and the status of a request """
+        with self.lock:
+            latency_sec = self.latency_sec + self.rnd.uniform(0, self.latency_jitter_sec)
+            draw = self.rnd.random()
+            if draw < self.throttle_rate:
+                return latency_sec, 429
+            if draw < self.throttle_rate + self.error_rate:
+                return latency_sec, self.rnd.choice(SERVER_ERROR_STATUSES)
+            return latency_sec, 200
+
+
+class _IngestionRequestHandler(_StubRequestHandler):
+
+    server: 'IngestionServer'
+
+    _READ_SIZE = 16 * 1024
+
+    def _read_body(self, length: int) -> bytes:
+        read_bytes_per_sec = self.server.faults.read_bytes_per_sec
+        if read_bytes_per_sec is None:
+            return self.rfile.read(length)
+        chunks = []
+        start = time.monotonic()
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(_IngestionRequestHandler._READ_SIZE, remaining))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            # sleeps until the bytes read so far are due
+            delay_sec = start + (length - remaining) / read_bytes_per_sec - time.monotonic()
+            if delay_sec > 0:
+                time.sleep(delay_sec)
+        return b''.join(chunks)
+
+    def do_POST(self):
+        start = time.monotonic()
+        body = self._read_body(int(self.headers.get('Content-Length', 0)))
+        latency_sec, status = self.server.faults.draw()
+        uncompressed_size = lines = None
+        if self.server.verify_payloads and status == 200:
+            data = gzip.decompress(body)
+            uncompressed_size = len(data)
+            lines = data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+        remaining_sec = start + latency_sec - time.monotonic()
+        if remaining_sec > 0:
+            time.sleep(remaining_sec)
+        headers = {'Content-Type': 'application/json'}
+        if status == 429 and self.server.faults.retry_after_sec is not None:
+            headers['Retry-After'] = f'{self.server.faults.retry_after_sec:g}'
+        self._send(status, headers, b'{}')
+        self.server.record(IngestionRequest(self.headers.get('x-bronto-service-name'), status, len(body),
+                                            uncompressed_size, lines, time.monotonic() - start))
+
+
+class IngestionServer(_StubServer):
+    """ Stand-in for the ingestion endpoint, accepting payloads POSTed to any path and recording their size. Payloads
+    are decompressed to count their lines when `verify_payloads` is set. """
+
+    def __init__(self, faults: Optional[Faults] = None, verify_payloads=False, host='127.0.0.1', port=0):
+        super().__init__((host, port), _IngestionRequestHandler)
+        self.faults = Faults() if faults is None else faults
+        self.verify_payloads = verify_payloads
+        self.requests: List[IngestionRequest] = []
+        self.lock = threading.Lock()
+
+    def record(self, request: IngestionRequest):
+        with self.lock:
+            self.requests.append(request)
+
+    def get_requests(self) -> List[IngestionRequest]:
+        with self.lock:
+            return list(self.requests)
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """ Returns the payload of a body sent with the `aws-chunked` content encoding, i.e. `<hex size>[;signature]\\r\\n
+    <data>\\r\\n` chunks followed by an empty chunk and trailers """
+    data = []
+    position = 0
+    while True:
+        line_end = body.index(b'\r\n', position)
+        size = int(body[position:line_end].split(b';')[0], 16)
+        if size == 0:
+            return b''.join(data)
+        data.append(body[line_end + 2:line_end + 2 + size])
+        position = line_end + 2 + size + 2
+
+
+class _S3RequestHandler(_StubRequestHandler):
+
+    server: 'LocalS3Server'
+
+    def _object_address(self) -> Tuple[str, str]:
+        # path-style addressing, i.e. /<bucket>/<key>
+        bucket, _, key = unquote(urlsplit(self.path).path).lstrip('/').partition('/')
+        return bucket, key
+
+    def _not_found(self, key):
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code>'
+                f'<Message>The specified key does not exist.</Message><Key>{key}</Key></Error>').encode()
+        self._send(404, {'Content-Type': 'application/xml'}, body)
+
+    def _get(self):
+        self.server.delay()
+        bucket, key = self._object_address()
+        s3_object = self.server.get_object(bucket, key)
+        if s3_object is None:
+            self._not_found(key)
+            return
+        headers = {'ETag': s3_object.etag, 'Last-Modified': s3_object.last_modified, 'Accept-Ranges': 'bytes',
+                   'Content-Type': 'binary/octet-stream'}
+        if self.headers.get('If-None-Match') == s3_object.etag:
+            self._send(304, headers)
+            return
+        data = s3_object.data
+        status = 200
+        byte_range = _RANGE.match(self.headers.get('Range', ''))
+        if byte_range is not None:
+            start = int(byte_range.group(1))
+            end = min(int(byte_range.group(2)) if byte_range.group(2) else len(data) - 1, len(data) - 1)
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            status = 206
+            data = data[start:end + 1]
+        self.server.count(self.command, len(data) if self.command == 'GET' else 0)
+        self._send(status, headers, data)
+
+    def do_GET(self):
+        self._get()
+
+    def do_HEAD(self):
+        self._get()
+
+    def do_PUT(self):
+        self.server.delay()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            body = _decode_aws_chunked(body)
+        bucket, key = self._object_address()
+        s3_object = self.server.put_object(bucket, key, body)
+        self.server.count(self.command, len(body))
+        self._send(200, {'ETag': s3_object.etag})
+
+    def do_DELETE(self):
+        self.server.delay()
+        bucket, key = self._object_address()
+        self.server.delete_object(bucket, key)
+        self.server.count(self.command, 0)
+        self._send(204, {})
+
+
+class LocalS3Server(_StubServer):
+    """ Stand-in for S3, holding objects in memory. It serves GET (including byte ranges and `If-None-Match`), HEAD, PUT
+    and DELETE object requests, which is all exports and checkpoints need. Requests are delayed by `latency_sec`. """
+
+    def __init__(self, latency_sec=0.0, host='127.0.0.1', port=0):
+        super().__init__((host, port), _S3RequestHandler)
+        self.latency_sec = latency_sec
+        self.objects: Dict[Tuple[str, str], S3Object] = {}
+        self.request_counts: Dict[str, int] = {}
+        self.bytes_transferred = 0
+        self.lock = threading.Lock()
+
+    def delay(self):
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+
+    def count(self, method: str, size: int):
+        with self.lock:
+            self.request_counts[method] = self.request_counts.get(method, 0) + 1
+            self.bytes_transferred += size
+
+    def put_object(self, bucket: str, key: str, data: bytes) -> S3Object:
+        s3_object = S3Object(data, f'"{hashlib.md5(data).hexdigest()}"', formatdate(usegmt=True))
+        with self.lock:
+            self.objects[(bucket, key)] = s3_object
+        return s3_object
+
+    def get_object(self, bucket: str, key: str) -> Optional[S3Object]:
+        with self.lock:
+            return self.objects.get((bucket, key))
+
+    def delete_object(self, bucket: str, key: str):
+        with self.lock:
+            self.objects.pop((bucket, key), None)
@@ -1,8 +1,11 @@
-from typing import Union
-from queue import Queue
+import re
+from typing import Dict, List, Optional, Union
 
 AGGREGATED_TERMINATION_MARKER = None
 
+DEFAULT_MULTILINE_MAX_LINES = 1000
+DEFAULT_MULTILINE_MAX_SIZE = 256 * 1024
+
 
 class Aggregator:
 
@@ -20,66 +23,254 @@ class Aggregator:
     def has_complete_aggregated_line(self):
         raise NotImplementedError()
 
+    def add_lines(self, lines: List[str]) -> List[str]:
+        """ Adds a chunk of lines and returns the aggregated lines they complete """
+        complete_lines = []
+        for line in lines:
+            self.add_line(line)
+            if self.has_complete_aggregated_line():
+                complete_lines.append(self.get_complete_aggregated_line())
+        return complete_lines
+
+    def finish(self) -> List[str]:
+        """ Completes the aggregation and returns the last aggregated lines """
+        self.complete()
+        if self.has_complete_aggregated_line():
+            return [self.get_complete_aggregated_line()]
+        return []
+
 
 class NoopAggregator(Aggregator):
+    """ Lines are complete as soon as the next one is added """
 
     def __init__(self):
-        self.lines = Queue(maxsize=2)
+        self.pending_line = Aggregator._NO_AGGREGATED_LINE
+        self.complete_line = Aggregator._NO_AGGREGATED_LINE
 
     def add_line(self, line: Union[str, None]):
         if self.has_complete_aggregated_line():
             raise Exception('Complete aggregated lines must be retrieved first')
         if line is not None and line == '':
             return Aggregator._NO_AGGREGATED_LINE
-        self.lines.put(line)
+        self.complete_line = self.pending_line
+        self.pending_line = line
         return
 
     def get_complete_aggregated_line(self):
-        if self.has_complete_aggregated_line():
-            return self.lines.get()
-        return Aggregator._NO_AGGREGATED_LINE
+        line = self.complete_line
+        self.complete_line = Aggregator._NO_AGGREGATED_LINE
+        return line
 
     def has_complete_aggregated_line(self):
-        return self.lines.full()
+        return self.complete_line is not None
 
+    def add_lines(self, lines: List[str]) -> List[str]:
+        if self.has_complete_aggregated_line():
+            raise Exception('Complete aggregated lines must be retrieved first')
+        complete_lines = [line for line in lines if line != '']
+        if len(complete_lines) == 0:
+            return complete_lines
+        pending_line = self.pending_line
+        self.pending_line = complete_lines.pop()
+        if pending_line is not None:
+            complete_lines.insert(0, pending_line)
+        return complete_lines
 
-class JavaStackTraceAggregator(Aggregator):
-    """ Inspired from https://www.elastic.co/docs/reference/beats/filebeat/multiline-examples#_java_stack_traces """
 
-    def __init__(self):
-        self.lines = Queue(maxsize=2)
+class MultilinePattern:
+    """ Tells which lines continue the entry started by a previous line. A line continues an entry if it matches
+    `continuation`, if `start` is given and it does not match it, or if it matches `end` right after a continuation
+    line, e.g. the exception closing a Python traceback. When `opening` is given, `end` only applies once a line of the
+    entry matched it since the previous end, e.g. the header of a Python traceback. Patterns are matched at the start
+    of lines. """
 
-    def add_line(self, line):
-        if self.lines.full():
-            raise Exception('Aggregator queue is full')
-        if line is None:
-            current_line = line
+    def __init__(self, continuation: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                 opening: Optional[str] = None):
+        self.continuation = re.compile(continuation).match if continuation is not None else None
+        self.start = re.compile(start).match if start is not None else None
+        self.end = re.compile(end).match if end is not None else None
+        self.opening = re.compile(opening).match if opening is not None else None
+
+    def continues(self, line: str) -> bool:
+        if self.continuation is not None and self.continuation(line):
+            return True
+        return self.start is not None and not self.start(line)
+
+    def opens(self, line: str) -> bool:
+        return self.opening is not None and self.opening(line) is not None
+
+    def ends(self, line: str) -> bool:
+        return self.end is not None and self.end(line) is not None
+
+
+MULTILINE_PATTERNS: Dict[str, MultilinePattern] = {
+    # inspired from https://www.elastic.co/docs/reference/beats/filebeat/multiline-examples#_java_stack_traces
+    'java_stack_trace': MultilinePattern(continuation=r'\s*(?:at |Caused by: |\.\.\.)'),
+    'python_traceback': MultilinePattern(
+        continuation=r'(?:\s+\S|Traceback \(most recent call last\):|During handling of the above exception|'
+                     r'The above exception was the direct cause)',
+        end=r'[\w.]+(?::|$)', opening=r'Traceback \(most recent call last\):'),
+    'go_panic': MultilinePattern(
+        continuation=r'(?:\s+\S|goroutine \d+ \[|created by |exit status \d+|\[signal |'
+                     r'(?:[\w.-]+/)*[\w-]+\.[\w.*()\[\]-]+\([^)]*\)$)'),
+    'dotnet_exception': MultilinePattern(continuation=r'\s*(?:at |--- End of |---> )'),
+}
+
+
+class MultilineAggregator(Aggregator):
+    """ Aggregates the lines continuing an entry, as told by `patterns`, into a single entry. Lines of an entry are
+    accumulated in a list and joined once the entry is complete, so that aggregating an entry takes linear time.
+    Entries are split once they reach `max_lines` lines or `max_size` bytes once encoded in UTF-8, so that a runaway
+    trace neither holds an unbounded amount of memory nor exceeds the size of a batch. Entries are not split when
+    these are `None`. """
+
+    # lines have always been joined with an escaped new line
+    _LINE_SEPARATOR = '\\n'
+    _LINE_SEPARATOR_SIZE = len(_LINE_SEPARATOR)
+
+    def __init__(self, patterns: List[MultilinePattern], max_lines: Optional[int] = DEFAULT_MULTILINE_MAX_LINES,
+                 max_size: Optional[int] = DEFAULT_MULTILINE_MAX_SIZE):
+        self.patterns = patterns
+        self.max_lines = max_lines
+        self.max_size = max_size
+        self.entry_lines: List[str] = []
+        # size of the entry, in bytes
+        self.entry_size = 0
+        # whether the last line of the entry is a continuation line
+        self.continued = False
+        self.opening_patterns = [pattern for pattern in patterns if pattern.opening is not None]
+        # patterns opened by a line of the entry, whose end may then continue it
+        self.opened_patterns: List[MultilinePattern] = []
+        self.complete_line = Aggregator._NO_AGGREGATED_LINE
+
+    def _continues_entry(self, line: str) -> bool:
+        for pattern in self.patterns:
+            if pattern.continues(line):
+                self.continued = True
+                return True
+        if self.continued:
+            for pattern in self.patterns:
+                if pattern.ends(line) and (pattern.opening is None or pattern in self.opened_patterns):
+                    self.continued = False
+                    if pattern.opening is not None:
+                        self.opened_patterns.remove(pattern)
+                    return True
+        return False
+
+    def _open(self, line: str):
+        for pattern in self.opening_patterns:
+            if pattern.opens(line) and pattern not in self.opened_patterns:
+                self.opened_patterns.append(pattern)
+
+    def _fits(self, size: int) -> bool:
+        if self.max_lines is not None and len(self.entry_lines) >= self.max_lines:
+            return False
+        return self.max_size is None or \
+            self.entry_size + MultilineAggregator._LINE_SEPARATOR_SIZE + size <= self.max_size
+
+    def _complete_entry(self) -> Optional[str]:
+        if len(self.entry_lines) == 0:
+            return Aggregator._NO_AGGREGATED_LINE
+        entry = MultilineAggregator._LINE_SEPARATOR.join(self.entry_lines)
+        self.entry_lines = []
+        self.entry_size = 0
+        return entry
+
+    def _add(self, line: str) -> Optional[str]:
+        """ Adds a line and returns the entry it completes, if any """
+        # ASCII lines, by far the most common, are as long as their encoding
+        size = len(line) if line.isascii() else len(line.encode())
+        if len(self.entry_lines) > 0 and self._continues_entry(line):
+            if self._fits(size):
+                self.entry_lines.append(line)
+                self.entry_size += MultilineAggregator._LINE_SEPARATOR_SIZE + size
+                if self.opening_patterns:
+                    self._open(line)
+                return Aggregator._NO_AGGREGATED_LINE
+            # the entry is split, but the trace it is part of goes on
         else:
-            stripped_line = line.lstrip()
-            if stripped_line == '':
-                return
-            if (stripped_line.startswith('at ') or stripped_line.startswith('Caused by: ') or
-                    stripped_line.startswith('...')):
-                current_line = self.lines.get().rstrip('\n')
-                current_line += f'\\n{line}'
-            else:
-                current_line = line
-        self.lines.put(current_line)
-        return
+            self.continued = False
+            if self.opened_patterns:
+                self.opened_patterns = []
+        entry = self._complete_entry()
+        self.entry_lines.append(line)
+        self.entry_size = size
+        if self.opening_patterns:
+            self._open(line)
+        return entry
 
-    def get_complete_aggregated_line(self):
+    def add_line(self, line: Union[str, None]):
         if self.has_complete_aggregated_line():
-            return self.lines.get()
-        return Aggregator._NO_AGGREGATED_LINE
+            raise Exception('Complete aggregated lines must be retrieved first')
+        if line is None:
+            self.complete_line = self._complete_entry()
+        elif line != '' and not line.isspace():
+            self.complete_line = self._add(line)
+
+    def add_lines(self, lines: List[str]) -> List[str]:
+        if self.has_complete_aggregated_line():
+            raise Exception('Complete aggregated lines must be retrieved first')
+        complete_lines = []
+        add = self._add
+        for line in lines:
+            if line == '' or line.isspace():
+                continue
+            entry = add(line)
+            if entry is not None:
+                complete_lines.append(entry)
+        return complete_lines
+
+    def get_complete_aggregated_line(self):
+        line = self.complete_line
+        self.complete_line = Aggregator._NO_AGGREGATED_LINE
+        return line
 
     def has_complete_aggregated_line(self):
-        return self.lines.full()
+        return self.complete_line is not None
+
+
+class JavaStackTraceAggregator(MultilineAggregator):
+    """ Inspired from https://www.elastic.co/docs/reference/beats/filebeat/multiline-examples#_java_stack_traces. Stack
+    traces are only split when `max_lines` or `max_size` is given, as they were not split before these existed. """
+
+    def __init__(self, max_lines: Optional[int] = None, max_size: Optional[int] = None):
+        super().__init__([MULTILINE_PATTERNS['java_stack_trace']], max_lines, max_size)
 
 
 class AggregatorFactory:
 
     @staticmethod
-    def get_aggregator(aggregator_name) -> Aggregator:
+    def validate(aggregator_name, continuation_pattern: Optional[str] = None, start_pattern: Optional[str] = None):
+        """ Raises a `ValueError` if the `multiline` aggregator is not described by valid patterns, rather than
+        forwarding lines that should have been aggregated """
+        if aggregator_name != 'multiline':
+            return
+        if continuation_pattern is None and start_pattern is None:
+            raise ValueError('The multiline aggregator requires multiline_continuation_pattern and/or '
+                             'multiline_start_pattern to be set')
+        for variable, pattern in [('multiline_continuation_pattern', continuation_pattern),
+                                  ('multiline_start_pattern', start_pattern)]:
+            try:
+                if pattern is not None:
+                    re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f'Invalid {variable}. error={e}') from e
+
+    @staticmethod
+    def get_aggregator(aggregator_name, max_lines: Optional[int] = None, max_size: Optional[int] = None,
+                       continuation_pattern: Optional[str] = None, start_pattern: Optional[str] = None) -> Aggregator:
+        """ `aggregator_name` is either `default`, `multiline` for entries described by `continuation_pattern` and/or
+        `start_pattern`, or a comma separated list of names of `MULTILINE_PATTERNS`. Entries are split once they reach
+        `max_lines` lines or `max_size` bytes, which default to `DEFAULT_MULTILINE_MAX_LINES` and
+        `DEFAULT_MULTILINE_MAX_SIZE`, except for `java_stack_trace` whose entries are not split by default. """
         if aggregator_name == 'java_stack_trace':
-            return JavaStackTraceAggregator()
+            return JavaStackTraceAggregator(max_lines, max_size)
+        max_lines = DEFAULT_MULTILINE_MAX_LINES if max_lines is None else max_lines
+        max_size = DEFAULT_MULTILINE_MAX_SIZE if max_size is None else max_size
+        if aggregator_name == 'multiline':
+            AggregatorFactory.validate(aggregator_name, continuation_pattern, start_pattern)
+            return MultilineAggregator([MultilinePattern(continuation_pattern, start_pattern)], max_lines, max_size)
+        names = [name.strip() for name in aggregator_name.split(',')] if aggregator_name is not None else []
+        if len(names) > 0 and all(name in MULTILINE_PATTERNS for name in names):
+            return MultilineAggregator([MULTILINE_PATTERNS[name] for name in names], max_lines, max_size)
         return NoopAggregator()
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import namedtuple
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from clients import get_s3_client
+
+logger = logging.getLogger()
+
+# `line_offset` is the number of parsed lines of the object that were sent and acknowledged
+Checkpoint = namedtuple('Checkpoint', ['object_id', 'etag', 'line_offset'])
+
+
+def _checkpoint_name(object_id: str) -> str:
+    # object keys may be long or contain any character
+    return hashlib.sha256(object_id.encode()).hexdigest() + '.json'
+
+
+class CheckpointStore:
+    """ Durable storage of the export progress of objects, so that an export that could not complete within an
+    invocation resumes where it stopped on retry """
+
+    def load(self, object_id: str) -> Optional[Checkpoint]:
+        raise NotImplementedError()
+
+    def save(self, checkpoint: Checkpoint):
+        raise NotImplementedError()
+
+    def delete(self, object_id: str):
+        raise NotImplementedError()
+
+
+class LocalFileCheckpointStore(CheckpointStore):
+    """ Keeps checkpoints as files of a local directory """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, object_id: str):
+        return os.path.join(self.directory, _checkpoint_name(object_id))
+
+    def load(self, object_id: str) -> Optional[Checkpoint]:
+        try:
+            with open(self._path(object_id)) as f:
+                return Checkpoint(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self, checkpoint: Checkpoint):
+        # checkpoints are replaced atomically, so that a partly written one is never read
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as f:
+            json.dump(checkpoint._asdict(), f)
+        os.replace(f.name, self._path(checkpoint.object_id))
+
+    def delete(self, object_id: str):
+        try:
+            os.remove(self._path(object_id))
+        except FileNotFoundError:
+            pass
+
+
+class S3CheckpointStore(CheckpointStore):
+    """ Keeps checkpoints as S3 objects under `s3_uri`, i.e. `s3://<bucket>/<prefix>` """
+
+    def __init__(self, s3_uri):
+        bucket_name_and_prefix = s3_uri.replace('s3://', '').split('/', 1)
+        self.bucket_name = bucket_name_and_prefix[0]
+        self.prefix = bucket_name_and_prefix[1] if len(bucket_name_and_prefix) > 1 else ''
+        if self.prefix != '' and not self.prefix.endswith('/'):
+            self.prefix += '/'
+        self.client = get_s3_client()
+
+    def _key(self, object_id: str):
+        return self.prefix + _checkpoint_name(object_id)
+
+    def load(self, object_id: str) -> Optional[Checkpoint]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=self._key(object_id))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'NoSuchKey':
+                return None
+            raise e
+        return Checkpoint(**json.loads(response['Body'].read()))
+
+    def save(self, checkpoint: Checkpoint):
+        self.client.put_object(Bucket=self.bucket_name, Key=self._key(checkpoint.object_id),
+                               Body=json.dumps(checkpoint._asdict()).encode())
+
+    def delete(self, object_id: str):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self._key(object_id))
+
+
+class ObjectCheckpointer:
+    """ Records the export progress of a given version of an object """
+
+    def __init__(self, store: CheckpointStore, object_id: str, etag: str):
+        self.store = store
+        self.object_id = object_id
+        self.etag = etag
+
+    def get_line_offset(self) -> int:
+        """ Returns the number of parsed lines that were already exported """
+        checkpoint = self.store.load(self.object_id)
+        if checkpoint is None:
+            return 0
+        if checkpoint.etag != self.etag:
+            logger.info('Checkpoint of another object version found. Ignoring it. object_id=%s, etag=%s, '
+                        'checkpoint_etag=%s', self.object_id, self.etag, checkpoint.etag)
+            return 0
+        return checkpoint.line_offset
+
+    def acknowledge(self, line_offset: int):
+        self.store.save(Checkpoint(self.object_id, self.etag, line_offset))
+
+    def complete(self):
+        self.store.delete(self.object_id)
+
+
+class CheckpointStoreFactory:
+
+    @staticmethod
+    def get_checkpoint_store(checkpoint_s3_uri=None, checkpoint_directory=None) -> Optional[CheckpointStore]:
+        if checkpoint_s3_uri is not None:
+            return S3CheckpointStore(checkpoint_s3_uri)
+        if checkpoint_directory is not None:
+            return LocalFileCheckpointStore(checkpoint_directory)
+        return None
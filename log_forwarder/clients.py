@@ -1,60 +1,246 @@
+import http.client
+import os
+import threading
 import time
 
 import boto3
-import urllib.request
-import gzip
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+import urllib.error
 import logging
-from typing import Dict
+import zlib
+from typing import Dict, List, Optional
 import json
+from json.encoder import encode_basestring_ascii
+
+from compression import GZIP_WBITS, PayloadCompressor
+from connection import get_connection_pool
+from metrics import ExportMetrics, NoopExportMetrics
+from ranged_reader import RangedReader
+from record import StructuredRecord
+from retry import Deadline, RetryPolicy
 
 logger = logging.getLogger()
 
+DEFAULT_S3_MAX_POOL_CONNECTIONS = 32
+DEFAULT_S3_RETRY_MODE = 'standard'
+DEFAULT_S3_MAX_ATTEMPTS = 5
+DEFAULT_S3_DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_S3_DOWNLOAD_MAX_CONCURRENCY = 1
+
+_S3_CLIENT = None
+_S3_CLIENT_LOCK = threading.Lock()
+
+
+def get_s3_client():
+    """ Returns the boto3 S3 client shared by the whole process, so that it is created only once per container.
+    boto3 clients are thread safe, but creating them is not. """
+    global _S3_CLIENT
+    with _S3_CLIENT_LOCK:
+        if _S3_CLIENT is None:
+            boto_config = BotoConfig(
+                max_pool_connections=int(os.environ.get('s3_max_pool_connections', DEFAULT_S3_MAX_POOL_CONNECTIONS)),
+                retries={'mode': os.environ.get('s3_retry_mode', DEFAULT_S3_RETRY_MODE),
+                         'max_attempts': int(os.environ.get('s3_max_attempts', DEFAULT_S3_MAX_ATTEMPTS))},
+                tcp_keepalive=True)
+            _S3_CLIENT = boto3.client('s3', config=boto_config)
+        return _S3_CLIENT
+
 
 class S3Client:
 
-    def __init__(self, filepath):
-        self.client = boto3.client('s3')
-        self.filepath = filepath
+    def __init__(self):
+        self.client = get_s3_client()
+        self.part_size = int(os.environ.get('s3_download_part_size', DEFAULT_S3_DOWNLOAD_PART_SIZE))
+        self.max_concurrency = int(os.environ.get('s3_download_max_concurrency',
+                                                  DEFAULT_S3_DOWNLOAD_MAX_CONCURRENCY))
 
-    def download(self, bucket, object_key):
-        with open(self.filepath, 'wb') as f:
-            self.client.download_fileobj(bucket, object_key, f)
+    def download(self, bucket, object_key, filepath):
+        # objects larger than a part are downloaded with concurrent byte-range GETs
+        transfer_config = TransferConfig(multipart_threshold=self.part_size, multipart_chunksize=self.part_size,
+                                         max_concurrency=self.max_concurrency)
+        with open(filepath, 'wb') as f:
+            self.client.download_fileobj(bucket, object_key, f, Config=transfer_config)
+
+    def get_object_body(self, bucket, object_key):
+        if self.max_concurrency > 1:
+            metadata = self.client.head_object(Bucket=bucket, Key=object_key)
+            if metadata['ContentLength'] > self.part_size:
+                logger.info('Reading object with concurrent range requests. size=%s, part_size=%s, '
+                            'max_concurrency=%s', metadata['ContentLength'], self.part_size, self.max_concurrency)
+                return RangedReader(self.client, bucket, object_key, metadata['ContentLength'], metadata['ETag'],
+                                    self.part_size, self.max_concurrency)
+        response = self.client.get_object(Bucket=bucket, Key=object_key)
+        return response['Body']
 
 
 class Batch:
+    """ Lines of a batch are formatted and encoded as they are added, into a buffer holding the payload. Attributes
+    are serialized once per batch, so that the payload is built without holding more than one copy of it. The size of
+    a batch is the exact size of its payload, in bytes. """
 
-    def __init__(self, max_size: int, no_formatting=False):
-        self.batch = []
-        self.size = 0
+    _LINE_SEPARATOR = b'\n'
+
+    def __init__(self, max_size: int, no_formatting=False, attributes: Optional[Dict[str, str]] = None,
+                 payload_compressor: Optional[PayloadCompressor] = None):
+        self.buffer = bytearray()
         self.max_size = max_size
         self.no_formatting = no_formatting
+        self.attributes = {} if attributes is None else attributes
+        self.payload_compressor = PayloadCompressor() if payload_compressor is None else payload_compressor
+        # formatted lines end with the attributes. An attribute named `log` would replace the line though
+        self.attributes_suffix = None
+        if 'log' not in self.attributes:
+            self.attributes_suffix = '}' if len(self.attributes) == 0 else ', ' + json.dumps(self.attributes)[1:]
+
+    def _format_line(self, line: str) -> str:
+        if self.no_formatting:
+            return line
+        if self.attributes_suffix is None:
+            log_message = {'log': line}
+            log_message.update(self.attributes)
+            return json.dumps(log_message)
+        if isinstance(line, StructuredRecord):
+            # the record already is a JSON object
+            return '{"log": ' + line + self.attributes_suffix
+        return '{"log": ' + encode_basestring_ascii(line) + self.attributes_suffix
+
+    def _encode_line(self, line: str) -> bytes:
+        data = self._format_line(line).encode()
+        if self.get_batch_size() > 0:
+            return Batch._LINE_SEPARATOR + data
+        return data
+
+    def add(self, line) -> bool:
+        """ Adds `line` to the batch, unless its payload would then exceed `max_size`. Returns whether the line was
+        added. A line is always added to an empty batch, even if it exceeds `max_size` on its own. """
+        data = self._encode_line(line)
+        if len(self.buffer) > 0 and len(self.buffer) + len(data) > self.max_size:
+            return False
+        self.buffer += data
+        return True
 
-    def add(self, line):
-        self.batch.append(line)
-        self.size += len(line)
+    def add_lines(self, lines: List[str], start=0) -> int:
+        """ Adds `lines`, from index `start`, until the batch is full. Returns the index of the first line that was not
+        added, i.e. `len(lines)` if all of them were. At least one line is always added to an empty batch. """
+        buffer = self.buffer
+        max_size = self.max_size
+        format_line = self._format_line
+        for i in range(start, len(lines)):
+            data = format_line(lines[i]).encode()
+            if len(buffer) > 0:
+                if len(buffer) + len(Batch._LINE_SEPARATOR) + len(data) > max_size:
+                    return i
+                buffer += Batch._LINE_SEPARATOR
+            buffer += data
+        return len(lines)
+
+    def get_batch_size(self) -> int:
+        return len(self.buffer)
+
+    def get_formatted_data(self) -> bytearray:
+        """ Returns the payload of the batch, i.e. its lines formatted with the attributes, separated by new lines """
+        return self.buffer
+
+    def get_compressed_data(self) -> bytes:
+        return self.payload_compressor.compress(self.buffer)
+
+    def reset(self):
+        # the buffer is emptied rather than replaced, so that its memory gets reused by the next batch
+        self.buffer.clear()
+
+    def new_batch(self) -> 'Batch':
+        return Batch(self.max_size, self.no_formatting, self.attributes, self.payload_compressor)
+
+
+class CompressedBatch(Batch):
+    """ Batch compressed as lines are added, so that the size of its compressed payload can be bounded by
+    `max_compressed_size` as well. Only the compressed payload is kept.
+
+    The size of the compressed payload is only known exactly once the compressor is flushed, which degrades
+    compression. The compressor is hence only flushed when the worst case size of the payload with a new line would
+    exceed `max_compressed_size`. As the room left shrinks, flushes get more frequent, so batches get filled close to
+    `max_compressed_size` at the cost of a few flushes. Only the compression level of `payload_compressor` applies,
+    since lines are compressed one after the other as they are added. """
+
+    # upper bound of the size of a deflate block header, of the end of the deflate stream and of the gzip trailer
+    _STREAM_OVERHEAD = 32
+
+    def __init__(self, max_size: int, max_compressed_size: int, no_formatting=False,
+                 attributes: Optional[Dict[str, str]] = None, payload_compressor: Optional[PayloadCompressor] = None):
+        super().__init__(max_size, no_formatting, attributes, payload_compressor)
+        self.max_compressed_size = max_compressed_size
+        self.size = 0
+        self.compressed = bytearray()
+        self.compressor = zlib.compressobj(self.payload_compressor.level, zlib.DEFLATED, GZIP_WBITS)
+        # uncompressed bytes given to the compressor since it was last flushed
+        self.pending_size = 0
+
+    def _compressed_size_bound(self, size: int) -> int:
+        # see deflateBound() in zlib: stored blocks are used when data does not compress
+        pending_size = self.pending_size + size
+        return (len(self.compressed) + pending_size + (pending_size >> 12) + (pending_size >> 14) +
+                (pending_size >> 25) + CompressedBatch._STREAM_OVERHEAD)
+
+    def _fits(self, size: int) -> bool:
+        if self.size + size > self.max_size:
+            return False
+        if self._compressed_size_bound(size) <= self.max_compressed_size:
+            return True
+        self.compressed += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.pending_size = 0
+        return self._compressed_size_bound(size) <= self.max_compressed_size
+
+    def add(self, line) -> bool:
+        data = self._encode_line(line)
+        if self.size > 0 and not self._fits(len(data)):
+            return False
+        self.compressed += self.compressor.compress(data)
+        self.size += len(data)
+        self.pending_size += len(data)
+        return True
+
+    def add_lines(self, lines: List[str], start=0) -> int:
+        for i in range(start, len(lines)):
+            if not self.add(lines[i]):
+                return i
+        return len(lines)
 
     def get_batch_size(self) -> int:
         return self.size
 
-    def get_data(self) -> list[str]:
-        return self.batch
+    def get_compressed_size(self) -> int:
+        """ Returns the size of the compressed payload compressed so far, which is a lower bound of its final size """
+        return len(self.compressed)
 
-    def get_formatted_data(self, attributes: Dict[str, str]):
-        if self.no_formatting:
-            return '\n'.join([line for line in self.batch])
-        log_messages = [{'log': line} for line in self.batch]
-        for log_message in log_messages:
-            log_message.update(attributes)
-        return '\n'.join([json.dumps(log_message) for log_message in log_messages])
+    def get_formatted_data(self) -> bytes:
+        return zlib.decompress(self.get_compressed_data(), GZIP_WBITS)
+
+    def get_compressed_data(self) -> bytes:
+        # the stream is finished on a copy of the compressor, so that lines can still be added
+        return bytes(self.compressed + self.compressor.copy().flush())
 
     def reset(self):
-        self.batch = []
         self.size = 0
+        self.compressed.clear()
+        self.compressor = zlib.compressobj(self.payload_compressor.level, zlib.DEFLATED, GZIP_WBITS)
+        self.pending_size = 0
+
+    def __reduce__(self):
+        # compressors cannot be pickled: a batch is pickled as an empty batch with the same settings
+        return CompressedBatch, (self.max_size, self.max_compressed_size, self.no_formatting, self.attributes,
+                                 self.payload_compressor)
+
+    def new_batch(self) -> 'CompressedBatch':
+        return CompressedBatch(self.max_size, self.max_compressed_size, self.no_formatting, self.attributes,
+                               self.payload_compressor)
 
 
 class BrontoClient:
 
-    def __init__(self, api_key, ingestion_endpoint, dataset, collection, client_type, tags: Dict[str, str]):
+    def __init__(self, api_key, ingestion_endpoint, dataset, collection, client_type, tags: Dict[str, str],
+                 retry_policy: Optional[RetryPolicy] = None, deadline: Optional[Deadline] = None,
+                 metrics: Optional[ExportMetrics] = None):
         self.api_key = api_key
         self.dataset = dataset
         self.collection = collection
@@ -73,29 +259,59 @@ class BrontoClient:
             self.headers.update({'x-bronto-service-namespace': self.collection})
         if self.client_type is not None:
             self.headers.update({'x-bronto-client': self.client_type})
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.deadline = Deadline() if deadline is None else deadline
+        self.metrics = NoopExportMetrics() if metrics is None else metrics
 
     def _send_batch(self, compressed_batch):
-        request = urllib.request.Request(self.ingestion_endpoint, data=compressed_batch, headers=self.headers)
         attempt = 0
-        max_attempts = 5
-        with urllib.request.urlopen(request) as resp:
-            if resp.status != 200 and attempt < max_attempts:
-                attempt += 1
-                delay_sec = attempt * 10
-                logger.warning('Data sending failed. attempt=%s, max_attempts=%s, status=%s, reason=%s',
-                               attempt, max_attempts, resp.status, resp.reason)
-                time.sleep(delay_sec)
-                self._send_batch(compressed_batch)
-            elif resp.status == 200:
-                logger.info('data sent successfully. collection=%s, dataset=%s', self.collection,
-                            self.dataset)
+        while True:
+            attempt += 1
+            retry_after_sec = None
+            try:
+                resp = get_connection_pool(self.ingestion_endpoint).request('POST', compressed_batch, self.headers)
+            except (OSError, http.client.HTTPException) as e:
+                # e.g. connection refused or timed out
+                error = e
             else:
-                logger.error('max attempts reached. attempt=%s, max_attempts=%s', attempt, max_attempts)
-                raise Exception('BrontoClientMaxAttemptReached')
+                if 200 <= resp.status < 300:
+                    logger.info('data sent successfully. collection=%s, dataset=%s', self.collection,
+                                self.dataset)
+                    return
+                # error statuses raise, as they did with urllib.request.urlopen
+                error = urllib.error.HTTPError(self.ingestion_endpoint, resp.status, resp.reason, resp.headers, None)
+                if not self.retry_policy.is_retryable_status(resp.status):
+                    logger.error('Data sending failed. Status is not retryable. status=%s, reason=%s', resp.status,
+                                 resp.reason)
+                    raise error
+                retry_after_sec = RetryPolicy.parse_retry_after(resp.headers.get('Retry-After'))
+            if attempt >= self.retry_policy.max_attempts:
+                logger.error('max attempts reached. attempt=%s, max_attempts=%s, error=%s', attempt,
+                             self.retry_policy.max_attempts, error)
+                raise error
+            delay_sec = self.retry_policy.get_delay_sec(attempt, retry_after_sec)
+            remaining_sec = self.deadline.get_remaining_sec()
+            if delay_sec >= remaining_sec:
+                logger.error('Data sending failed. Not enough time left to retry. attempt=%s, delay_sec=%.3f, '
+                             'remaining_sec=%.3f, error=%s', attempt, delay_sec, remaining_sec, error)
+                raise error
+            logger.warning('Data sending failed. Retrying. attempt=%s, max_attempts=%s, delay_sec=%.3f, error=%s',
+                           attempt, self.retry_policy.max_attempts, delay_sec, error)
+            time.sleep(delay_sec)
 
-    def send_data(self, batch, attributes=None):
-        data = batch.get_formatted_data({} if attributes is None else attributes)
-        compressed_data = gzip.compress(data.encode())
+    def compress(self, batch: Batch) -> bytes:
+        with self.metrics.time('compress'):
+            compressed_data = batch.get_compressed_data()
         logger.info('Batch compressed. batch_size=%s, compressed_batch_size=%s',batch.get_batch_size(),
                     len(compressed_data))
-        self._send_batch(compressed_data)
+        self.metrics.count('raw_bytes', batch.get_batch_size())
+        return compressed_data
+
+    def send_compressed_data(self, compressed_data: bytes):
+        with self.metrics.time('send'):
+            self._send_batch(compressed_data)
+        self.metrics.count('batches')
+        self.metrics.count('compressed_bytes', len(compressed_data))
+
+    def send_data(self, batch: Batch):
+        self.send_compressed_data(self.compress(batch))
@@ -0,0 +1,69 @@
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+DEFAULT_COMPRESSION_LEVEL = 9
+# window bits producing a gzip member
+GZIP_WBITS = 31
+
+
+class PayloadCompressor:
+    """ Compresses payloads with gzip at `level`, from 1 (fastest) to 9 (smallest) """
+
+    def __init__(self, level=DEFAULT_COMPRESSION_LEVEL):
+        self.level = level
+
+    def compress(self, data) -> bytes:
+        return zlib.compress(data, self.level, GZIP_WBITS)
+
+
+class ParallelPayloadCompressor(PayloadCompressor):
+    """ Compresses payloads larger than `block_size` as blocks of `block_size` bytes, compressed concurrently by
+    `executor` and concatenated into a multi-member gzip stream, which decompresses to the whole payload. zlib releases
+    the GIL while compressing, so blocks get compressed on as many cores as there are threads. Each block is compressed
+    without the history of the previous one, so payloads get slightly larger. """
+
+    def __init__(self, level, block_size: int, executor: ThreadPoolExecutor):
+        super().__init__(level)
+        self.block_size = block_size
+        self.executor = executor
+
+    def _compress_block(self, block) -> bytes:
+        return zlib.compress(block, self.level, GZIP_WBITS)
+
+    def compress(self, data) -> bytes:
+        if len(data) <= self.block_size:
+            return self._compress_block(data)
+        view = memoryview(data)
+        blocks = [view[start:start + self.block_size] for start in range(0, len(view), self.block_size)]
+        return b''.join(self.executor.map(self._compress_block, blocks))
+
+    def __reduce__(self):
+        # executors cannot be pickled: the compressor is pickled as a sequential one with the same level
+        return PayloadCompressor, (self.level,)
+
+
+_COMPRESSION_EXECUTORS: Dict[int, ThreadPoolExecutor] = {}
+_COMPRESSION_EXECUTORS_LOCK = threading.Lock()
+
+
+def get_compression_executor(max_threads: int) -> ThreadPoolExecutor:
+    """ Returns the executor compressing blocks with `max_threads` threads, kept across invocations and shared by all
+    the exports of an invocation """
+    with _COMPRESSION_EXECUTORS_LOCK:
+        executor = _COMPRESSION_EXECUTORS.get(max_threads)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='compression')
+            _COMPRESSION_EXECUTORS[max_threads] = executor
+        return executor
+
+
+class PayloadCompressorFactory:
+
+    @staticmethod
+    def get_payload_compressor(level=DEFAULT_COMPRESSION_LEVEL, block_size: Optional[int] = None,
+                               max_threads: Optional[int] = None) -> PayloadCompressor:
+        if block_size is None or max_threads is None or max_threads <= 1:
+            return PayloadCompressor(level)
+        return ParallelPayloadCompressor(level, block_size, get_compression_executor(max_threads))
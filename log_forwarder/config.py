@@ -2,8 +2,19 @@ import json
 import base64
 import os
 import logging
+import random
+import threading
+import time
 from typing import List, Dict
-import boto3
+from botocore.exceptions import ClientError
+
+from aggregator import AggregatorFactory
+from clients import get_s3_client
+from compression import DEFAULT_COMPRESSION_LEVEL, PayloadCompressor, PayloadCompressorFactory
+from metrics import DEFAULT_METRICS_NAMESPACE, InvocationMetrics, NoopInvocationMetrics
+from profiling import DEFAULT_PROFILING_DIRECTORY, PROFILE_EVENT_KEY
+from retry import Deadline, RetryPolicy
+from router import PathRouter
 
 logger = logging.getLogger()
 
@@ -21,6 +32,9 @@ CLOUDWATCH_LOG_TYPE = 'cloudwatch_log'
 
 class Config:
 
+    DEFAULT_MAX_CONCURRENCY = 1
+    DEFAULT_CHECKPOINT_MIN_REMAINING_SEC = 30
+
     @staticmethod
     def _extract_kvps(property_value: str) -> Dict[str, str]:
         result = {}
@@ -34,15 +48,48 @@ class Config:
         return result
 
 
-    def __init__(self, event, filepath):
+    def __init__(self, event, filepath=None, context=None):
         self.filepath = filepath
         self.event = event
+        # the Lambda context, if any, tells how much time the invocation has left
+        self.deadline = Deadline.from_lambda_context(context)
         self.path_regexes = os.environ.get('path_regexes')
         self.aggregator = os.environ.get('aggregator', 'default')
+        # entries are split with the defaults of the aggregator when these are not set
+        multiline_max_lines = os.environ.get('multiline_max_lines')
+        self.multiline_max_lines = int(multiline_max_lines) if multiline_max_lines else None
+        multiline_max_size = os.environ.get('multiline_max_size')
+        self.multiline_max_size = int(multiline_max_size) if multiline_max_size else None
+        self.multiline_continuation_pattern = os.environ.get('multiline_continuation_pattern')
+        self.multiline_start_pattern = os.environ.get('multiline_start_pattern')
+        AggregatorFactory.validate(self.aggregator, self.multiline_continuation_pattern, self.multiline_start_pattern)
         raw_tags = os.environ.get('tags')
         self.tags = Config._extract_kvps(raw_tags)
         raw_attributes = os.environ.get('attributes')
         self.resource_attributes = Config._extract_kvps(raw_attributes)
+        self.streaming = os.environ.get('streaming', 'false').lower() == 'true'
+        self.structured_records = os.environ.get('structured_records', 'false').lower() == 'true'
+        self.gzip_passthrough = os.environ.get('gzip_passthrough', 'false').lower() == 'true'
+        self.max_concurrency = int(os.environ.get('max_concurrency', Config.DEFAULT_MAX_CONCURRENCY))
+        self.checkpoint_s3_uri = os.environ.get('checkpoint_s3_uri')
+        self.checkpoint_directory = os.environ.get('checkpoint_directory')
+        self.checkpoint_min_remaining_sec = float(os.environ.get('checkpoint_min_remaining_sec',
+                                                                 Config.DEFAULT_CHECKPOINT_MIN_REMAINING_SEC))
+        self.parsing_processes = int(os.environ.get('parsing_processes', 1))
+        self.profiling_rate = float(os.environ.get('profiling_rate', 0))
+        self.profiling_s3_uri = os.environ.get('profiling_s3_uri')
+        self.profiling_directory = os.environ.get('profiling_directory', DEFAULT_PROFILING_DIRECTORY)
+        # invocations are profiled when their event asks for it, or when sampled
+        self.profiling = (isinstance(event, dict) and event.get(PROFILE_EVENT_KEY) is True) \
+            or (self.profiling_rate > 0 and random.random() < self.profiling_rate)
+        self.emit_metrics = os.environ.get('emit_metrics', 'false').lower() == 'true'
+        self.metrics_namespace = os.environ.get('metrics_namespace', DEFAULT_METRICS_NAMESPACE)
+        # metrics of the exports of the invocation, emitted once it is done. Profiled invocations record them as well,
+        # along with the peak memory of each stage.
+        if self.emit_metrics or self.profiling:
+            self.invocation_metrics = InvocationMetrics(self.metrics_namespace, track_memory=self.profiling)
+        else:
+            self.invocation_metrics = NoopInvocationMetrics()
 
     def get_resource_attributes(self):
         return self.resource_attributes
@@ -56,7 +103,9 @@ class DestinationConfig:
     ONE_MB = 1000000
 
     @staticmethod
-    def _get_json_config_from_s3(s3_uri, s3_client):
+    def _get_json_config_from_s3(s3_uri, s3_client, etag=None):
+        """ Returns the configuration stored at `s3_uri` along with its ETag. When `etag` is provided, the
+        configuration is only downloaded if it changed and None is returned otherwise. """
         bucket_name_and_path = s3_uri.replace('s3://', '').split('/')
         if len(bucket_name_and_path) < 2:
             raise Exception('Config S3 URI is malformed. Bucket name or path missing. s3_uri=%s', s3_uri)
@@ -65,22 +114,50 @@ class DestinationConfig:
         logger.info('Retrieving configuration from S3. config_s3_uri=%s, bucket_name=%s, s3_key=%s',
                     s3_uri, bucket_name, s3_key)
         try:
-            response = s3_client.get_object(
-                Bucket=bucket_name,
-                Key=s3_key,
-            )
-            return json.loads(response['Body'].read())
+            if etag is not None:
+                response = s3_client.get_object(Bucket=bucket_name, Key=s3_key, IfNoneMatch=etag)
+            else:
+                response = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+            return json.loads(response['Body'].read()), response.get('ETag')
+        except ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+                logger.info('Configuration not modified. config_s3_uri=%s, etag=%s', s3_uri, etag)
+                return None, etag
+            logger.error('Cannot get destination config from S3. bucket_name=%s, s3_key=%s',
+                         bucket_name, s3_key)
+            raise e
         except Exception as e:
             logger.error('Cannot get destination config from S3. bucket_name=%s, s3_key=%s',
                          bucket_name, s3_key)
             raise e
 
+    @staticmethod
+    def _get_json_config_from_s3_or_previous(s3_uri, previous_value, previous_etag):
+        s3_client = get_s3_client()
+        value, etag = DestinationConfig._get_json_config_from_s3(s3_uri, s3_client, previous_etag)
+        if value is None:
+            return previous_value, etag
+        return value, etag
 
-    def __init__(self):
+    def __init__(self, previous: 'DestinationConfig' = None):
+        """ `previous` is the configuration this one replaces, if any. Configuration stored in S3 that did not change
+        since it was loaded into `previous` is reused rather than downloaded again. """
         self.bronto_api_key = os.environ.get('bronto_api_key')
         self.bronto_endpoint = os.environ.get('bronto_endpoint')
         self.max_batch_size = int(os.environ.get('max_batch_size', DestinationConfig.ONE_MB))
+        max_compressed_batch_size = os.environ.get('max_compressed_batch_size')
+        self.max_compressed_batch_size = int(max_compressed_batch_size) if max_compressed_batch_size else None
+        self.max_in_flight_batches = int(os.environ.get('max_in_flight_batches', 1))
+        self.compression_level = int(os.environ.get('compression_level', DEFAULT_COMPRESSION_LEVEL))
+        compression_block_size = os.environ.get('compression_block_size')
+        self.compression_block_size = int(compression_block_size) if compression_block_size else None
+        self.compression_threads = int(os.environ.get('compression_threads', os.cpu_count() or 1))
+        self.send_max_attempts = int(os.environ.get('send_max_attempts', RetryPolicy.DEFAULT_MAX_ATTEMPTS))
+        self.send_max_retry_delay_sec = float(os.environ.get('send_max_retry_delay_sec',
+                                                             RetryPolicy.DEFAULT_MAX_DELAY_SEC))
         self.cloudwatch_default_collection = os.environ.get('cloudwatch_default_collection')
+        self.destination_config_etag = None
+        self.paths_regex_etag = None
         b64_destination_config = os.environ.get('destination_config')
         if b64_destination_config is not None:
             try:
@@ -92,9 +169,13 @@ class DestinationConfig:
             self.destination_config = None
             self.config_s3_uri = os.environ.get('CONFIG_S3_URI')
             if self.config_s3_uri is not None:
-                s3_client = boto3.client('s3')
-                self.destination_config = DestinationConfig._get_json_config_from_s3(self.config_s3_uri, s3_client)
+                reusable = previous is not None and getattr(previous, 'config_s3_uri', None) == self.config_s3_uri
+                self.destination_config, self.destination_config_etag = \
+                    DestinationConfig._get_json_config_from_s3_or_previous(
+                        self.config_s3_uri, previous.destination_config if reusable else None,
+                        previous.destination_config_etag if reusable else None)
         self.paths_regex = []
+        self.path_router = None
         b64_paths_regex_config = os.environ.get('paths_regex')
         if b64_paths_regex_config is not None:
             try:
@@ -105,8 +186,11 @@ class DestinationConfig:
         else:
             self.config_paths_regex_s3_uri = os.environ.get('CONFIG_PATHS_REGEX_S3_URI')
             if self.config_paths_regex_s3_uri is not None:
-                s3_client = boto3.client('s3')
-                self.paths_regex = DestinationConfig._get_json_config_from_s3(self.config_paths_regex_s3_uri, s3_client)
+                reusable = (previous is not None and
+                            getattr(previous, 'config_paths_regex_s3_uri', None) == self.config_paths_regex_s3_uri)
+                self.paths_regex, self.paths_regex_etag = DestinationConfig._get_json_config_from_s3_or_previous(
+                    self.config_paths_regex_s3_uri, previous.paths_regex if reusable else None,
+                    previous.paths_regex_etag if reusable else None)
         logger.info('Path regexes collected. paths_regex=%s', self.paths_regex)
 
     def _get_attribute_value(self, key, attribute_name):
@@ -138,3 +222,67 @@ class DestinationConfig:
 
     def get_paths_regex(self):
         return self.paths_regex
+
+    def get_retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(self.send_max_attempts, max_delay_sec=self.send_max_retry_delay_sec)
+
+    def get_payload_compressor(self) -> PayloadCompressor:
+        return PayloadCompressorFactory.get_payload_compressor(self.compression_level, self.compression_block_size,
+                                                               self.compression_threads)
+
+    def get_path_router(self) -> PathRouter:
+        # the router is built once per configuration load, or whenever paths_regex gets replaced
+        if self.path_router is None or self.path_router.paths_regex is not self.paths_regex:
+            self.path_router = PathRouter(self.paths_regex)
+        return self.path_router
+
+
+class DestinationConfigCache:
+    """ Keeps the destination configuration across warm invocations for `config_cache_ttl_sec` seconds. Once expired,
+    the cached configuration keeps being served while a fresh one is loaded in the background. Configuration stored in
+    S3 is then only downloaded again if it changed. """
+
+    DEFAULT_TTL_SEC = 300
+
+    def __init__(self):
+        self.config = None
+        self.expires_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def _store(self, config: DestinationConfig, ttl_sec):
+        with self.lock:
+            self.config = config
+            self.expires_at = time.monotonic() + ttl_sec
+
+    def _refresh(self, previous: DestinationConfig, ttl_sec):
+        try:
+            self._store(DestinationConfig(previous), ttl_sec)
+            logger.info('Destination config refreshed.')
+        except Exception as e:
+            logger.error('Cannot refresh destination config. Keeping the current one. error=%s', e)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def get(self) -> DestinationConfig:
+        ttl_sec = int(os.environ.get('config_cache_ttl_sec', DestinationConfigCache.DEFAULT_TTL_SEC))
+        if ttl_sec <= 0:
+            return DestinationConfig()
+        with self.lock:
+            config = self.config
+            if config is None or time.monotonic() < self.expires_at or self.refreshing:
+                expired = False
+            else:
+                expired = True
+                self.refreshing = True
+        if config is None:
+            config = DestinationConfig()
+            self._store(config, ttl_sec)
+        elif expired:
+            logger.info('Destination config expired. Refreshing it in the background.')
+            threading.Thread(target=self._refresh, args=(config, ttl_sec), daemon=True).start()
+        return config
+
+
+DESTINATION_CONFIG_CACHE = DestinationConfigCache()
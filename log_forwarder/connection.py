@@ -0,0 +1,231 @@
+import base64
+import http.client
+import logging
+import select
+import socket
+import ssl
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import SplitResult, unquote, urlsplit
+
+logger = logging.getLogger()
+
+Response = namedtuple('Response', ['status', 'reason', 'headers', 'body'])
+
+
+class DnsCache:
+    """ Caches host name resolutions, so that opening a new connection does not always require a DNS lookup. All the
+    addresses of a host are kept, so that connections fall back to the next one when an address is unreachable. """
+
+    def __init__(self, ttl_sec):
+        self.ttl_sec = ttl_sec
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port) -> List[Tuple[int, Tuple]]:
+        """ Returns the addresses of `host` as (address family, socket address) pairs, the ones that last failed to
+        accept a connection last """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((host, port))
+            if entry is not None and entry[1] > now:
+                return entry[0]
+        address_info = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        # the same address may be listed for several protocols
+        addresses = list(dict.fromkeys((family, address) for family, _, _, _, address in address_info))
+        with self.lock:
+            self.entries[(host, port)] = (addresses, now + self.ttl_sec)
+        return addresses
+
+    def demote(self, host, port, address: Tuple[int, Tuple]):
+        """ Moves `address` after the other addresses of `host`, so that they are tried first """
+        with self.lock:
+            entry = self.entries.get((host, port))
+            if entry is not None and address in entry[0]:
+                addresses = [other for other in entry[0] if other != address] + [address]
+                self.entries[(host, port)] = (addresses, entry[1])
+
+    def invalidate(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+    def connect(self, host, port, timeout) -> socket.socket:
+        """ Connects to the first address of `host` accepting the connection """
+        error = None
+        for address in self.resolve(host, port):
+            family, socket_address = address
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(socket_address)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
+            except OSError as e:
+                sock.close()
+                logger.info('Connection failed. Trying the next address. host=%s, address=%s, error=%s', host,
+                            socket_address[0], e)
+                self.demote(host, port, address)
+                error = e
+        # none of the cached addresses may be valid anymore
+        self.invalidate(host, port)
+        if error is None:
+            raise OSError(f'No address found for host {host}')
+        raise error
+
+
+class _DnsCachedHTTPConnection(http.client.HTTPConnection):
+    """ HTTP connection opened to the addresses cached by `dns_cache` """
+
+    def __init__(self, host, port, timeout, dns_cache: DnsCache):
+        super().__init__(host, port, timeout=timeout)
+        self.dns_cache = dns_cache
+
+    def connect(self):
+        self.sock = self.dns_cache.connect(self.host, self.port, self.timeout)
+        if self._tunnel_host:
+            self._tunnel()
+
+
+class _DnsCachedHTTPSConnection(http.client.HTTPSConnection):
+    """ HTTPS connection opened to the addresses cached by `dns_cache`. TLS server name indication and certificate
+    verification still rely on the host name, i.e. that of the tunnel when connecting through a proxy. """
+
+    def __init__(self, host, port, timeout, dns_cache: DnsCache):
+        self.ssl_context = ssl.create_default_context()
+        super().__init__(host, port, timeout=timeout, context=self.ssl_context)
+        self.dns_cache = dns_cache
+
+    def connect(self):
+        sock = self.dns_cache.connect(self.host, self.port, self.timeout)
+        try:
+            if self._tunnel_host:
+                self.sock = sock
+                self._tunnel()
+            self.sock = self.ssl_context.wrap_socket(sock, server_hostname=self._tunnel_host or self.host)
+        except Exception:
+            sock.close()
+            raise
+
+
+def get_proxy(scheme, host) -> Optional[SplitResult]:
+    """ Returns the URL of the proxy requests to `host` go through, if any, as told by the `HTTPS_PROXY`, `HTTP_PROXY`
+    and `NO_PROXY` environment variables, as urllib does """
+    proxy = urllib.request.getproxies().get(scheme)
+    if proxy is None or urllib.request.proxy_bypass(host):
+        return None
+    return urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+
+class ConnectionPool:
+    """ Pool of HTTP/1.1 keep-alive connections to a single endpoint. Connections are reused across requests and
+    stale ones (i.e. closed by the server while idle) are detected and replaced before requests are sent. Requests
+    failing once sent are not sent again, since the server may have processed them: retrying them is up to the caller.
+    Connections go through the proxy set in the environment, if any, by tunnelling HTTPS connections. """
+
+    DEFAULT_MAX_IDLE_CONNECTIONS = 10
+    DEFAULT_TIMEOUT_SEC = 60
+    # idle connections are commonly closed by servers and load balancers after 60 seconds
+    DEFAULT_MAX_IDLE_TIME_SEC = 50
+
+    def __init__(self, endpoint, dns_cache: DnsCache, max_idle_connections=DEFAULT_MAX_IDLE_CONNECTIONS,
+                 timeout_sec=DEFAULT_TIMEOUT_SEC, max_idle_time_sec=DEFAULT_MAX_IDLE_TIME_SEC):
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port if url.port is not None else (443 if self.scheme == 'https' else 80)
+        self.path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+        self.proxy = get_proxy(self.scheme, self.host)
+        self.proxy_headers = {}
+        if self.proxy is not None:
+            logger.info('Connecting through proxy. host=%s, proxy_host=%s, proxy_port=%s', self.host,
+                        self.proxy.hostname, self.proxy.port)
+            if self.proxy.username is not None:
+                credentials = f'{unquote(self.proxy.username)}:{unquote(self.proxy.password or "")}'
+                self.proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+            if self.scheme == 'http':
+                # plain HTTP requests are forwarded by the proxy, which they tell the URL of
+                self.path = endpoint
+        self.dns_cache = dns_cache
+        self.max_idle_connections = max_idle_connections
+        self.timeout_sec = timeout_sec
+        self.max_idle_time_sec = max_idle_time_sec
+        self.idle_connections = []
+        self.lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.proxy is None:
+            host, port = self.host, self.port
+        else:
+            host, port = self.proxy.hostname, self.proxy.port if self.proxy.port is not None else 80
+        if self.scheme == 'https':
+            connection = _DnsCachedHTTPSConnection(host, port, self.timeout_sec, self.dns_cache)
+            if self.proxy is not None:
+                connection.set_tunnel(self.host, self.port, self.proxy_headers)
+            return connection
+        return _DnsCachedHTTPConnection(host, port, self.timeout_sec, self.dns_cache)
+
+    @staticmethod
+    def _is_stale(connection: http.client.HTTPConnection):
+        if connection.sock is None:
+            return True
+        # an idle connection should have nothing to read. If it has, the server closed it or sent unexpected data
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        return len(readable) > 0
+
+    def _get_connection(self):
+        now = time.monotonic()
+        with self.lock:
+            while len(self.idle_connections) > 0:
+                connection, released_at = self.idle_connections.pop()
+                if now - released_at < self.max_idle_time_sec and not ConnectionPool._is_stale(connection):
+                    return connection
+                connection.close()
+        return self._new_connection()
+
+    def _release_connection(self, connection: http.client.HTTPConnection):
+        with self.lock:
+            if len(self.idle_connections) < self.max_idle_connections:
+                self.idle_connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def request(self, method, body, headers: Dict[str, str]) -> Response:
+        connection = self._get_connection()
+        if self.proxy_headers and self.scheme == 'http':
+            headers = dict(headers, **self.proxy_headers)
+        try:
+            connection.request(method, self.path, body=body, headers=headers)
+            resp = connection.getresponse()
+            response = Response(resp.status, resp.reason, resp.headers, resp.read())
+        except Exception:
+            connection.close()
+            raise
+        if resp.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+        return response
+
+    def close(self):
+        with self.lock:
+            for connection, _ in self.idle_connections:
+                connection.close()
+            self.idle_connections = []
+
+
+# pools are kept at module level, so that connections are reused across batches, data retrievers and warm invocations
+_DNS_CACHE = DnsCache(ttl_sec=60)
+_CONNECTION_POOLS: Dict[str, ConnectionPool] = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(endpoint) -> ConnectionPool:
+    with _CONNECTION_POOLS_LOCK:
+        pool = _CONNECTION_POOLS.get(endpoint)
+        if pool is None:
+            pool = ConnectionPool(endpoint, _DNS_CACHE)
+            _CONNECTION_POOLS[endpoint] = pool
+        return pool
@@ -3,7 +3,7 @@ import json
 import os
 import base64
 import logging
-import re
+from typing import Optional, Tuple
 
 from config import Config, DestinationConfig
 from clients import S3Client
@@ -13,6 +13,11 @@ logger = logging.getLogger()
 
 class DataRetriever:
 
+    filepath = None
+
+    def set_filepath(self, filepath):
+        self.filepath = filepath
+
     def get_name(self):
         raise NotImplementedError()
 
@@ -25,16 +30,32 @@ class DataRetriever:
     def get_data_id(self):
         raise NotImplementedError()
 
+    def get_stream(self):
+        return None
+
     def get_log_attributes_from_payload(self):
         return {}
 
+    def get_object_version(self) -> Optional[Tuple[str, str]]:
+        """ Returns the identifier and ETag of the object data is retrieved from, if any. Exports of objects can be
+        checkpointed. """
+        return None
+
+    def close(self):
+        """ Releases the stream of the data, if any, whether it was read or not """
+        pass
+
 
 class S3DataRetriever(DataRetriever):
 
-    def __init__(self, config: Config, bucket_name, s3_key):
+    def __init__(self, config: Config, bucket_name, s3_key, etag=None):
         self.src_bucket_name = bucket_name
         self.src_key = s3_key
-        self.s3_client = S3Client(config.filepath)
+        self.etag = etag
+        self.filepath = config.filepath
+        self.s3_client = S3Client()
+        self.streaming = config.streaming
+        self.stream = None
         logger.debug('type=%s, bucket=%s, s3_key=%s', self.__class__, self.src_bucket_name, self.src_key)
 
     def get_collection_type(self):
@@ -44,16 +65,31 @@ class S3DataRetriever(DataRetriever):
         raise NotImplementedError()
 
     def get_data(self):
-        self.s3_client.download(self.src_bucket_name, self.src_key)
+        if self.streaming:
+            self.stream = self.s3_client.get_object_body(self.src_bucket_name, self.src_key)
+            return
+        self.s3_client.download(self.src_bucket_name, self.src_key, self.filepath)
 
     def get_data_id(self):
         raise NotImplementedError()
 
+    def get_stream(self):
+        return self.stream
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+    def get_object_version(self) -> Optional[Tuple[str, str]]:
+        if self.etag is None:
+            return None
+        return f's3://{self.src_bucket_name}/{self.src_key}', self.etag
+
 
 class CustomS3Retriever(S3DataRetriever):
 
-    def __init__(self, data_id, config: Config, bucket_name, s3_key):
-        super().__init__(config, bucket_name, s3_key)
+    def __init__(self, data_id, config: Config, bucket_name, s3_key, etag=None):
+        super().__init__(config, bucket_name, s3_key, etag)
         self.data_id = data_id
 
     def get_name(self):
@@ -127,6 +163,7 @@ class CloudwatchDataRetriever(DataRetriever):
 
     def __init__(self, config: Config):
         self.config = config
+        self.filepath = config.filepath
         self.log_group_name = None
         self.log_stream = None
 
@@ -134,7 +171,7 @@ class CloudwatchDataRetriever(DataRetriever):
         data = json.loads(gzip.decompress(base64.b64decode(self.config.event['awslogs']['data'])).decode())
         self.log_group_name = data['logGroup']
         self.log_stream = data['logStream']
-        with open(self.config.filepath, 'wb') as f:
+        with open(self.filepath, 'wb') as f:
             for i in range(0, len(data['logEvents'])):
                 line = data['logEvents'][i]['message'] + ('\n' if i < len(data['logEvents']) - 1 else '')
                 f.write(line.encode())
@@ -156,31 +193,27 @@ class DataRetrieverFactory:
                 filename = os.path.basename(record['s3']['object']['key'])
                 bucket_name = record['s3']['bucket']['name']
                 s3_key = record['s3']['object']['key']
+                # S3 notifications and EventBridge events do not name it the same way
+                etag = record['s3']['object'].get('eTag', record['s3']['object'].get('etag'))
                 logger.info('Log data is in S3. bucket_name=%s, s3_key=%s', bucket_name, s3_key)
                 if 'CloudTrail' in s3_key:
-                    data_retrievers.append(CloudtrailLogsRetriever(config, bucket_name, s3_key))
+                    data_retrievers.append(CloudtrailLogsRetriever(config, bucket_name, s3_key, etag))
                 elif 'elasticloadbalancing' in s3_key:
-                    data_retrievers.append(LBAccessLogsRetriever(config, bucket_name, s3_key))
-                elif 'vpcflowlogs' in config.event['Records'][0]['s3']['object']['key']:
-                    data_retrievers.append(VPCFlowLogsRetriever(config, bucket_name, s3_key))
-                elif 'bedrock' in config.event['Records'][0]['s3']['object']['key']:
-                    data_retrievers.append(BedrockS3Retriever(config, bucket_name, s3_key))
+                    data_retrievers.append(LBAccessLogsRetriever(config, bucket_name, s3_key, etag))
+                elif 'vpcflowlogs' in s3_key:
+                    data_retrievers.append(VPCFlowLogsRetriever(config, bucket_name, s3_key, etag))
+                elif 'bedrock' in s3_key:
+                    data_retrievers.append(BedrockS3Retriever(config, bucket_name, s3_key, etag))
                 elif (filename.split('.')[0] in dest_config.get_keys() and
                         dest_config.get_log_type(filename.split('.')[0]) == 'cf_standard_access_log'):
-                    data_retrievers.append(CloudfrontLogsRetriever(config, bucket_name, s3_key))
+                    data_retrievers.append(CloudfrontLogsRetriever(config, bucket_name, s3_key, etag))
                 else:
-                    retriever_found = False
-                    for path_regex_config in dest_config.get_paths_regex():
-                        path_regex = path_regex_config.get('pattern')
-                        pattern = re.compile(path_regex)
-                        matches = pattern.match(s3_key)
-                        if matches is not None:
-                            dest_config_id = matches.group('dest_config_id')
-                            data_retrievers.append(CustomS3Retriever(dest_config_id, config, bucket_name, s3_key))
-                            retriever_found = True
-                            break
-                    if not retriever_found:
-                        data_retrievers.append(S3AccessLogsRetriever(config, bucket_name, s3_key))
+                    route = dest_config.get_path_router().route(s3_key)
+                    if route is not None:
+                        _, dest_config_id = route
+                        data_retrievers.append(CustomS3Retriever(dest_config_id, config, bucket_name, s3_key, etag))
+                    else:
+                        data_retrievers.append(S3AccessLogsRetriever(config, bucket_name, s3_key, etag))
         if 'awslogs' in config.event:
             data_retrievers.append(CloudwatchDataRetriever(config))
         return data_retrievers
@@ -1,2 +1,7 @@
 class LogTypeMissingException(Exception):
     pass
+
+
+class ExportInterruptedException(Exception):
+    """ Raised when an export stops before its end, e.g. for lack of time, after recording its progress """
+    pass
@@ -1,32 +1,215 @@
-from typing import Dict, List
+import logging
+import threading
+from itertools import islice
+from queue import Queue
+from typing import Dict, List, Optional
 from aggregator import Aggregator
+from checkpoint import ObjectCheckpointer
 from clients import BrontoClient, Batch
+from exceptions import ExportInterruptedException
+from metrics import ExportMetrics, NoopExportMetrics
 from parser import Parser
+from retry import Deadline
+
+logger = logging.getLogger()
+
+_END_OF_BATCHES = None
 
 
 class BrontoExporter:
+    """ Exports the parsed lines of an object in batches. When a `checkpointer` is given, the number of parsed lines
+    covered by acknowledged batches is recorded after each batch, so that the export of the object resumes from there
+    if it is retried. The export then also stops once less than `min_remaining_sec` seconds are left before the
+    `deadline`. Parsing, aggregation and formatting are timed by `metrics`. """
 
     def __init__(self, client: BrontoClient, parser: Parser, batch: Batch, aggregator: Aggregator,
-                 attributes: Dict[str, str]):
+                 checkpointer: Optional[ObjectCheckpointer] = None, deadline: Optional[Deadline] = None,
+                 min_remaining_sec: float = 0, metrics: Optional[ExportMetrics] = None):
         self.client = client
         self.parser = parser
         self.batch = batch
         self.aggregator = aggregator
-        self.attributes = attributes
+        self.checkpointer = checkpointer
+        self.deadline = Deadline() if deadline is None else deadline
+        self.min_remaining_sec = min_remaining_sec
+        self.metrics = NoopExportMetrics() if metrics is None else metrics
+        # number of parsed lines covered by the lines added to the current batch
+        self.batch_line_offset = 0
 
-    def export(self):
-        for line in self.parser.get_parsed_lines():
-            self.aggregator.add_line(line)
+    def _acknowledge(self, line_offset: int):
+        if self.checkpointer is not None:
+            self.checkpointer.acknowledge(line_offset)
+
+    def _flush_batch(self):
+        self.client.send_data(self.batch)
+        self.batch.reset()
+        self._acknowledge(self.batch_line_offset)
+
+    def _stop_if_out_of_time(self):
+        if self.checkpointer is None:
+            # the export would have to start over anyway
+            return
+        remaining_sec = self.deadline.get_remaining_sec()
+        if remaining_sec < self.min_remaining_sec:
+            logger.warning('Not enough time left to complete the export. Stopping. object_id=%s, line_offset=%s, '
+                           'remaining_sec=%.3f', self.checkpointer.object_id, self.batch_line_offset, remaining_sec)
+            raise ExportInterruptedException(f'Export interrupted at line offset {self.batch_line_offset}')
+
+    def _add_line(self, line, line_offset: int):
+        # batches are flushed before they would exceed their maximum size
+        with self.metrics.time('format'):
+            added = self.batch.add(line)
+        if not added:
+            self._flush_batch()
+            self._stop_if_out_of_time()
+            with self.metrics.time('format'):
+                self.batch.add(line)
+        self.batch_line_offset = line_offset
+
+    def _add_lines(self, lines: List[str]):
+        with self.metrics.time('format'):
+            start = self.batch.add_lines(lines)
+        while start < len(lines):
+            self._flush_batch()
+            with self.metrics.time('format'):
+                start = self.batch.add_lines(lines, start)
+
+    def _export_chunks(self):
+        # lines are passed between stages chunk by chunk, which saves several calls per line
+        add_lines = self.aggregator.add_lines
+        metrics = self.metrics
+        for lines in metrics.timed('parse', self.parser.get_parsed_chunks()):
+            with metrics.time('aggregate'):
+                complete_lines = add_lines(lines)
+            self._add_lines(complete_lines)
+        with metrics.time('aggregate'):
+            complete_lines = self.aggregator.finish()
+        self._add_lines(complete_lines)
+        if self.batch.get_batch_size() > 0:
+            self._flush_batch()
+
+    def _export_lines(self):
+        if self.checkpointer is None:
+            self._export_chunks()
+            return
+        # progress is recorded line by line, so that batches are acknowledged at the exact line they end with
+        line_offset = self.checkpointer.get_line_offset()
+        lines = self.metrics.timed('parse', self.parser.get_parsed_lines())
+        if line_offset > 0:
+            logger.info('Resuming export from checkpoint. object_id=%s, line_offset=%s', self.checkpointer.object_id,
+                        line_offset)
+            # lines already exported are still read, but not sent again
+            lines = islice(lines, line_offset, None)
+        self.batch_line_offset = line_offset
+        for line in lines:
+            with self.metrics.time('aggregate'):
+                self.aggregator.add_line(line)
+            line_offset += 1
             if not self.aggregator.has_complete_aggregated_line():
                 continue
             _line = self.aggregator.get_complete_aggregated_line()
-            self.batch.add(_line)
-            if self.batch.get_batch_size() > self.batch.max_size:
-                self.client.send_data(self.batch, self.attributes)
-                self.batch.reset()
-        self.aggregator.complete()
+            # a complete aggregated line covers the lines preceding the one just added
+            self._add_line(_line, line_offset - 1)
+        with self.metrics.time('aggregate'):
+            self.aggregator.complete()
         if self.aggregator.has_complete_aggregated_line():
             _line = self.aggregator.get_complete_aggregated_line()
-            self.batch.add(_line)
+            self._add_line(_line, line_offset)
         if self.batch.get_batch_size() > 0:
-            self.client.send_data(self.batch, self.attributes)
+            self._flush_batch()
+
+    def export(self):
+        self._export_lines()
+        if self.checkpointer is not None:
+            self.checkpointer.complete()
+
+
+class PipelinedBrontoExporter(BrontoExporter):
+    """ Exporter where lines are parsed and aggregated in the calling thread, while complete batches are formatted and
+    compressed by a dedicated thread and sent by up to `max_in_flight_batches` sender threads. Stages are connected
+    with bounded queues, so that CPU work and network round-trips overlap while memory usage stays bounded. Batches
+    may be delivered out of order when more than one batch is in flight. """
+
+    def __init__(self, client: BrontoClient, parser: Parser, batch: Batch, aggregator: Aggregator,
+                 max_in_flight_batches: int, checkpointer: Optional[ObjectCheckpointer] = None,
+                 deadline: Optional[Deadline] = None, min_remaining_sec: float = 0,
+                 metrics: Optional[ExportMetrics] = None):
+        super().__init__(client, parser, batch, aggregator, checkpointer, deadline, min_remaining_sec, metrics)
+        self.max_in_flight_batches = max_in_flight_batches
+        self.compression_queue = Queue(maxsize=max_in_flight_batches)
+        self.sending_queue = Queue(maxsize=max_in_flight_batches)
+        self.errors: List[Exception] = []
+        self.batch_sequence = 0
+        # line offsets of the batches acknowledged after a batch that was not acknowledged yet, by sequence number
+        self.acknowledged_line_offsets: Dict[int, int] = {}
+        self.next_acknowledged_sequence = 0
+        self.acknowledgement_lock = threading.Lock()
+
+    def _record_error(self, error: Exception):
+        logger.error('Batch export failed. error=%s', error)
+        self.errors.append(error)
+
+    def _acknowledge_batch(self, sequence: int, line_offset: int):
+        # batches may be acknowledged out of order, while progress is recorded up to the first batch not acknowledged
+        with self.acknowledgement_lock:
+            self.acknowledged_line_offsets[sequence] = line_offset
+            acknowledged_line_offset = None
+            while self.next_acknowledged_sequence in self.acknowledged_line_offsets:
+                acknowledged_line_offset = self.acknowledged_line_offsets.pop(self.next_acknowledged_sequence)
+                self.next_acknowledged_sequence += 1
+            if acknowledged_line_offset is not None:
+                self._acknowledge(acknowledged_line_offset)
+
+    def _compress_batches(self):
+        while True:
+            item = self.compression_queue.get()
+            if item is _END_OF_BATCHES:
+                break
+            if len(self.errors) > 0:
+                # keep draining the queue so that the parsing thread never blocks
+                continue
+            sequence, batch, line_offset = item
+            try:
+                self.sending_queue.put((sequence, self.client.compress(batch), line_offset))
+            except Exception as e:
+                self._record_error(e)
+        for _ in range(0, self.max_in_flight_batches):
+            self.sending_queue.put(_END_OF_BATCHES)
+
+    def _send_batches(self):
+        while True:
+            item = self.sending_queue.get()
+            if item is _END_OF_BATCHES:
+                break
+            if len(self.errors) > 0:
+                continue
+            sequence, compressed_data, line_offset = item
+            try:
+                self.client.send_compressed_data(compressed_data)
+                self._acknowledge_batch(sequence, line_offset)
+            except Exception as e:
+                self._record_error(e)
+
+    def _flush_batch(self):
+        if len(self.errors) > 0:
+            raise self.errors[0]
+        self.compression_queue.put((self.batch_sequence, self.batch, self.batch_line_offset))
+        self.batch_sequence += 1
+        self.batch = self.batch.new_batch()
+
+    def export(self):
+        threads = [threading.Thread(target=self._compress_batches)]
+        threads.extend([threading.Thread(target=self._send_batches) for _ in range(0, self.max_in_flight_batches)])
+        for thread in threads:
+            thread.start()
+        try:
+            self._export_lines()
+        finally:
+            # batches already queued are still sent, and acknowledged
+            self.compression_queue.put(_END_OF_BATCHES)
+            for thread in threads:
+                thread.join()
+        if len(self.errors) > 0:
+            raise self.errors[0]
+        if self.checkpointer is not None:
+            self.checkpointer.complete()
@@ -1,15 +1,21 @@
 import logging
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
-from aggregator import JavaStackTraceAggregator, AggregatorFactory
-from config import Config, DestinationConfig
-from data_retriever import DataRetrieverFactory
+from aggregator import JavaStackTraceAggregator, AggregatorFactory, NoopAggregator
+from checkpoint import CheckpointStoreFactory, ObjectCheckpointer
+from config import Config, DestinationConfig, DESTINATION_CONFIG_CACHE
+from data_retriever import DataRetriever, DataRetrieverFactory
 from destination_provider import DestinationProvider
-from exporter import BrontoExporter
-from parser import ParserFactory
-from clients import BrontoClient, Batch
-from logfile import LogFileFactory
+from exporter import BrontoExporter, PipelinedBrontoExporter
+from parser import DefaultParser, ParserFactory
+from clients import BrontoClient, Batch, CompressedBatch
+from logfile import LogFileFactory, GZipFile, PlaintextFile, TimedLogFile
+from passthrough import GZipPassthroughExporter
+from profiling import InvocationProfilerFactory, PROFILE_EVENT_KEY
+from sharding import ShardedBrontoExporter, get_parsing_process_pool
 
 logger = logging.getLogger()
 logger.setLevel("INFO")
@@ -17,63 +23,145 @@ logger.setLevel("INFO")
 MB = 1000 * 1000
 
 
-def process(event):
+def _process_retriever(data_retriever: DataRetriever, config: Config, dest_config: DestinationConfig):
+    logger.info('Data retriever selected. data_retriever=%s', type(data_retriever).__name__)
+    metrics = config.invocation_metrics.new_export_metrics()
+    # each retriever gets its own buffer so that records can be processed concurrently. Streams are closed even when
+    # the export fails before reading them.
+    with tempfile.NamedTemporaryFile(delete=True, delete_on_close=True) as f, closing(data_retriever):
+        data_retriever.set_filepath(f.name)
+        # We need to retrieve the data in order to be able to determine data_id, dataset, etc in the case of
+        # CloudWatch logs
+        with metrics.time('download'):
+            data_retriever.get_data()
+        data_id = data_retriever.get_data_id()
+        logger.info('Data ID retrieved. data_id=%s', data_id)
+
+        destination_provider = DestinationProvider(dest_config, data_retriever)
+        dataset = destination_provider.get_dataset(data_id)
+        collection = destination_provider.get_collection(data_id)
+        log_type = dest_config.get_log_type(data_id)
+        client_type = dest_config.get_client_type(data_id)
+        logger.info('Destination information retrieved. dataset=%s, collection=%s, log_type=%s', dataset,
+                    collection, log_type)
+        if log_type is None:
+            logger.info('Log type not specified in configuration. Assuming type is Cloudwatch.')
+        metrics.set_dimensions(log_type, dataset)
+
+        stream = data_retriever.get_stream()
+        if stream is not None:
+            input_file = LogFileFactory.get_log_stream(log_type, stream)
+        else:
+            input_file = LogFileFactory.get_log_file(log_type, data_retriever.filepath)
+        logger.info('Input file type detected. input_file=%s', type(input_file).__name__)
+        parser = ParserFactory.get_parser(log_type, TimedLogFile(input_file, metrics), config.structured_records)
+        logger.info('Parser selected. parser=%s', type(parser).__name__)
+        attributes = dict(config.get_resource_attributes())
+        attributes.update(data_retriever.get_log_attributes_from_payload())
+        bronto_client = BrontoClient(dest_config.bronto_api_key, dest_config.bronto_endpoint, dataset, collection,
+            client_type, config.tags, dest_config.get_retry_policy(), config.deadline, metrics)
+        no_formatting = client_type is not None
+        payload_compressor = dest_config.get_payload_compressor()
+        if dest_config.max_compressed_batch_size is not None:
+            batch = CompressedBatch(dest_config.max_batch_size, dest_config.max_compressed_batch_size, no_formatting,
+                                    attributes, payload_compressor)
+        else:
+            batch = Batch(dest_config.max_batch_size, no_formatting, attributes, payload_compressor)
+        aggregator = AggregatorFactory.get_aggregator(config.aggregator, config.multiline_max_lines,
+                                                      config.multiline_max_size, config.multiline_continuation_pattern,
+                                                      config.multiline_start_pattern)
+        checkpointer = None
+        checkpoint_store = CheckpointStoreFactory.get_checkpoint_store(config.checkpoint_s3_uri,
+                                                                       config.checkpoint_directory)
+        object_version = data_retriever.get_object_version()
+        if checkpoint_store is not None and object_version is not None:
+            checkpointer = ObjectCheckpointer(checkpoint_store, *object_version)
+        if config.gzip_passthrough and no_formatting and type(input_file) is GZipFile \
+                and type(parser) is DefaultParser and isinstance(aggregator, NoopAggregator) and checkpointer is None:
+            # the data is already in its final form: it is sent as it is stored
+            input_file.get_file().close()
+            exporter = GZipPassthroughExporter(bronto_client, data_retriever.filepath, batch,
+                                               dest_config.max_compressed_batch_size)
+        elif config.parsing_processes > 1 and not config.profiling and type(input_file) in [PlaintextFile, GZipFile] \
+                and isinstance(aggregator, NoopAggregator) and parser.can_parse_shards() and checkpointer is None:
+            # lines are parsed from the file by the parsing processes
+            input_file.get_file().close()
+            exporter = ShardedBrontoExporter(bronto_client, data_retriever.filepath, log_type,
+                                             config.structured_records, batch,
+                                             get_parsing_process_pool(config.parsing_processes),
+                                             compressed=type(input_file) is GZipFile, metrics=metrics)
+        elif dest_config.max_in_flight_batches > 1 and not config.profiling:
+            exporter = PipelinedBrontoExporter(bronto_client, parser, batch, aggregator,
+                                               dest_config.max_in_flight_batches, checkpointer, config.deadline,
+                                               config.checkpoint_min_remaining_sec, metrics)
+        else:
+            exporter = BrontoExporter(bronto_client, parser, batch, aggregator, checkpointer, config.deadline,
+                                      config.checkpoint_min_remaining_sec, metrics)
+        try:
+            exporter.export()
+        finally:
+            metrics.count('parse_misses', parser.parse_misses)
+            metrics.finish()
+
+
+def process(event, context=None):
     logger.debug('Processing event. event=%s', event)
-    dest_config: DestinationConfig = DestinationConfig()
+    config: Config = Config(event, context=context)
+    profiler = InvocationProfilerFactory.get_profiler(config.profiling, config.profiling_s3_uri,
+                                                      config.profiling_directory, context)
+    profiler.start()
+    try:
+        _process(config)
+    finally:
+        profiler.stop()
+        if config.emit_metrics:
+            config.invocation_metrics.emit()
+        profiler.save(config.invocation_metrics)
+
+
+def _process(config: Config):
+    dest_config: DestinationConfig = DESTINATION_CONFIG_CACHE.get()
     # ephemeral storage path is based on https://docs.aws.amazon.com/lambda/latest/dg/configuration-ephemeral-storage.html
     total, used, free = shutil.disk_usage("/tmp")
     logger.info('Ephemeral disk usage. used_mb=%.3f, usage_ratio=%.6f', used / MB, used / total if total > 0 else -1)
-    with tempfile.NamedTemporaryFile(delete=True, delete_on_close=True) as f:
-        config: Config = Config(event, f.name)
 
-        retrievers = DataRetrieverFactory.get_data_retrievers(config, dest_config)
-        if len(retrievers) == 0:
-            logger.warning('Event does not map to any retriever.')
+    retrievers = DataRetrieverFactory.get_data_retrievers(config, dest_config)
+    if len(retrievers) == 0:
+        logger.warning('Event does not map to any retriever.')
+    if None in retrievers:
+        logger.info('Unknown data type from event. Skipping.')
+        retrievers = [data_retriever for data_retriever in retrievers if data_retriever is not None]
 
+    # profiled invocations export records one at a time, and without concurrent stages, so that the peak memory of
+    # each stage is not that of another
+    max_workers = 1 if config.profiling else min(config.max_concurrency, len(retrievers))
+    if max_workers <= 1:
         for data_retriever in retrievers:
-            if data_retriever is None:
-                logger.info('Unknown data type from event. Skipping.')
-                continue
-            logger.info('Data retriever selected. data_retriever=%s', type(data_retriever).__name__)
-            # We need to retrieve the data in order to be able to determine data_id, dataset, etc in the case of
-            # CloudWatch logs
-            data_retriever.get_data()
-            data_id = data_retriever.get_data_id()
-            logger.info('Data ID retrieved. data_id=%s', data_id)
-
-            destination_provider = DestinationProvider(dest_config, data_retriever)
-            dataset = destination_provider.get_dataset(data_id)
-            collection = destination_provider.get_collection(data_id)
-            log_type = dest_config.get_log_type(data_id)
-            client_type = dest_config.get_client_type(data_id)
-            logger.info('Destination information retrieved. dataset=%s, collection=%s, log_type=%s', dataset,
-                        collection, log_type)
-            if log_type is None:
-                logger.info('Log type not specified in configuration. Assuming type is Cloudwatch.')
-
-            input_file = LogFileFactory.get_log_file(log_type, config.filepath)
-            logger.info('Input file type detected. input_file=%s', type(input_file).__name__)
-            parser = ParserFactory.get_parser(log_type, input_file)
-            logger.info('Parser selected. parser=%s', type(parser).__name__)
-            attributes = config.get_resource_attributes()
-            attributes.update(data_retriever.get_log_attributes_from_payload())
-            bronto_client = BrontoClient(dest_config.bronto_api_key, dest_config.bronto_endpoint, dataset, collection,
-                client_type, config.tags)
-            no_formatting = client_type is not None
-            batch = Batch(dest_config.max_batch_size, no_formatting)
-            aggregator = AggregatorFactory.get_aggregator(config.aggregator)
-            exporter = BrontoExporter(bronto_client, parser, batch, aggregator, attributes)
-            exporter.export()
+            _process_retriever(data_retriever, config, dest_config)
+        return
+    # Records are processed concurrently, each by a single worker so that ordering within a record is kept. With
+    # more records than workers, a worker picks the next record (and starts downloading it) as soon as it is done
+    # with the previous one.
+    logger.info('Processing records concurrently. record_count=%s, max_workers=%s', len(retrievers), max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_process_retriever, data_retriever, config, dest_config)
+                   for data_retriever in retrievers]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if len(errors) > 0:
+        logger.error('Records processing failed. record_count=%s, failure_count=%s', len(retrievers), len(errors))
+        raise errors[0]
 
 
-def forward_logs(_event, _):
+def forward_logs(_event, context):
     logger.debug('event=%s', _event)
     source = _event.get('source')
     _event_details = _event.get('detail')
     # event coming from S3 via EventBridge
     if source is not None and source == 'aws.s3' and _event_details is not None:
         event = {'Records': [{'s3': _event_details}]}
-        process(event)
+        if PROFILE_EVENT_KEY in _event:
+            event[PROFILE_EVENT_KEY] = _event[PROFILE_EVENT_KEY]
+        process(event, context)
         return
     # event coming from Cloudwatch or S3 notification
-    process(_event)
+    process(_event, context)
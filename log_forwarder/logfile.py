@@ -1,7 +1,69 @@
 import gzip
+import mmap
+import os
+from itertools import islice
+from typing import Iterable, Iterator, List
 
 from config import (ALB_ACCESS_LOG_TYPE, CLOUDTRAIL_LOG_TYPE, CLOUDWATCH_LOG_TYPE, VPC_FLOW_LOG_TYPE,
                     S3_ACCESS_LOG_TYPE, BEDROCK_S3_LOG_TYPE)
+from metrics import ExportMetrics
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+LINES_PER_CHUNK = 4096
+
+
+def chunk_lines(lines: Iterable, size=LINES_PER_CHUNK) -> Iterator[List]:
+    """ Groups lines into lists of up to `size` lines """
+    iterator = iter(lines)
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _read_line_blocks(fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    """ Yields the lines of a binary file-like object as lists of decoded lines, without their line terminator,
+    reading it chunk by chunk so that memory usage is bounded by the chunk size rather than the size of the data. The
+    complete lines of a chunk are decoded at once rather than one by one. """
+    carry = b''
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            # the line spans the whole chunk
+            carry += chunk
+            continue
+        lines = (carry + chunk[:end]).decode() if carry else chunk[:end].decode()
+        carry = chunk[end + 1:]
+        yield lines.split('\n')
+    if carry:
+        yield [carry.decode()]
+
+
+def _read_mapped_line_blocks(f, start=0, end=None, block_size=STREAM_CHUNK_SIZE):
+    """ Yields the lines of a file between byte offsets `start` and `end` as lists of decoded lines, without their line
+    terminator. The file is memory-mapped, so that blocks of lines are copied once, straight from the page cache. """
+    size = os.fstat(f.fileno()).st_size
+    end = size if end is None else min(end, size)
+    if start >= end:
+        # empty files cannot be mapped
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        while start < end:
+            block_end = start + block_size
+            if block_end >= end:
+                block_end = end
+            else:
+                # blocks end with a complete line
+                block_end = mapped.find(b'\n', block_end - 1, end) + 1 or end
+            lines = mapped[start:block_end].decode().split('\n')
+            if lines[-1] == '':
+                lines.pop()
+            start = block_end
+            yield lines
 
 
 class LogFile:
@@ -10,7 +72,14 @@ class LogFile:
         self.filepath = filepath
 
     def get_lines(self):
-        raise NotImplementedError()
+        """ Yields the lines of the file one by one """
+        for lines in self.get_line_chunks():
+            yield from lines
+
+    def get_line_chunks(self) -> Iterator[List[str]]:
+        """ Yields the lines of the file as lists of up to a few thousand lines, so that they can be processed chunk by
+        chunk. Log files implement either this method or `get_lines`. """
+        return chunk_lines(self.get_lines())
 
     def get_file(self):
         raise NotImplementedError()
@@ -28,25 +97,133 @@ class GZipFile(LogFile):
     def get_file(self):
         return self.file
 
-    def get_lines(self):
+    def get_line_chunks(self):
         with self.file as f:
-            for line in f.readlines():
-                yield line.decode().strip()
+            for lines in _read_line_blocks(f):
+                yield list(map(str.strip, lines))
 
 
 class PlaintextFile(LogFile):
 
     def __init__(self, filepath):
         super().__init__(filepath)
-        self.file = open(self.filepath, 'r')
+        self.file = open(self.filepath, 'rb')
 
     def get_file(self):
         return self.file
 
-    def get_lines(self):
+    def get_line_chunks(self):
         with self.file as f:
-            for line in f.readlines():
-                yield line.rstrip()  # we keep spaces at the start as they may be indicative of a stack trace
+            for lines in _read_mapped_line_blocks(f):
+                # we keep spaces at the start as they may be indicative of a stack trace
+                yield list(map(str.rstrip, lines))
+
+
+class GZipStream(LogFile):
+    """ Gzip compressed data read from a stream (e.g. the body of an S3 object), decompressed on the fly """
+
+    def __init__(self, stream):
+        super().__init__(None)
+        self.stream = stream
+        self.file = gzip.GzipFile(fileobj=stream, mode='rb')
+
+    def get_file(self):
+        return self.file
+
+    def get_line_chunks(self):
+        try:
+            with self.file as f:
+                for lines in _read_line_blocks(f):
+                    yield list(map(str.strip, lines))
+        finally:
+            self.stream.close()
+
+
+class PlaintextStream(LogFile):
+    """ Plaintext data read from a stream (e.g. the body of an S3 object) """
+
+    def __init__(self, stream):
+        super().__init__(None)
+        self.stream = stream
+
+    def get_file(self):
+        return self.stream
+
+    def get_line_chunks(self):
+        try:
+            for lines in _read_line_blocks(self.stream):
+                # we keep spaces at the start as they may be indicative of a stack trace
+                yield list(map(str.rstrip, lines))
+        finally:
+            self.stream.close()
+
+
+class PlaintextFileRange(LogFile):
+    """ Lines of a plaintext file between byte offsets `start` (included) and `end` (excluded), which are expected to
+    be at the start of a line. Spaces at the start of lines are only stripped when `strip_lines`, e.g. for lines
+    decompressed from a gzip file, which are read as stripped lines otherwise. """
+
+    def __init__(self, filepath, start, end, strip_lines=False):
+        super().__init__(filepath)
+        self.start = start
+        self.end = end
+        self.strip_lines = strip_lines
+
+    def get_line_chunks(self):
+        # we keep spaces at the start as they may be indicative of a stack trace
+        strip = str.strip if self.strip_lines else str.rstrip
+        with open(self.filepath, 'rb') as f:
+            for lines in _read_mapped_line_blocks(f, self.start, self.end):
+                yield list(map(strip, lines))
+
+
+class _LimitedReader:
+    """ Reads at most `limit` bytes of a binary file-like object """
+
+    def __init__(self, fileobj, limit):
+        self.fileobj = fileobj
+        self.remaining = limit
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class GZipFileRange(LogFile):
+    """ Lines of the gzip members of a file between byte offsets `start` (included) and `end` (excluded), which are
+    expected to be at the start of a member """
+
+    def __init__(self, filepath, start, end):
+        super().__init__(filepath)
+        self.start = start
+        self.end = end
+
+    def get_line_chunks(self):
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.start)
+            with gzip.GzipFile(fileobj=_LimitedReader(f, self.end - self.start), mode='rb') as members:
+                for lines in _read_line_blocks(members):
+                    yield list(map(str.strip, lines))
+
+
+class TimedLogFile(LogFile):
+    """ Lines of `log_file`, whose reading and decompression is timed, and which are counted, by `metrics` """
+
+    def __init__(self, log_file: LogFile, metrics: ExportMetrics):
+        super().__init__(log_file.filepath)
+        self.log_file = log_file
+        self.metrics = metrics
+
+    def get_file(self):
+        return self.log_file.get_file()
+
+    def get_line_chunks(self):
+        for lines in self.metrics.timed('decompress', self.log_file.get_line_chunks()):
+            self.metrics.count('lines', len(lines))
+            yield lines
 
 
 class LogFileFactory:
@@ -58,3 +235,9 @@ class LogFileFactory:
         if log_type in [ALB_ACCESS_LOG_TYPE, CLOUDTRAIL_LOG_TYPE, VPC_FLOW_LOG_TYPE, BEDROCK_S3_LOG_TYPE]:
             return GZipFile(filepath)
         return GZipFile(filepath)
+
+    @staticmethod
+    def get_log_stream(log_type, stream):
+        if log_type is None or log_type in [S3_ACCESS_LOG_TYPE, CLOUDWATCH_LOG_TYPE]:
+            return PlaintextStream(stream)
+        return GZipStream(stream)
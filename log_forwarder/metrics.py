@@ -0,0 +1,301 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_METRICS_NAMESPACE = 'BrontoLogForwarder'
+
+# stages of an export, in the order data goes through them
+STAGES = ['download', 'decompress', 'parse', 'aggregate', 'format', 'compress', 'send']
+COUNTERS = ['lines', 'parse_misses', 'batches', 'raw_bytes', 'compressed_bytes']
+
+# names and units of the metrics emitted for stages and counters
+_STAGE_METRICS = {stage: (stage.capitalize() + 'Time', 'Milliseconds') for stage in STAGES}
+_COUNTER_METRICS = {
+    'lines': ('Lines', 'Count'),
+    'parse_misses': ('ParseMisses', 'Count'),
+    'batches': ('Batches', 'Count'),
+    'raw_bytes': ('RawBytes', 'Bytes'),
+    'compressed_bytes': ('CompressedBytes', 'Bytes'),
+}
+_DIMENSIONS = ['log_type', 'dataset']
+# dimension value of exports without a log type or a dataset
+_DEFAULT_DIMENSION_VALUE = 'default'
+
+
+class _ThreadMetrics:
+    """ Metrics recorded by a single thread, so that recording them requires no lock """
+
+    def __init__(self):
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        # stages the thread is in, the innermost last
+        self.stages: List[str] = []
+        self.started_at = 0.0
+
+
+class _StageTimer:
+
+    def __init__(self, metrics: 'ExportMetrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.metrics.start(self.stage)
+
+    def __exit__(self, *_):
+        self.metrics.stop()
+
+
+class ExportMetrics:
+    """ Time spent in each stage of the export of a record, and volumes of the data exported. Stages are timed
+    exclusively: time spent in a stage nested in another one (e.g. decompressing the lines pulled by the parser) is not
+    counted in the outer one. Time spent in stages running in separate threads adds up. """
+
+    def __init__(self):
+        self.log_type = None
+        self.dataset = None
+        self.started_at = perf_counter()
+        self.ended_at = None
+        self.thread_metrics: List[_ThreadMetrics] = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _get_thread_metrics(self) -> _ThreadMetrics:
+        try:
+            return self.local.metrics
+        except AttributeError:
+            thread_metrics = _ThreadMetrics()
+            with self.lock:
+                self.thread_metrics.append(thread_metrics)
+            self.local.metrics = thread_metrics
+            return thread_metrics
+
+    def set_dimensions(self, log_type: Optional[str], dataset: Optional[str]):
+        self.log_type = log_type
+        self.dataset = dataset
+
+    def start(self, stage: str):
+        thread_metrics = self._get_thread_metrics()
+        now = perf_counter()
+        if len(thread_metrics.stages) > 0:
+            thread_metrics.durations[thread_metrics.stages[-1]] += now - thread_metrics.started_at
+        thread_metrics.stages.append(stage)
+        thread_metrics.started_at = now
+
+    def stop(self):
+        thread_metrics = self._get_thread_metrics()
+        now = perf_counter()
+        thread_metrics.durations[thread_metrics.stages.pop()] += now - thread_metrics.started_at
+        thread_metrics.started_at = now
+
+    def time(self, stage: str) -> _StageTimer:
+        """ Returns a context manager timing `stage` """
+        return _StageTimer(self, stage)
+
+    def timed(self, stage: str, iterable: Iterable) -> Iterator:
+        """ Yields the items of `iterable`, timing the time taken to get each of them as `stage` """
+        iterator = iter(iterable)
+        while True:
+            self.start(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def count(self, counter: str, value=1):
+        self._get_thread_metrics().counts[counter] += value
+
+    def finish(self):
+        self.ended_at = perf_counter()
+
+    def get_durations(self) -> Dict[str, float]:
+        durations = dict.fromkeys(STAGES, 0.0)
+        with self.lock:
+            for thread_metrics in self.thread_metrics:
+                for stage, duration in thread_metrics.durations.items():
+                    durations[stage] += duration
+        return durations
+
+    def get_counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(COUNTERS, 0)
+        with self.lock:
+            for thread_metrics in self.thread_metrics:
+                for counter, value in thread_metrics.counts.items():
+                    counts[counter] += value
+        return counts
+
+    def get_export_duration(self) -> float:
+        return (self.ended_at if self.ended_at is not None else perf_counter()) - self.started_at
+
+
+class MemoryTrackingExportMetrics(ExportMetrics):
+    """ Export metrics which also record the peak memory allocated while in each stage, as traced by tracemalloc. The
+    peak of traced memory is that of the whole process, and is reset as stages start and stop, so peaks are only
+    those of each stage when a single stage runs at a time: profiled invocations export records one at a time, with
+    neither pipelined nor sharded exports. """
+
+    def __init__(self):
+        super().__init__()
+        self.peak_memory = dict.fromkeys(STAGES, 0)
+
+    def _record_peak_memory(self, thread_metrics: _ThreadMetrics):
+        if len(thread_metrics.stages) > 0:
+            stage = thread_metrics.stages[-1]
+            peak = tracemalloc.get_traced_memory()[1]
+            with self.lock:
+                self.peak_memory[stage] = max(self.peak_memory[stage], peak)
+        # the next peak is that of the stage starting or resuming
+        tracemalloc.reset_peak()
+
+    def start(self, stage: str):
+        self._record_peak_memory(self._get_thread_metrics())
+        super().start(stage)
+
+    def stop(self):
+        self._record_peak_memory(self._get_thread_metrics())
+        super().stop()
+
+    def get_peak_memory(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.peak_memory)
+
+
+class _NoopStageTimer:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *_):
+        pass
+
+
+_NOOP_STAGE_TIMER = _NoopStageTimer()
+
+
+class NoopExportMetrics(ExportMetrics):
+    """ Metrics of exports when metrics are not emitted: nothing is recorded """
+
+    def start(self, stage: str):
+        pass
+
+    def stop(self):
+        pass
+
+    def time(self, stage: str):
+        return _NOOP_STAGE_TIMER
+
+    def timed(self, stage: str, iterable: Iterable) -> Iterable:
+        return iterable
+
+    def count(self, counter: str, value=1):
+        pass
+
+
+class InvocationMetrics:
+    """ Collects the metrics of the exports of an invocation, which are emitted once the invocation is done in
+    CloudWatch embedded metric format (EMF), i.e. as JSON documents written to the standard output, from which
+    CloudWatch extracts metrics. Exports are aggregated by log type and dataset, with a document for each. """
+
+    def __init__(self, namespace=DEFAULT_METRICS_NAMESPACE, track_memory=False):
+        self.namespace = namespace
+        self.track_memory = track_memory
+        self.exports: List[ExportMetrics] = []
+        self.lock = threading.Lock()
+
+    def new_export_metrics(self) -> ExportMetrics:
+        export_metrics = MemoryTrackingExportMetrics() if self.track_memory else ExportMetrics()
+        with self.lock:
+            self.exports.append(export_metrics)
+        return export_metrics
+
+    @staticmethod
+    def _get_key(export_metrics: ExportMetrics) -> Tuple[str, str]:
+        return (export_metrics.log_type or _DEFAULT_DIMENSION_VALUE,
+                export_metrics.dataset or _DEFAULT_DIMENSION_VALUE)
+
+    def _aggregate(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        aggregates = {}
+        with self.lock:
+            exports = list(self.exports)
+        for export_metrics in exports:
+            key = InvocationMetrics._get_key(export_metrics)
+            aggregate = aggregates.setdefault(key, {'Records': 0, 'ExportTime': 0.0,
+                                                    **dict.fromkeys(_STAGE_METRICS, 0.0),
+                                                    **dict.fromkeys(_COUNTER_METRICS, 0)})
+            aggregate['Records'] += 1
+            aggregate['ExportTime'] += export_metrics.get_export_duration()
+            for stage, duration in export_metrics.get_durations().items():
+                aggregate[stage] += duration
+            for counter, value in export_metrics.get_counts().items():
+                aggregate[counter] += value
+        return aggregates
+
+    def get_peak_memory(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """ Returns the highest peak memory of each stage, in bytes, by log type and dataset. Peaks are only recorded
+        when memory is tracked. """
+        peaks = {}
+        with self.lock:
+            exports = list(self.exports)
+        for export_metrics in exports:
+            if not isinstance(export_metrics, MemoryTrackingExportMetrics):
+                continue
+            stage_peaks = peaks.setdefault(InvocationMetrics._get_key(export_metrics), dict.fromkeys(STAGES, 0))
+            for stage, peak in export_metrics.get_peak_memory().items():
+                stage_peaks[stage] = max(stage_peaks[stage], peak)
+        return peaks
+
+    def get_documents(self, timestamp_ms: Optional[int] = None) -> List[Dict]:
+        timestamp_ms = int(time.time() * 1000) if timestamp_ms is None else timestamp_ms
+        documents = []
+        for (log_type, dataset), aggregate in self._aggregate().items():
+            export_sec = aggregate['ExportTime']
+            values = {
+                'Records': aggregate['Records'],
+                'ExportTime': export_sec * 1000,
+                'LinesPerSecond': aggregate['lines'] / export_sec if export_sec > 0 else 0.0,
+            }
+            units = {'Records': 'Count', 'ExportTime': 'Milliseconds', 'LinesPerSecond': 'Count/Second'}
+            for stage, (name, unit) in _STAGE_METRICS.items():
+                values[name] = aggregate[stage] * 1000
+                units[name] = unit
+            for counter, (name, unit) in _COUNTER_METRICS.items():
+                values[name] = aggregate[counter]
+                units[name] = unit
+            documents.append({
+                '_aws': {
+                    'Timestamp': timestamp_ms,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [_DIMENSIONS],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()],
+                    }],
+                },
+                'log_type': log_type,
+                'dataset': dataset,
+                **values,
+            })
+        return documents
+
+    def emit(self, output=None):
+        """ Writes the documents to `output`, the standard output by default. Documents are not written with the
+        logger, since CloudWatch only extracts metrics from log events made of a JSON document. """
+        output = sys.stdout if output is None else output
+        for document in self.get_documents():
+            output.write(json.dumps(document) + '\n')
+        output.flush()
+
+
+class NoopInvocationMetrics(InvocationMetrics):
+
+    def new_export_metrics(self) -> ExportMetrics:
+        return NoopExportMetrics()
+
+    def emit(self, output=None):
+        pass
@@ -1,8 +1,12 @@
 import re
 import json
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
 from config import (CLOUDFRONT_REALTIME_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_TYPE, NLB_ACCESS_LOG_TYPE,
                     CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, CLASSIC_LB_ACCESS_LOG_TYPE, CLOUDTRAIL_LOG_TYPE,
                     CLOUDWATCH_LOG_TYPE, VPC_FLOW_LOG_TYPE, S3_ACCESS_LOG_TYPE, BEDROCK_S3_LOG_TYPE)
+from logfile import chunk_lines
+from record import StructuredRecord, RecordSerializer
 # Regex used in this file mostly come from:
 # https://github.com/aws-samples/siem-on-amazon-opensearch-service/blob/v2.10.2/source/lambda/es_loader/aws.ini
 #
@@ -14,52 +18,466 @@ class Parser:
         self.regex = regex
         self.pattern = re.compile(self.regex) if self.regex is not None else None
         self.input_file = input_file
+        self.serializer: Optional[RecordSerializer] = None
+        # number of lines that did not match the format of the parser, and were exported as they are
+        self.parse_misses = 0
+
+    def can_parse_shards(self) -> bool:
+        """ Returns whether lines can be parsed independently of the lines preceding them, other than the headers at
+        the start of the object, so that the lines of an object can be split into shards parsed concurrently """
+        return self.regex is not None
+
+    def read_headers(self, filepath) -> int:
+        """ Reads the headers at the start of a file to be split into shards and returns the offset of its first line
+        after them. The parsers of the shards are then set up with `use_header`. """
+        return 0
+
+    def get_header(self):
+        """ Returns what the parsers of the lines following the headers need to know of them """
+        return None
+
+    def use_header(self, header):
+        pass
+
+    def use_structured_records(self):
+        """ Makes parsed lines structured records, so that their fields are serialized only once """
+        self.serializer = RecordSerializer(self.pattern.groupindex if self.pattern is not None else ())
+
+    def match(self, line: str) -> Optional[Dict[str, str]]:
+        parsed = re.match(self.pattern, line)
+        if parsed is not None:
+            return {k: v for k, v in parsed.groupdict().items() if v is not None}
+        return None
 
     def parse(self, line: str):
         stripped_line = line.strip()
         if self.regex is None:
             return stripped_line
-        parsed = re.match(self.pattern, stripped_line)
-        if parsed is not None:
-            return json.dumps({k: v for k, v in parsed.groupdict().items() if v is not None})
+        fields = self.match(stripped_line)
+        if fields is not None:
+            if self.serializer is not None:
+                return self.serializer.serialize(fields)
+            return json.dumps(fields)
+        self.parse_misses += 1
         return stripped_line
 
     def get_parsed_lines(self):
         for line in self.input_file.get_lines():
             yield self.parse(line)
 
-
-class S3AccessLogParser(Parser):
+    def get_parsed_chunks(self) -> Iterator[List[str]]:
+        """ Yields the parsed lines as lists of up to a few thousand lines, so that they are passed to the following
+        stages chunk by chunk rather than one by one """
+        parse = self.parse
+        for lines in self.input_file.get_line_chunks():
+            yield [parse(line) for line in lines]
+
+
+_QUOTE = '"'
+_DIGITS = '0123456789'
+_SIGNED_DIGITS = '-0123456789'
+_DECIMALS = '-.0123456789'
+_IP_CHARACTERS = '0123456789abcdef.:'
+_IPV6_CHARACTERS = '0123456789abcdefABCDEF.:'
+
+
+def _tokenize(line: str) -> Optional[Tuple[List[str], List[str]]]:
+    """ Splits a space delimited line into tokens. Quoted fields may contain spaces: each of them is replaced by a
+    single `"` token, and their values are returned separately, in order. Returns None if quotes are unbalanced. """
+    segments = line.split(_QUOTE)
+    if len(segments) % 2 == 0:
+        return None
+    return _QUOTE.join(segments[::2]).split(' '), segments[1::2]
+
+
+def _is_word(value: str) -> bool:
+    # equivalent to \w+ for ASCII strings
+    return value.isalnum() or value.replace('_', 'a').isalnum()
+
+
+def _tokenize_request(request: str, fields: Dict[str, str], classic_lb: bool) -> bool:
+    """ Extracts the HTTP method, URL components and HTTP version of a load balancer request field into `fields`, the
+    way the ALB (or CLB if `classic_lb`) regular expression would. Returns False if the request cannot be tokenized. """
+    parts = request.split(' ')
+    if classic_lb and len(parts) == 4 and parts[2] == '-' and parts[3] == '':
+        # `- ` version of malformed requests
+        parts.pop()
+    if len(parts) != 3:
+        return False
+    method, url, version = parts
+    fields['request'] = request
+    if method != '-':
+        if not _is_word(method.replace('-', '_') if classic_lb else method):
+            return False
+        fields['http_method'] = method
+    if url != '-':
+        protocol, separator, location = url.partition('://')
+        if not separator or (protocol and not _is_word(protocol)):
+            return False
+        if location[:1] == '[':
+            # IPv6 address
+            host, _, remainder = location[1:].partition(']')
+            separator, remainder = remainder[:1], remainder[1:]
+            if not host or host.strip(_IPV6_CHARACTERS):
+                return False
+        else:
+            host, separator, remainder = location.partition(':')
+            if not host or '[' in host or ']' in host or (not classic_lb and '/' in host):
+                return False
+        path = remainder.lstrip(_DIGITS)
+        port = remainder[:len(remainder) - len(path)]
+        if separator != ':' or not port or path[:1] not in ('-', '/'):
+            return False
+        fields['http_protocol'] = protocol
+        fields['http_host'] = host
+        fields['http_port'] = port
+        path, separator, query = path.partition('?')
+        if path != '-':
+            if path[:1] != '/':
+                return False
+            fields['http_path'] = path
+        if separator:
+            fields['http_query'] = query
+    if version == '-' or (not version and not classic_lb):
+        return True
+    name, separator, version_number = version.partition('/')
+    if not separator or not _is_word(name) or version_number.strip('0123456789.'):
+        return False
+    fields['http_version'] = version_number
+    return True
+
+
+class TokenizedParser(Parser):
+    """ Parser for space delimited formats with quoted and bracketed fields. Lines are split into fields in a single
+    left-to-right scan and fields are mapped by position, which is much cheaper than matching the format regular
+    expression. Lines that do not have the expected shape are matched with the regular expression, which remains the
+    reference. """
+
+    def tokenize_fields(self, line: str) -> Optional[Dict[str, str]]:
+        raise NotImplementedError()
+
+    def match(self, line: str) -> Optional[Dict[str, str]]:
+        fields = self.tokenize_fields(line)
+        if fields is not None:
+            return fields
+        return super().match(line)
+
+
+class S3AccessLogParser(TokenizedParser):
 
     REGEX = r'(?P<BucketOwner>[^ ]*) (?P<Bucket>[^ ]*) \[(?P<RequestDateTime>.*?)\] (?P<RemoteIP>[^ ]*) (?P<Requester>[^ ]*) (?P<RequestID>[^ ]*) (?P<Operation>[^ ]*) (?P<Key>[^ ]*) (\"(?P<RequestURI_operation>[^ ]*) (?P<RequestURI_key>[^ ]*) (?P<RequestURI_httpProtoversion>- |[^ ]*)\"|\"-\"|-) (?P<HTTPstatus>-|[0-9]*) (?P<ErrorCode>[^ ]*) (?P<BytesSent>[^ ]*) (?P<ObjectSize>[^ ]*) (?P<TotalTime>[^ ]*) (?P<TurnAroundTime>[^ ]*) (\"(?P<Referrer>.*?)\"|-) (\"(?P<UserAgent>.*?)\"|-) (?P<VersionId>[^ ]*)(?: (?P<HostId>[^ ]*) (?P<SigV>[^ ]*) (?P<CipherSuite>[^ ]*) (?P<AuthType>[^ ]*) (?P<EndPoint>[^ ]*) (?P<TLSVersion>[^ ]*))?( (?P<S3AccessPointARN>arn:[^ ]*|-))?'
 
     def __init__(self, input_file):
         super().__init__(S3AccessLogParser.REGEX, input_file)
 
-
-class ALBAccessLogParser(Parser):
+    def tokenize_fields(self, line: str) -> Optional[Dict[str, str]]:
+        tokenized = _tokenize(line)
+        if tokenized is None:
+            return None
+        tokens, quoted_values = tokenized
+        if len(tokens) < 19:
+            return None
+        # the request time is the only bracketed field and contains a single space
+        request_time_start, request_time_end = tokens[2], tokens[3]
+        if request_time_start[:1] != '[' or request_time_end[-1:] != ']' or ']' in request_time_start or \
+                ']' in request_time_end[:-1]:
+            return None
+        # the request URI, referrer and user agent are either quoted or a dash
+        request_uri, referrer, user_agent = tokens[9], tokens[16], tokens[17]
+        if (request_uri == _QUOTE) + (referrer == _QUOTE) + (user_agent == _QUOTE) != len(quoted_values):
+            return None
+        http_status = tokens[10]
+        if http_status != '-' and http_status.strip(_DIGITS):
+            return None
+        fields = {'BucketOwner': tokens[0], 'Bucket': tokens[1],
+                  'RequestDateTime': request_time_start[1:] + ' ' + request_time_end[:-1], 'RemoteIP': tokens[4],
+                  'Requester': tokens[5], 'RequestID': tokens[6], 'Operation': tokens[7], 'Key': tokens[8]}
+        quoted_index = 0
+        if request_uri == _QUOTE:
+            request_uri = quoted_values[0]
+            quoted_index = 1
+            request_uri_parts = request_uri.split(' ')
+            if len(request_uri_parts) == 3:
+                (fields['RequestURI_operation'], fields['RequestURI_key'],
+                 fields['RequestURI_httpProtoversion']) = request_uri_parts
+            elif request_uri != '-':
+                return None
+        elif request_uri != '-':
+            return None
+        fields['HTTPstatus'] = http_status
+        fields['ErrorCode'] = tokens[11]
+        fields['BytesSent'] = tokens[12]
+        fields['ObjectSize'] = tokens[13]
+        fields['TotalTime'] = tokens[14]
+        fields['TurnAroundTime'] = tokens[15]
+        if referrer == _QUOTE:
+            fields['Referrer'] = quoted_values[quoted_index]
+            quoted_index += 1
+        elif referrer != '-':
+            return None
+        if user_agent == _QUOTE:
+            fields['UserAgent'] = quoted_values[quoted_index]
+        elif user_agent != '-':
+            return None
+        fields['VersionId'] = tokens[18]
+        remaining = tokens[19:]
+        if len(remaining) >= 6:
+            (fields['HostId'], fields['SigV'], fields['CipherSuite'], fields['AuthType'], fields['EndPoint'],
+             fields['TLSVersion']) = remaining[:6]
+            remaining = remaining[6:]
+        if remaining:
+            if remaining[0].startswith('arn:'):
+                fields['S3AccessPointARN'] = remaining[0]
+            elif remaining[0][:1] == '-':
+                fields['S3AccessPointARN'] = '-'
+        return fields
+
+
+class ALBAccessLogParser(TokenizedParser):
 
     REGEX   = r'(?P<request_type>[^\s]*) (?P<timestamp>[^\s]*) (?P<elb>[^\s]*) (?P<client_ip>[^\s]*):(?P<client_port>[0-9]*) (?P<target_ip>[^\s]*)[:-](?P<target_port>[0-9]*) (?P<request_processing_time>[-.0-9]*) (?P<target_processing_time>[-.0-9]*) (?P<response_processing_time>[-.0-9]*) (?P<elb_status_code>|[-0-9]*) (?P<target_status_code>-|[-0-9]*) (?P<received_bytes>[-0-9]*) (?P<sent_bytes>[-0-9]*) \"(?P<request>(-|(?P<http_method>\w+)) (-|(?P<http_protocol>\w*)://\[?(?P<http_host>[^/]+?)\]?:(?P<http_port>\d+)(-|(?P<http_path>/[^?]*?))(\?(?P<http_query>.*?))?) (-?|\w+/(?P<http_version>[0-9\.]*)))\" \"(|(?P<useragent>[^\"]+))\" (?P<ssl_cipher>[^\s]+) (?P<ssl_protocol>[^\s]*) (?P<target_group_arn>[^\s]*) \"(?P<trace_id>[^\"]*)\" \"(?P<domain_name>[^\"]*)\" \"(?P<chosen_cert_arn>[^\"]*)\" (?P<matched_rule_priority>[-.0-9]*) (?P<request_creation_time>[^\s]*) \"(?P<actions_executed>[^\"]*)\" \"(?P<redirect_url>[^\"]*)\" \"(?P<lambda_error_reason>[^\s]*)\" \"(?P<target_port_list>[^\s]+)\" \"(?P<target_status_code_list>[^\s]+)\"( \"(?P<classification>[^\s]+)\" \"(?P<classification_reason>[^\s]+)\")? ?(?P<conn_trace_id>[^\s]*)?'
+    QUOTED_FIELDS = itemgetter(12, 13, 17, 18, 19, 22, 23, 24, 25, 26)
+    QUOTED_FIELD_TOKENS = (_QUOTE,) * 10
 
     def __init__(self, input_file):
         super().__init__(ALBAccessLogParser.REGEX, input_file)
 
-
-class NLBAccessLogParser(Parser):
+    def tokenize_fields(self, line: str) -> Optional[Dict[str, str]]:
+        # other lines are left to the regular expression, so that the Unicode semantics of \s, \w and \d do not
+        # have to be reproduced
+        if not line.isascii() or not line.isprintable():
+            return None
+        tokenized = _tokenize(line)
+        if tokenized is None:
+            return None
+        tokens, quoted_values = tokenized
+        # the classification and classification reason fields are optional
+        has_classification = len(quoted_values) == 12
+        if (len(quoted_values) != 10 and not has_classification) or len(tokens) < (29 if has_classification else 27):
+            return None
+        if ALBAccessLogParser.QUOTED_FIELDS(tokens) != ALBAccessLogParser.QUOTED_FIELD_TOKENS:
+            return None
+        if has_classification and (tokens[27] != _QUOTE or tokens[28] != _QUOTE):
+            return None
+        client_ip, separator, client_port = tokens[3].rpartition(':')
+        if not separator or client_port.strip(_DIGITS):
+            return None
+        target = tokens[4]
+        separator_index = max(target.rfind(':'), target.rfind('-'))
+        target_port = target[separator_index + 1:]
+        if separator_index < 0 or target_port.strip(_DIGITS):
+            return None
+        # fields made of the same characters are checked at once
+        if (tokens[5] + tokens[6] + tokens[7] + tokens[20]).strip(_DECIMALS):
+            return None
+        if (tokens[8] + tokens[9] + tokens[10] + tokens[11]).strip(_SIGNED_DIGITS):
+            return None
+        if not tokens[14] or not quoted_values[8] or not quoted_values[9] or \
+                ' ' in quoted_values[7] + quoted_values[8] + quoted_values[9]:
+            return None
+        fields = {'request_type': tokens[0], 'timestamp': tokens[1], 'elb': tokens[2], 'client_ip': client_ip,
+                  'client_port': client_port, 'target_ip': target[:separator_index], 'target_port': target_port,
+                  'request_processing_time': tokens[5], 'target_processing_time': tokens[6],
+                  'response_processing_time': tokens[7], 'elb_status_code': tokens[8],
+                  'target_status_code': tokens[9], 'received_bytes': tokens[10], 'sent_bytes': tokens[11]}
+        if not _tokenize_request(quoted_values[0], fields, classic_lb=False):
+            return None
+        if quoted_values[1]:
+            fields['useragent'] = quoted_values[1]
+        fields['ssl_cipher'] = tokens[14]
+        fields['ssl_protocol'] = tokens[15]
+        fields['target_group_arn'] = tokens[16]
+        fields['trace_id'] = quoted_values[2]
+        fields['domain_name'] = quoted_values[3]
+        fields['chosen_cert_arn'] = quoted_values[4]
+        fields['matched_rule_priority'] = tokens[20]
+        fields['request_creation_time'] = tokens[21]
+        fields['actions_executed'] = quoted_values[5]
+        fields['redirect_url'] = quoted_values[6]
+        fields['lambda_error_reason'] = quoted_values[7]
+        fields['target_port_list'] = quoted_values[8]
+        fields['target_status_code_list'] = quoted_values[9]
+        conn_trace_id_index = 27
+        if has_classification:
+            classification, classification_reason = quoted_values[10], quoted_values[11]
+            if not classification or not classification_reason or ' ' in classification + classification_reason:
+                return None
+            fields['classification'] = classification
+            fields['classification_reason'] = classification_reason
+            conn_trace_id_index = 29
+        fields['conn_trace_id'] = tokens[conn_trace_id_index] if len(tokens) > conn_trace_id_index else ''
+        return fields
+
+
+class NLBAccessLogParser(TokenizedParser):
 
     REGEX = r'(?P<listener_type>[^ ]+) (?P<log_entry_version>[^ ]+) (?P<timestamp>[^ ]+) (?P<elb>[^ ]+) (?P<listener>[^ ]+) (?P<client_ip>[0-9a-f.:]+):(?P<client_port>[0-9]+) (?P<destination_ip>[^ ]+):(?P<destination_port>[0-9]+) (?P<connection_time>[0-9]+) (-|(?P<tls_handshake_time>[0-9]+)) (-|(?P<received_bytes>[-0-9]+)) (?P<sent_bytes>[-0-9]+) (-|(?P<incoming_tls_alert>[^ ]+)) (-|(?P<chosen_cert_arn>[^ ]+)) (-|(?P<chosen_cert_serial>[^ ]+)) (-|(?P<tls_cipher>[^ ]+)) (-|(?P<tls_protocol_version>[^ ]+)) (-|(?P<tls_named_group>[^ ]+)) (-|(?P<domain_name>[^ ]+)) (-|(?P<alpn_fe_protocol>[^ ]+)) (-|(?P<alpn_be_protocol>[^ ]+)) (-|(?P<alpn_client_preference_list>[^ ]+))( (?P<tls_connection_creation_time>20[0-9T:-]+))?'
+    OPTIONAL_FIELDS = ('incoming_tls_alert', 'chosen_cert_arn', 'chosen_cert_serial', 'tls_cipher',
+                       'tls_protocol_version', 'tls_named_group', 'domain_name', 'alpn_fe_protocol', 'alpn_be_protocol',
+                       'alpn_client_preference_list')
 
     def __init__(self, input_file):
         super().__init__(NLBAccessLogParser.REGEX, input_file)
 
-
-class CLBAccessLogParser(Parser):
+    def tokenize_fields(self, line: str) -> Optional[Dict[str, str]]:
+        if not line.isascii():
+            return None
+        # fields are never quoted, although the ALPN client preference list contains quotes
+        tokens = line.split(' ')
+        if len(tokens) < 21 or '' in tokens[:21]:
+            return None
+        client_ip, _, client_port = tokens[5].rpartition(':')
+        destination_ip, _, destination_port = tokens[6].rpartition(':')
+        if not client_ip or client_ip.strip(_IP_CHARACTERS) or not client_port.isdigit():
+            return None
+        if not destination_ip or not destination_port.isdigit() or not tokens[7].isdigit():
+            return None
+        if (tokens[8] != '-' and not tokens[8].isdigit()) or (tokens[9] + tokens[10]).strip(_SIGNED_DIGITS):
+            return None
+        if tokens[20][:1] == '-' and tokens[20] != '-':
+            # the dash alternative matches the start of the field
+            return None
+        fields = {'listener_type': tokens[0], 'log_entry_version': tokens[1], 'timestamp': tokens[2],
+                  'elb': tokens[3], 'listener': tokens[4], 'client_ip': client_ip, 'client_port': client_port,
+                  'destination_ip': destination_ip, 'destination_port': destination_port,
+                  'connection_time': tokens[7]}
+        if tokens[8] != '-':
+            fields['tls_handshake_time'] = tokens[8]
+        if tokens[9] != '-':
+            fields['received_bytes'] = tokens[9]
+        fields['sent_bytes'] = tokens[10]
+        for name, value in zip(NLBAccessLogParser.OPTIONAL_FIELDS, tokens[11:21]):
+            if value != '-':
+                fields[name] = value
+        if len(tokens) > 21 and tokens[21][:2] == '20':
+            creation_time = tokens[21][2:]
+            length = len(creation_time) - len(creation_time.lstrip('0123456789T:-'))
+            if length > 0:
+                fields['tls_connection_creation_time'] = tokens[21][:2 + length]
+        return fields
+
+
+class CLBAccessLogParser(TokenizedParser):
 
     REGEX = r'(?P<timestamp>[^ ]+) (?P<elb>[^ ]+) (?P<client_ip>[0-9a-f.:]+):(?P<client_port>[0-9]+) (-|(?P<backend_ip>[0-9a-f.:]+):(?P<backend_port>[-0-9]+)) (?P<request_processing_time>[0-9\.-]+) (?P<backend_processing_time>[0-9\.-]+) (?P<response_processing_time>[0-9\.-]+) (?P<elb_status_code>[0-9\.-]+) (?P<backend_status_code>[0-9\.-]+) (?P<received_bytes>[0-9\.-]+) (?P<sent_bytes>[0-9\.-]+) \"(?P<request>(-|(?P<http_method>[\w-]+)) (-|(?P<http_protocol>\w*)://\[?(?P<http_host>[^\[\]]+?)\]?:(?P<http_port>\d+)(-|(?P<http_path>/[^?]*?))(\?(?P<http_query>[^ ]*))?) (- |-|\w+/(?P<http_version>[0-9\.]*)))\" (-|\"(|(?P<useragent>.+))\") (?P<ssl_cipher>[^ ]+) (?P<ssl_protocol>[^ ]+)'
 
     def __init__(self, input_file):
         super().__init__(CLBAccessLogParser.REGEX, input_file)
 
+    def tokenize_fields(self, line: str) -> Optional[Dict[str, str]]:
+        # other lines are left to the regular expression, so that the Unicode semantics of \w and \d do not have to
+        # be reproduced
+        if not line.isascii():
+            return None
+        tokenized = _tokenize(line)
+        if tokenized is None:
+            return None
+        tokens, quoted_values = tokenized
+        # the user agent is either quoted or a dash. As it is matched greedily by the regular expression, it is only
+        # unambiguous if no quote follows it
+        if len(tokens) < 15 or tokens[11] != _QUOTE or len(quoted_values) != (2 if tokens[12] == _QUOTE else 1):
+            return None
+        if tokens[12] != _QUOTE and tokens[12] != '-':
+            return None
+        ssl_cipher, ssl_protocol = tokens[13], tokens[14]
+        if not tokens[0] or not tokens[1] or not ssl_cipher or not ssl_protocol:
+            return None
+        client_ip, _, client_port = tokens[2].rpartition(':')
+        if not client_ip or client_ip.strip(_IP_CHARACTERS) or not client_port.isdigit():
+            return None
+        if '' in tokens[4:11] or ''.join(tokens[4:11]).strip(_DECIMALS):
+            return None
+        fields = {'timestamp': tokens[0], 'elb': tokens[1], 'client_ip': client_ip, 'client_port': client_port}
+        if tokens[3] != '-':
+            backend_ip, _, backend_port = tokens[3].rpartition(':')
+            if not backend_ip or backend_ip.strip(_IP_CHARACTERS) or not backend_port or \
+                    backend_port.strip(_SIGNED_DIGITS):
+                return None
+            fields['backend_ip'] = backend_ip
+            fields['backend_port'] = backend_port
+        fields['request_processing_time'] = tokens[4]
+        fields['backend_processing_time'] = tokens[5]
+        fields['response_processing_time'] = tokens[6]
+        fields['elb_status_code'] = tokens[7]
+        fields['backend_status_code'] = tokens[8]
+        fields['received_bytes'] = tokens[9]
+        fields['sent_bytes'] = tokens[10]
+        if not _tokenize_request(quoted_values[0], fields, classic_lb=True):
+            return None
+        if len(quoted_values) > 1 and quoted_values[1]:
+            fields['useragent'] = quoted_values[1]
+        fields['ssl_cipher'] = ssl_cipher
+        fields['ssl_protocol'] = ssl_protocol
+        return fields
+
+
+# https://docs.aws.amazon.com/vpc/latest/userguide/flow-log-records.html#flow-logs-fields
+VPC_FLOW_LOG_FIELDS = frozenset([
+    'version', 'account-id', 'interface-id', 'srcaddr', 'dstaddr', 'srcport', 'dstport', 'protocol', 'packets', 'bytes',
+    'start', 'end', 'action', 'log-status', 'vpc-id', 'subnet-id', 'instance-id', 'tcp-flags', 'type', 'pkt-srcaddr',
+    'pkt-dstaddr', 'region', 'az-id', 'sublocation-type', 'sublocation-id', 'pkt-src-aws-service', 'pkt-dst-aws-service',
+    'flow-direction', 'traffic-path', 'ecs-cluster-arn', 'ecs-cluster-name', 'ecs-container-instance-arn',
+    'ecs-container-instance-id', 'ecs-container-id', 'ecs-second-container-id', 'ecs-service-name',
+    'ecs-task-definition-arn', 'ecs-task-arn', 'ecs-task-id', 'reject-reason'])
+
+
+def _normalize_column_name(name: str) -> str:
+    # e.g. `log-status` becomes `log_status` and `cs(User-Agent)` becomes `cs_user_agent`
+    return name.lower().replace('(', '_').replace(')', '').replace('-', '_')
+
+
+class ColumnMappedParser(Parser):
+    """ Parser for delimited formats whose columns are described by a header line, so that custom formats are
+    supported. Once a header is read, rows are split into the columns it describes. Rows read before any header, or
+    whose number of values does not match it, are matched with the regular expression of the default format. """
+
+    def __init__(self, regex, input_file, delimiter):
+        super().__init__(regex, input_file)
+        self.delimiter = delimiter
+        self.columns: Optional[List[str]] = None
+
+    def can_parse_shards(self) -> bool:
+        # rows depend on the header read before them, which is handed over to the parsers of shards
+        return self.regex is not None
+
+    def read_headers(self, filepath) -> int:
+        offset = 0
+        with open(filepath, 'rb') as f:
+            for line in f:
+                if not self.read_header(line.decode().strip()):
+                    break
+                offset += len(line)
+        return offset
+
+    def get_header(self) -> Optional[List[str]]:
+        return self.columns
+
+    def use_header(self, header: Optional[List[str]]):
+        self.columns = header
+
+    def read_header(self, line: str) -> bool:
+        """ Returns whether `line` is a header rather than a row. Columns described by a header are used to parse the
+        rows that follow it. """
+        raise NotImplementedError()
+
+    def match(self, line: str) -> Optional[Dict[str, str]]:
+        if self.columns is not None:
+            values = line.split(self.delimiter)
+            if len(values) == len(self.columns):
+                return dict(zip(self.columns, values))
+        return super().match(line)
+
+    def get_parsed_lines(self):
+        for line in self.input_file.get_lines():
+            if not self.read_header(line):
+                yield self.parse(line)
+
+    def get_parsed_chunks(self):
+        parse = self.parse
+        read_header = self.read_header
+        for lines in self.input_file.get_line_chunks():
+            yield [parse(line) for line in lines if not read_header(line)]
+
 
 class CloudFrontRealtimeAccessLogParser(Parser):
 
@@ -69,28 +487,47 @@ class CloudFrontRealtimeAccessLogParser(Parser):
         super().__init__(CloudFrontRealtimeAccessLogParser.REGEX, input_file)
 
 
-class CloudFrontStandardAccessLogParser(Parser):
+class CloudFrontStandardAccessLogParser(ColumnMappedParser):
 
     REGEX = r'(?P<date>[0-9-]+)\t(?P<time>[0-9:]+)\t(?P<x_edge_location>[0-9A-Z-]+)\t(?P<sc_bytes>[0-9]+)\t(?P<c_ip>[0-9a-f.:]+)\t(?P<cs_method>[A-Z]+)\t(?P<cs_host>[0-9A-Za-z.]+)\t(?P<cs_uri_stem>[^\t]+)\t(?P<sc_status>[0-9-]+)\t(?P<cs_referer>[^\t]+)\t(?P<cs_user_agent>[^\t]+)\t(?P<cs_uri_query>[^\t]+)\t(?P<cs_cookie>[^\t]+)\t(?P<x_edge_result_type>[^\t]+)\t(?P<x_edge_request_id>[^\t]+)\t(?P<x_host_header>[^\t]+)\t(?P<cs_protocol>[^\t]+)\t(?P<cs_bytes>[^\t]+)\t(?P<time_taken>[^\t]+)\t(?P<x_forwarded_for>[^\t]+)\t(?P<ssl_protocol>[^\t]+)\t(?P<ssl_cipher>[^\t]+)\t(?P<x_edge_response_result_type>[^\t]+)\t(?P<cs_protocol_version>[^\t]+)\t(?P<fle_status>[^\t]+)\t(?P<fle_encrypted_fields>[^\t]+)(\t(?P<c_port>[^\t]+)\t(?P<time_to_first_byte>[^\t]+)\t(?P<x_edge_detailed_result_type>[^\t]+)\t(?P<sc_content_type>[^\t]+)\t(?P<sc_content_len>[^\t]+)\t(?P<sc_range_start>[^\t]+)\t(?P<sc_range_end>[^\t]+))?'
 
     def __init__(self, input_file):
-        super().__init__(CloudFrontStandardAccessLogParser.REGEX, input_file)
+        super().__init__(CloudFrontStandardAccessLogParser.REGEX, input_file, '\t')
 
     # https://docs.aws.amazon.com/AmazonCloudFront/latest/DeveloperGuide/AccessLogs.html#BasicDistributionFileFormat
-    def get_parsed_lines(self):
-        for line in self.input_file.get_lines():
-            # Cloudfront Standard log files contain headers starting with '#'. This also skips empty lines,
-            # should there be any.
-            if len(line) > 0 and line[0] != '#':
-                yield self.parse(line)
+    def read_header(self, line: str) -> bool:
+        # Cloudfront Standard log files contain headers starting with '#'. This also skips empty lines,
+        # should there be any.
+        if len(line) > 0 and line[0] != '#':
+            return False
+        if line.startswith('#Fields:'):
+            self.columns = [_normalize_column_name(name) for name in line[len('#Fields:'):].split()]
+        return True
 
 
-class VPCFlowLogParser(Parser):
+class VPCFlowLogParser(ColumnMappedParser):
 
     REGEX = r'(?P<version>[^ ]+) (?P<account_id>[^ ]+) (?P<interface_id>[^ ]+) (?P<srcaddr>[^ ]+) (?P<dstaddr>[^ ]+) (?P<srcport>[^ ]+) (?P<dstport>[^ ]+) (?P<protocol>[^ ]+) (?P<packets>[^ ]+) (?P<bytes>[^ ]+) (?P<start>[^ ]+) (?P<end>[^ ]+) (?P<action>[^ ]+) (?P<log_status>[^ ]+)( (?P<vpc_id>[^ ]+) (?P<subnet_id>[^ ]+) (?P<instance_id>[^ ]+) (?P<tcp_flags>[^ ]+) (?P<type>[^ ]+) (?P<pkt_srcaddr>[^ ]+) (?P<pkt_dstaddr>[^ ]+) (?P<region>[^ ]+) (?P<az_id>[^ ]+) (?P<sublocation_type>[^ ]+) (?P<sublocation_id>[^ ]+) (?P<pkt_src_aws_service>[^ ]+) (?P<pkt_dst_aws_service>[^ ]+) (?P<flow_direction>[^ ]+) (?P<traffic_path>[^ ]+))?'
 
     def __init__(self, input_file):
-        super().__init__(VPCFlowLogParser.REGEX, input_file)
+        super().__init__(VPCFlowLogParser.REGEX, input_file, ' ')
+        self.expects_header = True
+
+    def use_header(self, header: Optional[List[str]]):
+        super().use_header(header)
+        # the header, if any, was read from the start of the file
+        self.expects_header = False
+
+    def read_header(self, line: str) -> bool:
+        # flow log files delivered to S3 start with a header listing the fields of the (possibly custom) format
+        if not self.expects_header:
+            return False
+        self.expects_header = False
+        names = line.split()
+        if len(names) == 0 or any(name not in VPC_FLOW_LOG_FIELDS for name in names):
+            return False
+        self.columns = [_normalize_column_name(name) for name in names]
+        return True
 
 
 class DefaultParser(Parser):
@@ -115,15 +552,29 @@ class CloudTrailParser(Parser):
             data = json.loads(line)
             if 'Records' in data:
                 for record in data['Records']:
-                    yield json.dumps(record)
+                    if self.serializer is not None:
+                        yield StructuredRecord(json.dumps(record))
+                    else:
+                        yield json.dumps(record)
             else:
                 yield line
 
+    def get_parsed_chunks(self):
+        # records are extracted from the lines
+        return chunk_lines(self.get_parsed_lines())
+
 
 class ParserFactory:
 
     @staticmethod
-    def get_parser(log_type, input_file):
+    def get_parser(log_type, input_file, structured_records=False):
+        parser = ParserFactory._new_parser(log_type, input_file)
+        if structured_records:
+            parser.use_structured_records()
+        return parser
+
+    @staticmethod
+    def _new_parser(log_type, input_file):
         if log_type == S3_ACCESS_LOG_TYPE:
             return S3AccessLogParser(input_file)
         if log_type == ALB_ACCESS_LOG_TYPE:
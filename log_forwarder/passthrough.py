@@ -0,0 +1,136 @@
+import gzip
+import logging
+import mmap
+import os
+import zlib
+from collections import namedtuple
+from typing import Iterator, Optional
+
+from aggregator import NoopAggregator
+from clients import BrontoClient, Batch
+from compression import GZIP_WBITS
+from exporter import BrontoExporter
+from logfile import GZipFileRange, STREAM_CHUNK_SIZE
+from parser import DefaultParser
+
+logger = logging.getLogger()
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+# `start` and `end` are byte offsets in the compressed file, `size` is the size of the decompressed data and
+# `ends_with_line` tells whether the decompressed data ends with a complete line. `end` and `size` are `None` for
+# members larger than the maximum size they were scanned with.
+Member = namedtuple('Member', ['start', 'end', 'size', 'ends_with_line'])
+
+
+def scan_members(data, chunk_size=STREAM_CHUNK_SIZE, max_size: Optional[int] = None) -> Iterator[Member]:
+    """ Yields the gzip members of `data`. Members are inflated to learn their size, which is much cheaper than
+    compressing them, while their decompressed data is dropped chunk by chunk. Members are inflated no further than
+    `max_size` bytes: the scan ends with the first larger member, whose end is then unknown. """
+    start = 0
+    while start < len(data) and data[start:start + 2] == _GZIP_MAGIC:
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        position = start
+        size = 0
+        last_byte = b''
+        while not decompressor.eof:
+            chunk = data[position:position + chunk_size]
+            if not chunk:
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            position += len(chunk)
+            while chunk and not decompressor.eof:
+                max_length = chunk_size if max_size is None else min(chunk_size, max_size + 1 - size)
+                output = decompressor.decompress(chunk, max_length)
+                chunk = decompressor.unconsumed_tail
+                if output:
+                    size += len(output)
+                    last_byte = output[-1:]
+                if max_size is not None and size > max_size:
+                    yield Member(start, None, None, False)
+                    return
+        end = position - len(decompressor.unused_data)
+        yield Member(start, end, size, last_byte in (b'', b'\n'))
+        start = end
+    # trailing zeros are allowed after the last member, as with the gzip module
+    if start < len(data) and data[start] != 0:
+        raise gzip.BadGzipFile('Not a gzipped file')
+
+
+def _line_aligned_members(members: Iterator[Member]) -> Iterator[Member]:
+    """ Merges consecutive members until they end with a complete line, so that lines never span payloads """
+    merged = None
+    for member in members:
+        if member.end is None:
+            # the end of the members is unknown, and so is where their lines end
+            yield member if merged is None else Member(merged.start, None, None, False)
+            return
+        if merged is None:
+            merged = member
+        else:
+            merged = Member(merged.start, member.end, merged.size + member.size, member.ends_with_line)
+        if merged.ends_with_line:
+            yield merged
+            merged = None
+    if merged is not None:
+        yield merged
+
+
+class GZipPassthroughExporter:
+    """ Exporter forwarding the data of a gzip file as it is stored, for data already in its final form (i.e.
+    newline-delimited entries that are neither parsed nor formatted). Consecutive gzip members are sent as they are,
+    grouped into payloads bounded by the maximum size of `batch` and by `max_compressed_size`, so that the bulk of the
+    data is never decompressed and compressed again. Members only get split at line boundaries, with `batch`, when they
+    do not fit in a payload on their own, e.g. for files made of a single large member. Members are not scanned past
+    the first one larger than the maximum size of `batch`: it is split along with the members following it, so that
+    they are only decompressed once. """
+
+    def __init__(self, client: BrontoClient, filepath, batch: Batch, max_compressed_size: Optional[int] = None):
+        self.client = client
+        self.filepath = filepath
+        self.batch = batch
+        self.max_size = batch.max_size
+        self.max_compressed_size = max_compressed_size
+
+    def _fits(self, start: int, end: int, size: int) -> bool:
+        if size > self.max_size:
+            return False
+        return self.max_compressed_size is None or end - start <= self.max_compressed_size
+
+    def _send_members(self, data, start: int, end: int):
+        # the payload is a view of the mapped file, so that it is sent without being copied
+        with memoryview(data)[start:end] as payload:
+            self.client.send_compressed_data(payload)
+
+    def _export_lines(self, start: int, end: int):
+        logger.info('Gzip members too large to be sent as they are. Splitting them. start=%s, end=%s', start, end)
+        parser = DefaultParser(GZipFileRange(self.filepath, start, end))
+        BrontoExporter(self.client, parser, self.batch, NoopAggregator()).export()
+
+    def _export_members(self, data):
+        payload_start = payload_end = payload_size = 0
+        for member in _line_aligned_members(scan_members(data, max_size=self.max_size)):
+            if member.end is None or not self._fits(member.start, member.end, member.size):
+                if payload_end > payload_start:
+                    self._send_members(data, payload_start, payload_end)
+                # members that were not scanned to their end are split along with all the members following them
+                end = len(data) if member.end is None else member.end
+                self._export_lines(member.start, end)
+                payload_start = payload_end = end
+                payload_size = 0
+                continue
+            if payload_end > payload_start and not self._fits(payload_start, member.end, payload_size + member.size):
+                self._send_members(data, payload_start, payload_end)
+                payload_start = member.start
+                payload_size = 0
+            payload_end = member.end
+            payload_size += member.size
+        if payload_end > payload_start:
+            self._send_members(data, payload_start, payload_end)
+
+    def export(self):
+        with open(self.filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files cannot be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self._export_members(data)
@@ -0,0 +1,157 @@
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from clients import get_s3_client
+from metrics import STAGES, InvocationMetrics
+
+logger = logging.getLogger()
+
+DEFAULT_PROFILING_DIRECTORY = tempfile.gettempdir()
+# key of events asking for their invocation to be profiled, e.g. {"Records": [...], "profile": true}
+PROFILE_EVENT_KEY = 'profile'
+TOP_FUNCTIONS = 50
+TOP_ALLOCATION_SITES = 25
+MB = 1000 * 1000
+
+
+class ProfileStore:
+    """ Storage of the profiles of invocations """
+
+    def save(self, filename: str, data: bytes):
+        raise NotImplementedError()
+
+
+class LocalFileProfileStore(ProfileStore):
+    """ Keeps profiles as files of a local directory """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def save(self, filename: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        logger.info('Profile saved. path=%s', path)
+
+
+class S3ProfileStore(ProfileStore):
+    """ Keeps profiles as S3 objects under `s3_uri`, i.e. `s3://<bucket>/<prefix>` """
+
+    def __init__(self, s3_uri):
+        bucket_name_and_prefix = s3_uri.replace('s3://', '').split('/', 1)
+        self.bucket_name = bucket_name_and_prefix[0]
+        self.prefix = bucket_name_and_prefix[1] if len(bucket_name_and_prefix) > 1 else ''
+        if self.prefix != '' and not self.prefix.endswith('/'):
+            self.prefix += '/'
+        self.client = get_s3_client()
+
+    def save(self, filename: str, data: bytes):
+        key = self.prefix + filename
+        self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+        logger.info('Profile saved. bucket=%s, key=%s', self.bucket_name, key)
+
+
+class InvocationProfiler:
+    """ Profiles an invocation with cProfile and tracemalloc. Its profile is saved as `<name>.pstats`, which can be
+    loaded with `pstats`, along with `<name>.txt`, a report of the functions taking the most time, of the sites
+    allocating the most memory still held at the end of the invocation, and of the peak memory of each export stage.
+    On Python 3.12 and later, cProfile also profiles the threads the invocation starts. """
+
+    def __init__(self, store: ProfileStore, name: str):
+        self.store = store
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.started_tracing = False
+        self.started_at = None
+        self.duration_sec = None
+        self.snapshot = None
+        self.traced_memory_peak = 0
+
+    def start(self):
+        logger.info('Profiling invocation. name=%s', self.name)
+        # memory may already be traced, e.g. with the PYTHONTRACEMALLOC environment variable
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.started_at = time.perf_counter()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.duration_sec = time.perf_counter() - self.started_at
+        self.snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ])
+        self.traced_memory_peak = tracemalloc.get_traced_memory()[1]
+        if self.started_tracing:
+            tracemalloc.stop()
+
+    def get_report(self, invocation_metrics: InvocationMetrics) -> str:
+        peak_memory = invocation_metrics.get_peak_memory()
+        # the peak of traced memory is reset as export stages start and stop
+        traced_memory_peak = max([self.traced_memory_peak] + [max(stage_peaks.values())
+                                                              for stage_peaks in peak_memory.values()])
+        report = io.StringIO()
+        report.write(f'Profile of invocation {self.name}\n')
+        report.write(f'duration_sec={self.duration_sec:.3f}, traced_memory_peak_mb={traced_memory_peak / MB:.3f}\n\n')
+        report.write('Peak traced memory of export stages (MB):\n')
+        for (log_type, dataset), stage_peaks in peak_memory.items():
+            peaks = ', '.join(f'{stage}={stage_peaks[stage] / MB:.3f}' for stage in STAGES)
+            report.write(f'log_type={log_type}, dataset={dataset}: {peaks}\n')
+        report.write(f'\nTop {TOP_ALLOCATION_SITES} allocation sites of the memory held at the end of the '
+                     f'invocation:\n')
+        for statistic in self.snapshot.statistics('lineno')[:TOP_ALLOCATION_SITES]:
+            report.write(f'{statistic}\n')
+        report.write(f'\nTop {TOP_FUNCTIONS} functions by cumulative time:\n')
+        pstats.Stats(self.profile, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        return report.getvalue()
+
+    def save(self, invocation_metrics: InvocationMetrics):
+        """ Saves the profile. Failing to do so does not fail the invocation. """
+        try:
+            self.store.save(self.name + '.pstats', marshal.dumps(pstats.Stats(self.profile).stats))
+            self.store.save(self.name + '.txt', self.get_report(invocation_metrics).encode())
+        except Exception as e:
+            logger.error('Cannot save profile. name=%s, error=%s', self.name, e)
+
+
+class NoopInvocationProfiler(InvocationProfiler):
+    """ Profiler of invocations that are not profiled: nothing is recorded """
+
+    def __init__(self):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def save(self, invocation_metrics: InvocationMetrics):
+        pass
+
+
+class InvocationProfilerFactory:
+
+    @staticmethod
+    def get_profiler(profiling: bool, profiling_s3_uri=None, profiling_directory=DEFAULT_PROFILING_DIRECTORY,
+                     context=None) -> InvocationProfiler:
+        if not profiling:
+            return NoopInvocationProfiler()
+        # profiles are named after the time and the request ID of the invocation, so that they sort chronologically
+        request_id = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+        name = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()) + '-' + request_id
+        if profiling_s3_uri is not None:
+            return InvocationProfiler(S3ProfileStore(profiling_s3_uri), name)
+        return InvocationProfiler(LocalFileProfileStore(profiling_directory), name)
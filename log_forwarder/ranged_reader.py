@@ -0,0 +1,68 @@
+import io
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Optional
+
+
+class RangedReader(io.RawIOBase):
+    """ Binary file-like object reading an S3 object with concurrent byte-range GETs. Up to `max_concurrency` parts of
+    `part_size` bytes are downloaded ahead of the reader and handed over in order, so that the throughput is not bound
+    by a single connection while memory usage stays bounded by `max_concurrency * part_size`. Parts are requested with
+    the ETag of the object, so that they all belong to the same version of the object. Parts are only requested once
+    the reader is first read, and threads downloading them are stopped once it is closed. """
+
+    def __init__(self, client, bucket, key, size: int, etag: str, part_size: int, max_concurrency: int):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.parts: Deque[Future] = deque()
+        self.next_part_start = 0
+        self.part = memoryview(b'')
+
+    def _start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='ranged-reader')
+        for _ in range(0, self.max_concurrency):
+            self._request_next_part()
+
+    def _get_part(self, start: int, end: int) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end}',
+                                          IfMatch=self.etag)
+        return response['Body'].read()
+
+    def _request_next_part(self):
+        if self.next_part_start >= self.size:
+            return
+        end = min(self.next_part_start + self.part_size, self.size) - 1
+        self.parts.append(self.executor.submit(self._get_part, self.next_part_start, end))
+        self.next_part_start = end + 1
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.executor is None:
+            if self.closed:
+                raise ValueError('I/O operation on closed file')
+            self._start()
+        if len(self.part) == 0:
+            if len(self.parts) == 0:
+                return 0
+            self.part = memoryview(self.parts.popleft().result())
+            self._request_next_part()
+        size = min(len(buffer), len(self.part))
+        buffer[:size] = self.part[:size]
+        self.part = self.part[size:]
+        return size
+
+    def close(self):
+        if not self.closed and self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.parts.clear()
+            self.part = memoryview(b'')
+        super().close()
@@ -0,0 +1,73 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# statuses worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+
+class Deadline:
+    """ Point in time by which the invocation must be done, so that no time is spent waiting for retries that
+    cannot complete anyway """
+
+    # time kept to report errors and return before the invocation times out
+    DEFAULT_SAFETY_MARGIN_SEC = 2
+
+    def __init__(self, remaining_sec: Optional[float] = None):
+        self.expires_at = None if remaining_sec is None else time.monotonic() + remaining_sec
+
+    @staticmethod
+    def from_lambda_context(context, safety_margin_sec=DEFAULT_SAFETY_MARGIN_SEC) -> 'Deadline':
+        """ Returns the deadline of the invocation `context` belongs to, or a deadline that never expires if the
+        remaining time of the invocation is unknown """
+        if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+            return Deadline()
+        return Deadline(context.get_remaining_time_in_millis() / 1000 - safety_margin_sec)
+
+    def get_remaining_sec(self) -> float:
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class RetryPolicy:
+    """ Exponential backoff with full jitter, i.e. the delay before attempt `n + 1` is drawn uniformly between 0 and
+    `base_delay_sec * 2 ** (n - 1)`, capped at `max_delay_sec`. A delay requested by the server with a `Retry-After`
+    header is honoured, up to `max_delay_sec` as well. """
+
+    DEFAULT_MAX_ATTEMPTS = 5
+    DEFAULT_BASE_DELAY_SEC = 1
+    DEFAULT_MAX_DELAY_SEC = 20
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay_sec=DEFAULT_BASE_DELAY_SEC,
+                 max_delay_sec=DEFAULT_MAX_DELAY_SEC, retryable_statuses=RETRYABLE_STATUSES):
+        self.max_attempts = max_attempts
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.retryable_statuses = retryable_statuses
+
+    def is_retryable_status(self, status: int) -> bool:
+        return status in self.retryable_statuses
+
+    def get_delay_sec(self, attempt: int, retry_after_sec: Optional[float] = None) -> float:
+        """ Returns the delay to wait for after the failure of attempt number `attempt` (starting at 1) """
+        delay_sec = random.uniform(0, min(self.max_delay_sec, self.base_delay_sec * 2 ** (attempt - 1)))
+        if retry_after_sec is not None:
+            # servers may ask for delays far longer than the invocation could wait, e.g. with a far-off date
+            return min(max(delay_sec, retry_after_sec), self.max_delay_sec)
+        return delay_sec
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """ Returns the delay in seconds requested by a `Retry-After` header, given either in seconds or as an HTTP
+        date, or None if the header is missing or malformed """
+        if value is None:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,126 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+DEST_CONFIG_ID_GROUP = 'dest_config_id'
+
+_NAMED_GROUP = re.compile(r'\(\?P<(\w+)>')
+_NAMED_BACKREFERENCE = re.compile(r'\(\?P=(\w+)\)')
+# constructs whose meaning changes once patterns are combined: numbered back references, conditionals and inline
+# global flags
+_NOT_COMBINABLE = re.compile(r'\\[1-9]|\(\?\(|\(\?[aiLmsux]+\)')
+_METACHARACTERS = set('.^$*+?{}[]|()')
+_OPTIONAL_QUANTIFIERS = set('*?{')
+
+
+def literal_prefix(pattern: str) -> str:
+    """ Returns the literal string that every key matched by `pattern` starts with (possibly empty) """
+    if '|' in pattern:
+        # an alternation may not require the prefix
+        return ''
+    prefix = []
+    # keys are matched from their start anyway
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            char = pattern[i + 1]
+            i += 1
+        elif char in _METACHARACTERS:
+            if char in _OPTIONAL_QUANTIFIERS and len(prefix) > 0:
+                # the quantified character may not be there
+                prefix.pop()
+            break
+        prefix.append(char)
+        i += 1
+    return ''.join(prefix)
+
+
+class _Matcher:
+    """ Finds the first of a list of rules matching a key. Rules are combined into a single alternation so that they
+    are all tried within one regular expression match, unless they use constructs that cannot be combined. """
+
+    def __init__(self, rule_indices: List[int], patterns: List[str]):
+        self.rule_indices = rule_indices
+        self.combined = None
+        self.patterns = [re.compile(patterns[rule_index]) for rule_index in rule_indices]
+        if any(_NOT_COMBINABLE.search(patterns[rule_index]) is not None for rule_index in rule_indices):
+            return
+        alternatives = []
+        for rule_index in rule_indices:
+            # group names must be unique within the combined pattern
+            pattern = _NAMED_GROUP.sub(rf'(?P<_r{rule_index}_\1>', patterns[rule_index])
+            pattern = _NAMED_BACKREFERENCE.sub(rf'(?P=_r{rule_index}_\1)', pattern)
+            alternatives.append(f'(?P<_r{rule_index}>{pattern})')
+        try:
+            self.combined = re.compile('|'.join(alternatives))
+        except re.error:
+            self.combined = None
+
+    def match(self, key) -> Optional[Tuple[int, Optional[str]]]:
+        if self.combined is not None:
+            matches = self.combined.match(key)
+            if matches is None:
+                return None
+            # the group wrapping a rule is closed last, hence is the last matched group
+            rule_index = int(matches.lastgroup[2:])
+            return rule_index, matches.group(f'_r{rule_index}_{DEST_CONFIG_ID_GROUP}')
+        for rule_index, pattern in zip(self.rule_indices, self.patterns):
+            matches = pattern.match(key)
+            if matches is not None:
+                return rule_index, matches.group(DEST_CONFIG_ID_GROUP)
+        return None
+
+
+class _TrieNode:
+
+    __slots__ = ['children', 'rule_indices', 'matcher']
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.rule_indices: List[int] = []
+        self.matcher: Optional[_Matcher] = None
+
+
+class PathRouter:
+    """ Maps S3 keys to the `dest_config_id` extracted by the first matching rule of the `paths_regex` configuration.
+
+    Rules are indexed by the literal prefix of their pattern in a trie. The rules that can match a key are the ones
+    found along the path of the key in the trie, and they are all tried at once with a precompiled alternation. The
+    cost of routing a key hence depends on the number of rules sharing a prefix with it, rather than on the total
+    number of rules. """
+
+    def __init__(self, paths_regex: List[Dict[str, str]]):
+        self.paths_regex = paths_regex
+        patterns = [path_regex_config.get('pattern') for path_regex_config in paths_regex]
+        self.root = _TrieNode()
+        for rule_index, pattern in enumerate(patterns):
+            node = self.root
+            for char in literal_prefix(pattern):
+                node = node.children.setdefault(char, _TrieNode())
+            node.rule_indices.append(rule_index)
+        self._build_matchers(self.root, [], patterns)
+
+    def _build_matchers(self, node: _TrieNode, inherited_rule_indices: List[int], patterns: List[str]):
+        # a node matches its own rules and the rules of its ancestors, in configuration order
+        rule_indices = sorted(inherited_rule_indices + node.rule_indices)
+        if len(node.rule_indices) > 0:
+            node.matcher = _Matcher(rule_indices, patterns)
+        for child in node.children.values():
+            self._build_matchers(child, rule_indices, patterns)
+
+    def route(self, key) -> Optional[Tuple[int, Optional[str]]]:
+        """ Returns the index of the first rule matching `key` and the `dest_config_id` it extracted, or None if no
+        rule matches """
+        node = self.root
+        matcher = node.matcher
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.matcher is not None:
+                matcher = node.matcher
+        if matcher is None:
+            return None
+        return matcher.match(key)
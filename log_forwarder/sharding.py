@@ -0,0 +1,227 @@
+import gzip
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.connection import Connection
+from queue import Queue
+from typing import Dict, List, Optional, Tuple
+
+from aggregator import NoopAggregator
+from clients import BrontoClient, Batch
+from exporter import BrontoExporter
+from logfile import PlaintextFileRange
+from metrics import ExportMetrics, NoopExportMetrics
+from parser import ParserFactory
+
+logger = logging.getLogger()
+
+# shards smaller than this are not worth the overhead of a parsing process
+MIN_SHARD_SIZE = 4 * 1024 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+_BATCH = 'batch'
+_DONE = 'done'
+_ERROR = 'error'
+
+
+def split_shards(filepath, shard_count, min_shard_size=MIN_SHARD_SIZE, start=0) -> List[Tuple[int, int]]:
+    """ Splits a file from byte offset `start` into up to `shard_count` byte ranges of about the same size, each
+    starting at the start of a line """
+    size = os.path.getsize(filepath)
+    shard_count = max(1, min(shard_count, (size - start) // max(1, min_shard_size)))
+    boundaries = [start]
+    with open(filepath, 'rb') as f:
+        for i in range(1, shard_count):
+            position = start + (size - start) * i // shard_count
+            if position <= boundaries[-1]:
+                continue
+            f.seek(position - 1)
+            # the shard ends with the line the position falls in
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > boundaries[-1]:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+class _PipeClient:
+    """ Client of the exporters of parsing processes, handing compressed batches over to the parent process """
+
+    def __init__(self, connection: Connection):
+        self.connection = connection
+
+    def send_data(self, batch: Batch):
+        self.connection.send((_BATCH, batch.get_compressed_data()))
+
+
+def _parse_shards(connection: Connection):
+    # parsing processes are kept across invocations and parse one shard after another
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        filepath, start, end, log_type, structured_records, header, strip_lines, batch = task
+        try:
+            parser = ParserFactory.get_parser(log_type, PlaintextFileRange(filepath, start, end, strip_lines),
+                                              structured_records)
+            parser.use_header(header)
+            BrontoExporter(_PipeClient(connection), parser, batch, NoopAggregator()).export()
+            connection.send((_DONE, parser.parse_misses))
+        except Exception as e:
+            connection.send((_ERROR, f'{type(e).__name__}: {e}'))
+
+
+class _ParsingProcess:
+
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_parse_shards, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        self.connection.close()
+        self.process.terminate()
+        self.process.join()
+
+
+class ParsingProcessPool:
+    """ Processes parsing shards, kept across warm invocations. Only processes and pipes are used, since the Lambda
+    environment does not support the shared memory that multiprocessing pools and queues rely on. """
+
+    def __init__(self, size: int):
+        self.size = size
+        # processes are forked from a fork server rather than from this process, whose other threads may hold locks
+        # (e.g. of logging or of the compression executor) that would never be released in the forked process. The
+        # fork server is a single-threaded process that has already imported the modules parsing processes run, so
+        # that forking from it is about as fast as forking from this process.
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload([__name__])
+        self.idle_processes: Queue = Queue()
+        self.process_count = 0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> _ParsingProcess:
+        with self.lock:
+            if self.idle_processes.empty() and self.process_count < self.size:
+                self.process_count += 1
+                return _ParsingProcess(self.context)
+        return self.idle_processes.get()
+
+    def release(self, process: _ParsingProcess):
+        if not process.is_alive():
+            # e.g. killed for lack of memory. It is replaced the next time a process is needed
+            process.terminate()
+            with self.lock:
+                self.process_count -= 1
+            return
+        self.idle_processes.put(process)
+
+    def discard(self, process: _ParsingProcess):
+        process.terminate()
+        with self.lock:
+            self.process_count -= 1
+
+
+_PARSING_PROCESS_POOLS: Dict[int, ParsingProcessPool] = {}
+_PARSING_PROCESS_POOLS_LOCK = threading.Lock()
+
+
+def get_parsing_process_pool(size: int) -> ParsingProcessPool:
+    with _PARSING_PROCESS_POOLS_LOCK:
+        pool = _PARSING_PROCESS_POOLS.get(size)
+        if pool is None:
+            pool = ParsingProcessPool(size)
+            _PARSING_PROCESS_POOLS[size] = pool
+        return pool
+
+
+class ShardedBrontoExporter:
+    """ Exporter splitting a plaintext file into shards at line boundaries, parsed concurrently by a pool of
+    processes, so that parsing is not bound to a single core. When `compressed`, the file is a gzip file, which is first
+    decompressed into a spool file next to it. Each shard is exported with its own batches, which parsing processes
+    format and compress, while they are sent from the calling process. Lines of different shards are hence delivered
+    out of order. Lines must be parsed independently of each other, other than with the headers at the start of the
+    file, and not be aggregated. Decompression and parse misses of shards are recorded by `metrics`. """
+
+    def __init__(self, client: BrontoClient, filepath, log_type, structured_records: bool, batch: Batch,
+                 pool: ParsingProcessPool, min_shard_size=MIN_SHARD_SIZE, compressed=False,
+                 metrics: Optional[ExportMetrics] = None):
+        self.client = client
+        self.filepath = filepath
+        self.log_type = log_type
+        self.structured_records = structured_records
+        self.batch = batch
+        self.pool = pool
+        self.min_shard_size = min_shard_size
+        self.compressed = compressed
+        self.metrics = NoopExportMetrics() if metrics is None else metrics
+        self.errors: List[Exception] = []
+
+    def _record_error(self, error: Exception):
+        logger.error('Shard export failed. error=%s', error)
+        self.errors.append(error)
+
+    def _export_shard(self, filepath, start: int, end: int, header):
+        process = self.pool.acquire()
+        try:
+            # lines decompressed from gzip files are stripped, as when read from the gzip file
+            process.connection.send((filepath, start, end, self.log_type, self.structured_records, header,
+                                     self.compressed, self.batch.new_batch()))
+            while True:
+                kind, payload = process.connection.recv()
+                if kind == _DONE:
+                    self.metrics.count('parse_misses', payload)
+                    break
+                if kind == _ERROR:
+                    self._record_error(Exception(f'Shard parsing failed. start={start}, end={end}, error={payload}'))
+                    break
+                if len(self.errors) > 0:
+                    # batches are still received, so that the process gets ready for another shard
+                    continue
+                try:
+                    self.client.send_compressed_data(payload)
+                except Exception as e:
+                    self._record_error(e)
+        except Exception as e:
+            # the state of the process is unknown
+            self._record_error(e)
+            self.pool.discard(process)
+            return
+        self.pool.release(process)
+
+    def _export_shards(self, filepath):
+        # headers (e.g. the columns of VPC flow logs) are read once, and handed over to the parsers of all shards
+        parser = ParserFactory.get_parser(self.log_type, None, self.structured_records)
+        start = parser.read_headers(filepath)
+        header = parser.get_header()
+        shards = split_shards(filepath, self.pool.size, self.min_shard_size, start)
+        logger.info('Exporting shards concurrently. shard_count=%s, process_count=%s', len(shards), self.pool.size)
+        threads = [threading.Thread(target=self._export_shard, args=(filepath, shard_start, shard_end, header))
+                   for shard_start, shard_end in shards]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    def export(self):
+        if not self.compressed:
+            self._export_shards(self.filepath)
+            return
+        # the spool file is removed once closed
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(self.filepath)) as spool:
+            with self.metrics.time('decompress'), gzip.open(self.filepath, 'rb') as f:
+                shutil.copyfileobj(f, spool, SPOOL_CHUNK_SIZE)
+            spool.flush()
+            self._export_shards(spool.name)
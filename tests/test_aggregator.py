@@ -1,7 +1,7 @@
 import pytest
-from queue import Queue
 
-from log_forwarder.aggregator import JavaStackTraceAggregator, NoopAggregator, AggregatorFactory
+from log_forwarder.aggregator import (JavaStackTraceAggregator, NoopAggregator, AggregatorFactory, MultilineAggregator,
+                                     MultilinePattern, MULTILINE_PATTERNS)
 
 
 def test_aggregator_factory_stack_trace():
@@ -18,9 +18,8 @@ def test_aggregator_factory_default():
 
 def test_noop_init():
     aggregator = NoopAggregator()
-    assert isinstance(aggregator.lines, Queue)
-    assert aggregator.lines.maxsize == 2
-    assert aggregator.lines.empty()
+    assert not aggregator.has_complete_aggregated_line()
+    assert aggregator.get_complete_aggregated_line() is None
 
 
 def test_noop_add_single_line():
@@ -55,16 +54,15 @@ def test_noop_add_stack_trace():
 
 def test_init():
     aggregator = JavaStackTraceAggregator()
-    assert isinstance(aggregator.lines, Queue)
-    assert aggregator.lines.maxsize == 2
-    assert aggregator.lines.empty()
+    assert not aggregator.has_complete_aggregated_line()
+    assert aggregator.get_complete_aggregated_line() is None
 
 
 def test_add_line_normal_line():
     aggregator = JavaStackTraceAggregator()
     line = "Exception in thread main java.lang.NullPointerException"
     aggregator.add_line(line)
-    assert aggregator.lines.qsize() == 1
+    assert not aggregator.has_complete_aggregated_line()
     assert aggregator.get_complete_aggregated_line() is None
 
 
@@ -76,8 +74,9 @@ def test_add_line_stack_trace_line():
     aggregator.add_line(main_line)
     aggregator.add_line(stack_line)
 
-    assert aggregator.lines.qsize() == 1
-    result = aggregator.lines.get()
+    assert not aggregator.has_complete_aggregated_line()
+    aggregator.complete()
+    result = aggregator.get_complete_aggregated_line()
     expected = f"{main_line}\\n{stack_line}"
     assert result == expected
 
@@ -90,8 +89,9 @@ def test_add_line_stack_trace_line_with_caused_by():
     aggregator.add_line(main_line)
     aggregator.add_line(stack_line)
 
-    assert aggregator.lines.qsize() == 1
-    result = aggregator.lines.get()
+    assert not aggregator.has_complete_aggregated_line()
+    aggregator.complete()
+    result = aggregator.get_complete_aggregated_line()
     expected = f"{main_line}\\n{stack_line}"
     assert result == expected
 
@@ -103,8 +103,9 @@ def test_add_line_stack_trace_line_with_3_dots():
     aggregator.add_line(main_line)
     aggregator.add_line(stack_line)
 
-    assert aggregator.lines.qsize() == 1
-    result = aggregator.lines.get()
+    assert not aggregator.has_complete_aggregated_line()
+    aggregator.complete()
+    result = aggregator.get_complete_aggregated_line()
     expected = f"{main_line}\\n{stack_line}"
     assert result == expected
 
@@ -118,8 +119,9 @@ def test_add_line_multiple_stack_trace_lines():
     aggregator.add_line(stack_line1)
     aggregator.add_line(stack_line2)
 
-    assert aggregator.lines.qsize() == 1
-    result = aggregator.lines.get()
+    assert not aggregator.has_complete_aggregated_line()
+    aggregator.complete()
+    result = aggregator.get_complete_aggregated_line()
     expected = f"{main_line}\\n{stack_line1}\\n{stack_line2}"
     assert result == expected
 
@@ -127,8 +129,8 @@ def test_add_line_multiple_stack_trace_lines():
 def test_add_line_none():
     aggregator = JavaStackTraceAggregator()
     aggregator.add_line(None)
-    assert aggregator.lines.qsize() == 1
-    assert aggregator.lines.get() is None
+    assert not aggregator.has_complete_aggregated_line()
+    assert aggregator.get_complete_aggregated_line() is None
 
 
 def test_add_line_queue_full_exception():
@@ -136,7 +138,7 @@ def test_add_line_queue_full_exception():
     aggregator.add_line("line1")
     aggregator.add_line("line2")
 
-    with pytest.raises(Exception, match="Aggregator queue is full"):
+    with pytest.raises(Exception, match="Complete aggregated lines must be retrieved first"):
         aggregator.add_line("line3")
 
 
@@ -158,7 +160,9 @@ def test_get_line_full_queue():
 
     result = aggregator.get_complete_aggregated_line()
     assert result == "line1"
-    assert aggregator.lines.qsize() == 1
+    assert not aggregator.has_complete_aggregated_line()
+    aggregator.complete()
+    assert aggregator.get_complete_aggregated_line() == "line2"
 
 
 def test_stack_trace_aggregation_workflow():
@@ -228,4 +232,131 @@ def test_edge_case_stack_trace_prefix():
     aggregator.add_line(None)
     second_result = aggregator.get_complete_aggregated_line()
     expected = f"{not_stack_line}\\n{actual_stack_line}"
-    assert second_result == expected
\ No newline at end of file
+    assert second_result == expected
+
+#
+# Multiline Aggregator
+#
+
+def _aggregate(aggregator, lines):
+    result = []
+    for line in lines:
+        aggregator.add_line(line)
+        if aggregator.has_complete_aggregated_line():
+            result.append(aggregator.get_complete_aggregated_line())
+    aggregator.complete()
+    if aggregator.has_complete_aggregated_line():
+        result.append(aggregator.get_complete_aggregated_line())
+    return result
+
+
+def test_aggregator_factory_presets():
+    aggregator = AggregatorFactory.get_aggregator('python_traceback, go_panic', max_lines=10, max_size=100)
+    assert isinstance(aggregator, MultilineAggregator)
+    assert aggregator.patterns == [MULTILINE_PATTERNS['python_traceback'], MULTILINE_PATTERNS['go_panic']]
+    assert (aggregator.max_lines, aggregator.max_size) == (10, 100)
+    assert isinstance(AggregatorFactory.get_aggregator('python_traceback,unknown'), NoopAggregator)
+    assert isinstance(AggregatorFactory.get_aggregator(None), NoopAggregator)
+
+
+def test_python_traceback():
+    traceback = ['ERROR:root:Request failed', 'Traceback (most recent call last):',
+                 '  File "/var/task/app.py", line 3, in handler', '    raise KeyError(key)', "KeyError: 'id'", '',
+                 'During handling of the above exception, another exception occurred:', '',
+                 'Traceback (most recent call last):', '  File "/var/task/app.py", line 5, in handler',
+                 '    raise ValueError()', 'ValueError']
+    lines = ['INFO:root:Request received'] + traceback + ['INFO:root:Request done: ok']
+    aggregator = AggregatorFactory.get_aggregator('python_traceback')
+    assert _aggregate(aggregator, lines) == [
+        'INFO:root:Request received', '\\n'.join(line for line in traceback if line != ''),
+        'INFO:root:Request done: ok']
+
+
+def test_python_logging_record_after_indented_lines():
+    # the `LEVEL:logger:message` format of the logging module looks like the exception closing a traceback
+    lines = ['INFO:app:config loaded:', '    db=postgres', '    cache=redis', 'WARNING:app:slow request']
+    assert _aggregate(AggregatorFactory.get_aggregator('python_traceback'), lines) == [
+        '\\n'.join(lines[:3]), lines[3]]
+
+
+def test_python_traceback_split_by_max_lines():
+    traceback = ['Traceback (most recent call last):', '  File "/var/task/app.py", line 3, in handler',
+                 '    raise KeyError(key)', "KeyError: 'id'"]
+    aggregator = AggregatorFactory.get_aggregator('python_traceback', max_lines=2)
+    assert _aggregate(aggregator, traceback + ['INFO:root:done']) == [
+        '\\n'.join(traceback[:2]), '\\n'.join(traceback[2:]), 'INFO:root:done']
+
+
+def test_go_panic():
+    panic = ['panic: runtime error: index out of range [5] with length 3', 'goroutine 1 [running]:',
+             'main.lookup(...)', '\t/app/main.go:12', 'net/http.(*conn).serve(0xc000132000, {0x6f3b28, 0xc0001})',
+             '\t/usr/local/go/src/net/http/server.go:2009 +0x8a5', 'created by net/http.(*Server).Serve in goroutine 1',
+             'exit status 2']
+    lines = ['2024/01/01 00:00:00 starting'] + panic + ['2024/01/01 00:00:01 restarting']
+    assert _aggregate(AggregatorFactory.get_aggregator('go_panic'), lines) == [
+        lines[0], '\\n'.join(panic), lines[-1]]
+
+
+def test_dotnet_exception():
+    exception = ['System.InvalidOperationException: Operation failed',
+                 ' ---> System.NullReferenceException: Object reference not set to an instance of an object.',
+                 '   at App.Service.Run() in /src/Service.cs:line 10', '   --- End of inner exception stack trace ---',
+                 '   at App.Program.Main(String[] args) in /src/Program.cs:line 5']
+    lines = ['info: App started'] + exception + ['info: App stopped']
+    assert _aggregate(AggregatorFactory.get_aggregator('dotnet_exception'), lines) == [
+        lines[0], '\\n'.join(exception), lines[-1]]
+
+
+def test_custom_start_pattern():
+    lines = ['2024-01-01 first entry', 'continued', '  indented', '2024-01-02 second entry', 'continued']
+    aggregator = AggregatorFactory.get_aggregator('multiline', start_pattern=r'\d{4}-\d{2}-\d{2} ')
+    assert _aggregate(aggregator, lines) == ['\\n'.join(lines[:3]), '\\n'.join(lines[3:])]
+
+
+def test_multiline_aggregator_requires_patterns():
+    with pytest.raises(ValueError, match='multiline_continuation_pattern and/or multiline_start_pattern'):
+        AggregatorFactory.get_aggregator('multiline')
+    with pytest.raises(ValueError, match='multiline_start_pattern'):
+        AggregatorFactory.get_aggregator('multiline', start_pattern='(')
+    AggregatorFactory.validate('default')
+
+
+def test_max_lines():
+    lines = ['Exception'] + [f'at frame{i}' for i in range(0, 5)]
+    aggregator = JavaStackTraceAggregator(max_lines=4)
+    assert _aggregate(aggregator, lines) == ['\\n'.join(lines[:4]), '\\n'.join(lines[4:])]
+
+
+def test_max_size():
+    lines = ['Exception'] + [f'at frame{i}' for i in range(0, 5)]
+    aggregator = MultilineAggregator([MultilinePattern(continuation='at ')], max_size=len('\\n'.join(lines[:3])))
+    assert _aggregate(aggregator, lines) == ['\\n'.join(lines[:3]), '\\n'.join(lines[3:])]
+
+
+def test_max_size_in_bytes():
+    # continuation lines are 6 characters, but 8 bytes once encoded in UTF-8: all lines would fit in characters
+    lines = ['Exception', 'at été', 'at été', 'at été']
+    aggregator = MultilineAggregator([MultilinePattern(continuation='at ')], max_size=len('Exception') + 3 * (2 + 6))
+    assert _aggregate(aggregator, lines) == ['\\n'.join(lines[:3]), lines[3]]
+
+
+def test_java_stack_traces_are_not_split_by_default():
+    lines = ['Exception'] + [f'at frame{i}' for i in range(0, 2000)]
+    for aggregator in [JavaStackTraceAggregator(), AggregatorFactory.get_aggregator('java_stack_trace')]:
+        assert _aggregate(aggregator, lines) == ['\\n'.join(lines)]
+    aggregator = AggregatorFactory.get_aggregator('java_stack_trace,python_traceback')
+    assert len(_aggregate(aggregator, lines)) == 3
+
+
+def test_continuation_without_entry():
+    assert _aggregate(JavaStackTraceAggregator(), ['at frame0', 'at frame1']) == ['at frame0\\nat frame1']
+
+
+@pytest.mark.parametrize('aggregator_name', ['default', 'java_stack_trace', 'python_traceback,go_panic'])
+def test_add_lines_like_add_line(aggregator_name):
+    lines = ['first', 'Exception', 'at frame0', '', 'at frame1', '   ', 'Traceback (most recent call last):',
+             '  File "app.py", line 1', 'ValueError: x', 'last']
+    expected = _aggregate(AggregatorFactory.get_aggregator(aggregator_name, max_lines=3), lines)
+    aggregator = AggregatorFactory.get_aggregator(aggregator_name, max_lines=3)
+    result = aggregator.add_lines(lines[:4]) + aggregator.add_lines(lines[4:]) + aggregator.add_lines([])
+    assert result + aggregator.finish() == expected
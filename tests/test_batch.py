@@ -1,37 +1,148 @@
 import json
 
-from clients import Batch
+import gzip
+import os
+
+from clients import Batch, CompressedBatch
+from record import StructuredRecord
 
 
 def test_add_to_batch():
     batch = Batch(1)
     entry = "an entry"
-    batch.add(entry)
-    assert batch.get_batch_size() == len(entry)
-    assert batch.get_data() == [entry]
+    assert batch.add(entry)
+    assert batch.get_batch_size() == len('{"log": "an entry"}')
+    assert json.loads(batch.get_formatted_data()) == {'log': entry}
     assert batch.max_size == 1
 
 
 def test_get_formatted_batch():
-    batch = Batch(1)
+    attributes = {'key': 'value'}
+    batch = Batch(1, attributes=attributes)
     entry = "an entry"
     batch.add(entry)
-    attributes = {'key': 'value'}
     expected = {'log': entry}
     expected.update(attributes)
-    assert json.loads(batch.get_formatted_data(attributes)) == expected
+    assert json.loads(batch.get_formatted_data()) == expected
 
 def test_get_formatted_batch_with_no_formatting():
-    batch = Batch(1, no_formatting=True)
+    attributes = {'key': 'value'}
+    batch = Batch(1, no_formatting=True, attributes=attributes)
     entry = "an entry"
     batch.add(entry)
-    attributes = {'key': 'value'}
-    assert batch.get_formatted_data(attributes) == entry
+    assert batch.get_formatted_data() == entry.encode()
+
+def test_get_formatted_batch_like_json_dumps():
+    attributes = {'key': 'välue', 'other_key': 'other "value"'}
+    batch = Batch(1000, attributes=attributes)
+    entries = ['an entry', 'a "quoted"\tentry with ünicode', '']
+    for entry in entries:
+        batch.add(entry)
+    assert batch.get_formatted_data().decode() == '\n'.join(json.dumps({'log': entry, **attributes})
+                                                            for entry in entries)
 
 def test_reset():
     batch = Batch(1)
     entry = "an entry"
     batch.add(entry)
     batch.reset()
-    assert batch.batch == []
-    assert batch.size == 0
+    assert batch.get_formatted_data() == b''
+    assert batch.get_batch_size() == 0
+    batch.add(entry)
+    assert json.loads(batch.get_formatted_data()) == {'log': entry}
+
+
+def test_get_formatted_batch_with_structured_records():
+    attributes = {'key': 'value'}
+    batch = Batch(1000, attributes=attributes)
+    record = StructuredRecord(json.dumps({'field': 'a "value"'}))
+    batch.add(record)
+    batch.add('an entry')
+    assert [json.loads(line) for line in batch.get_formatted_data().split(b'\n')] == [
+        {'log': {'field': 'a "value"'}, 'key': 'value'}, {'log': 'an entry', 'key': 'value'}]
+    batch = Batch(1)
+    batch.add(record)
+    assert json.loads(batch.get_formatted_data()) == {'log': {'field': 'a "value"'}}
+
+
+def test_get_formatted_batch_with_structured_record_and_log_attribute():
+    batch = Batch(1, attributes={'log': 'attribute'})
+    batch.add(StructuredRecord(json.dumps({'field': 'value'})))
+    assert json.loads(batch.get_formatted_data()) == {'log': 'attribute'}
+
+
+def test_batch_size_is_payload_size():
+    batch = Batch(1000, attributes={'key': 'välue'})
+    for entry in ['an entry', 'ünicode entry', 'a "quoted" entry']:
+        assert batch.add(entry)
+    assert batch.get_batch_size() == len(batch.get_formatted_data())
+
+
+def test_batch_does_not_exceed_max_size():
+    entry_size = len('{"log": "entry 0"}')
+    batch = Batch(2 * entry_size + 1)
+    assert batch.add('entry 0')
+    assert batch.add('entry 1')
+    assert not batch.add('entry 2')
+    assert batch.get_batch_size() == 2 * entry_size + 1
+    batch = Batch(1)
+    # a line is always added to an empty batch
+    assert batch.add('entry 0')
+    assert not batch.add('entry 1')
+
+
+def test_compressed_batch():
+    attributes = {'key': 'value'}
+    batch = CompressedBatch(1000, 1000, attributes=attributes)
+    entries = [f'entry {i}' for i in range(0, 10)]
+    for entry in entries:
+        assert batch.add(entry)
+    expected = '\n'.join(json.dumps({'log': entry, **attributes}) for entry in entries).encode()
+    assert batch.get_formatted_data() == expected
+    assert batch.get_batch_size() == len(expected)
+    assert gzip.decompress(batch.get_compressed_data()) == expected
+    batch.reset()
+    assert batch.get_batch_size() == 0
+    assert gzip.decompress(batch.get_compressed_data()) == b''
+
+
+def test_compressed_batch_does_not_exceed_max_compressed_size():
+    max_compressed_size = 10000
+    for entry_size in [10, 100, 1000, 5000]:
+        batch = CompressedBatch(1000000, max_compressed_size)
+        # random entries do not compress
+        while batch.add(os.urandom(entry_size).hex()):
+            pass
+        assert len(batch.get_compressed_data()) <= max_compressed_size
+        assert len(batch.get_compressed_data()) > max_compressed_size - 2 * 2 * entry_size - 100
+        batch = CompressedBatch(1000000, max_compressed_size)
+        while batch.add('a compressible entry ' * (entry_size // 20)):
+            pass
+        assert len(batch.get_compressed_data()) <= max_compressed_size
+
+
+def test_add_lines_like_add():
+    lines = [f'entry {i}' for i in range(0, 100)]
+    for batch in [Batch(200, attributes={'key': 'value'}), CompressedBatch(200, 150)]:
+        expected = batch.new_batch()
+        payloads = []
+        expected_payloads = []
+        start = 0
+        while start < len(lines):
+            start = batch.add_lines(lines, start)
+            payloads.append(bytes(batch.get_formatted_data()))
+            batch.reset()
+        for line in lines:
+            if not expected.add(line):
+                expected_payloads.append(bytes(expected.get_formatted_data()))
+                expected.reset()
+                expected.add(line)
+        expected_payloads.append(bytes(expected.get_formatted_data()))
+        assert payloads == expected_payloads
+
+
+def test_add_lines_to_empty_batch():
+    batch = Batch(1)
+    assert batch.add_lines(['an entry', 'another entry']) == 1
+    assert batch.add_lines(['another entry']) == 0
+    assert batch.add_lines([]) == 0
@@ -0,0 +1,28 @@
+from checkpoint import Checkpoint, LocalFileCheckpointStore, ObjectCheckpointer
+
+
+def test_local_file_checkpoint_store(tmp_path):
+    store = LocalFileCheckpointStore(str(tmp_path / 'checkpoints'))
+    object_id = 's3://my-bucket/some/key.log.gz'
+    assert store.load(object_id) is None
+    store.save(Checkpoint(object_id, 'etag', 10))
+    store.save(Checkpoint(object_id, 'etag', 20))
+    store.save(Checkpoint('s3://my-bucket/other/key.log.gz', 'etag', 5))
+    assert store.load(object_id) == Checkpoint(object_id, 'etag', 20)
+    store.delete(object_id)
+    assert store.load(object_id) is None
+    store.delete(object_id)
+    assert LocalFileCheckpointStore(str(tmp_path / 'checkpoints')).load('s3://my-bucket/other/key.log.gz') == \
+        Checkpoint('s3://my-bucket/other/key.log.gz', 'etag', 5)
+
+
+def test_object_checkpointer(tmp_path):
+    store = LocalFileCheckpointStore(str(tmp_path))
+    checkpointer = ObjectCheckpointer(store, 's3://my-bucket/key', 'etag')
+    assert checkpointer.get_line_offset() == 0
+    checkpointer.acknowledge(42)
+    assert checkpointer.get_line_offset() == 42
+    # the object was replaced since
+    assert ObjectCheckpointer(store, 's3://my-bucket/key', 'other-etag').get_line_offset() == 0
+    checkpointer.complete()
+    assert checkpointer.get_line_offset() == 0
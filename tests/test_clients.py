@@ -0,0 +1,103 @@
+import io
+import urllib.error
+
+import pytest
+
+import clients
+from clients import BrontoClient, S3Client
+from connection import Response
+from ranged_reader import RangedReader
+from retry import Deadline, RetryPolicy
+
+
+class _Pool:
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = 0
+
+    def request(self, *_):
+        self.requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _response(status, headers=None):
+    return Response(status, 'reason', {} if headers is None else headers, b'')
+
+
+@pytest.fixture()
+def sleeps(monkeypatch):
+    _sleeps = []
+    monkeypatch.setattr(clients.time, 'sleep', _sleeps.append)
+    return _sleeps
+
+
+def _client(pool, monkeypatch, retry_policy=None, deadline=None):
+    monkeypatch.setattr(clients, 'get_connection_pool', lambda _: pool)
+    return BrontoClient('api_key', 'endpoint', 'my_dataset', 'my_collection', None, {}, retry_policy, deadline)
+
+
+def test_send_retries_transient_errors(monkeypatch, sleeps):
+    pool = _Pool([ConnectionResetError(), _response(503), _response(429, {'Retry-After': '2'}), _response(200)])
+    _client(pool, monkeypatch, RetryPolicy(max_attempts=4, base_delay_sec=1, max_delay_sec=2)).send_compressed_data(b'')
+    assert pool.requests == 4
+    assert 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2 and sleeps[2] == 2
+
+
+def test_send_does_not_retry_client_errors(monkeypatch, sleeps):
+    pool = _Pool([_response(400)])
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _client(pool, monkeypatch).send_compressed_data(b'')
+    assert e.value.code == 400
+    assert pool.requests == 1
+    assert sleeps == []
+
+
+def test_send_gives_up_after_max_attempts(monkeypatch, sleeps):
+    pool = _Pool([_response(500)] * 3)
+    with pytest.raises(urllib.error.HTTPError):
+        _client(pool, monkeypatch, RetryPolicy(max_attempts=3)).send_compressed_data(b'')
+    assert pool.requests == 3
+    assert len(sleeps) == 2
+
+
+def test_send_fails_fast_near_deadline(monkeypatch, sleeps):
+    pool = _Pool([_response(503, {'Retry-After': '10'}), _response(200)])
+    with pytest.raises(urllib.error.HTTPError):
+        _client(pool, monkeypatch, deadline=Deadline(5)).send_compressed_data(b'')
+    assert pool.requests == 1
+    assert sleeps == []
+
+
+class _S3Client:
+
+    def __init__(self, size):
+        self.size = size
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': self.size, 'ETag': 'etag'}
+
+    def get_object(self, Bucket, Key, **_):
+        return {'Body': io.BytesIO(b'x' * self.size)}
+
+
+def test_large_objects_are_read_with_range_requests(monkeypatch):
+    monkeypatch.setenv('s3_download_part_size', '10')
+    monkeypatch.setenv('s3_download_max_concurrency', '2')
+    s3_client = S3Client()
+    s3_client.client = _S3Client(10)
+    assert not isinstance(s3_client.get_object_body('bucket', 'key'), RangedReader)
+    s3_client.client = _S3Client(11)
+    assert isinstance(s3_client.get_object_body('bucket', 'key'), RangedReader)
+    monkeypatch.setenv('s3_download_max_concurrency', '1')
+    s3_client = S3Client()
+    s3_client.client = _S3Client(11)
+    assert not isinstance(s3_client.get_object_body('bucket', 'key'), RangedReader)
+    # objects are read with a single request by default
+    monkeypatch.delenv('s3_download_max_concurrency')
+    s3_client = S3Client()
+    s3_client.client = _S3Client(11)
+    assert not isinstance(s3_client.get_object_body('bucket', 'key'), RangedReader)
@@ -0,0 +1,65 @@
+import gzip
+import pickle
+import random
+
+import pytest
+
+from clients import Batch, CompressedBatch
+from compression import (PayloadCompressor, ParallelPayloadCompressor, PayloadCompressorFactory,
+                         get_compression_executor)
+
+
+@pytest.fixture()
+def payload():
+    rnd = random.Random(42)
+    return bytearray(b'\n'.join(f'{{"log": "line {i} {rnd.getrandbits(32)}"}}'.encode() for i in range(0, 5000)))
+
+
+@pytest.mark.parametrize('level', [1, 6, 9])
+def test_compress(payload, level):
+    compressed = PayloadCompressor(level).compress(payload)
+    assert gzip.decompress(compressed) == payload
+
+
+def test_lower_level_is_larger(payload):
+    assert len(PayloadCompressor(1).compress(payload)) > len(PayloadCompressor(9).compress(payload))
+
+
+@pytest.mark.parametrize('block_size', [1000, 4096, 50000, 1000000])
+def test_parallel_compress(payload, block_size):
+    compressor = ParallelPayloadCompressor(6, block_size, get_compression_executor(2))
+    compressed = compressor.compress(payload)
+    assert gzip.decompress(compressed) == payload
+
+
+def test_parallel_compress_small_payload():
+    compressor = ParallelPayloadCompressor(6, 1000, get_compression_executor(2))
+    assert gzip.decompress(compressor.compress(b'')) == b''
+    assert gzip.decompress(compressor.compress(b'some line')) == b'some line'
+
+
+def test_factory():
+    assert type(PayloadCompressorFactory.get_payload_compressor(5)) is PayloadCompressor
+    assert type(PayloadCompressorFactory.get_payload_compressor(5, 1000, 1)) is PayloadCompressor
+    compressor = PayloadCompressorFactory.get_payload_compressor(5, 1000, 2)
+    assert type(compressor) is ParallelPayloadCompressor
+    assert compressor.level == 5
+    assert compressor.executor is get_compression_executor(2)
+
+
+def test_parallel_compressor_pickled_as_sequential():
+    compressor = pickle.loads(pickle.dumps(ParallelPayloadCompressor(3, 1000, get_compression_executor(2))))
+    assert type(compressor) is PayloadCompressor
+    assert compressor.level == 3
+
+
+def test_batch_compression_level():
+    batch = Batch(100000, payload_compressor=PayloadCompressor(1))
+    compressed_batch = CompressedBatch(100000, 100000, payload_compressor=PayloadCompressor(1))
+    for i in range(0, 1000):
+        assert batch.add(f'some line {i}')
+        assert compressed_batch.add(f'some line {i}')
+    assert gzip.decompress(batch.get_compressed_data()) == batch.get_formatted_data()
+    assert gzip.decompress(compressed_batch.get_compressed_data()) == batch.get_formatted_data()
+    assert batch.new_batch().payload_compressor is batch.payload_compressor
+    assert compressed_batch.new_batch().payload_compressor is compressed_batch.payload_compressor
@@ -1,9 +1,15 @@
 import base64
+import io
 import json
 import os.path
 import tempfile
+import threading
 
-from config import DestinationConfig, Config
+import pytest
+from botocore.exceptions import ClientError
+
+import config as config_module
+from config import DestinationConfig, Config, DestinationConfigCache
 
 
 def test_destination_config(monkeypatch):
@@ -72,6 +78,14 @@ def test_attributes_config_malformed(monkeypatch):
         config = Config({}, f.name)
         assert config.get_resource_attributes() == {'attr2': 'value2'}
 
+def test_multiline_aggregator_config_without_patterns(monkeypatch):
+    monkeypatch.setenv('aggregator', 'multiline')
+    with tempfile.NamedTemporaryFile() as f:
+        with pytest.raises(ValueError, match='multiline_continuation_pattern'):
+            Config({}, f.name)
+        monkeypatch.setenv('multiline_continuation_pattern', r'\s+')
+        assert Config({}, f.name).aggregator == 'multiline'
+
 def test_tags_config(monkeypatch):
     monkeypatch.setenv('tags', 'attr1=value1,attr2=value2')
     with tempfile.NamedTemporaryFile() as f:
@@ -122,3 +136,66 @@ def test_file_is_deleted_on_close():
         config = Config({}, f.name)
         assert config.get_resource_attributes() == {}
     assert filepath is not None and not os.path.exists(filepath)
+
+
+class _FakeS3Client:
+
+    def __init__(self, content, etag):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.requests.append(IfNoneMatch)
+        if IfNoneMatch == self.etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'},
+                               'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': io.BytesIO(json.dumps(self.content).encode()), 'ETag': self.etag}
+
+
+def test_destination_config_from_s3_is_not_downloaded_again_if_not_modified(monkeypatch):
+    raw_config = {'some_id': {'log_type': 'my_log_type'}}
+    s3_client = _FakeS3Client(raw_config, '"etag1"')
+    monkeypatch.setattr(config_module, 'get_s3_client', lambda: s3_client)
+    monkeypatch.setenv('CONFIG_S3_URI', 's3://my-bucket/my/config.json')
+    dest_config = DestinationConfig()
+    assert dest_config.get_log_type('some_id') == 'my_log_type'
+    refreshed_config = DestinationConfig(dest_config)
+    assert refreshed_config.get_log_type('some_id') == 'my_log_type'
+    assert s3_client.requests == [None, '"etag1"']
+    s3_client.content = {'some_id': {'log_type': 'my_other_log_type'}}
+    s3_client.etag = '"etag2"'
+    assert DestinationConfig(refreshed_config).get_log_type('some_id') == 'my_other_log_type'
+
+
+def test_destination_config_cache(monkeypatch):
+    monkeypatch.setenv('config_cache_ttl_sec', '60')
+    cache = DestinationConfigCache()
+    dest_config = cache.get()
+    assert cache.get() is dest_config
+
+
+def test_destination_config_cache_refreshes_in_background(monkeypatch):
+    monkeypatch.setenv('config_cache_ttl_sec', '60')
+    cache = DestinationConfigCache()
+    dest_config = cache.get()
+    refreshed = threading.Event()
+    refresh = cache._refresh
+
+    def _refresh(*args):
+        refresh(*args)
+        refreshed.set()
+
+    monkeypatch.setattr(cache, '_refresh', _refresh)
+    cache.expires_at = 0
+    # the expired configuration is served while being refreshed
+    assert cache.get() is dest_config
+    assert refreshed.wait(timeout=5)
+    assert cache.get() is not dest_config
+    assert cache.expires_at > 0
+
+
+def test_destination_config_cache_disabled(monkeypatch):
+    monkeypatch.setenv('config_cache_ttl_sec', '0')
+    cache = DestinationConfigCache()
+    assert cache.get() is not cache.get()
@@ -1,10 +1,15 @@
 import base64
 import gzip
+import io
 import json
 import tempfile
 
-from config import Config
-from data_retriever import CloudwatchDataRetriever, LBAccessLogsRetriever, S3AccessLogsRetriever
+import pytest
+
+from clients import S3Client, get_s3_client
+from config import Config, DestinationConfig
+from data_retriever import (CloudwatchDataRetriever, LBAccessLogsRetriever, S3AccessLogsRetriever,
+                            DataRetrieverFactory)
 
 
 def test_cloudwatch():
@@ -51,3 +56,39 @@ def test_s3_access_logs_retriever():
         retriever = S3AccessLogsRetriever(config, src_bucket, s3_key)
         assert retriever.get_data_id() == src_bucket
 
+
+def test_s3_retriever_streaming(monkeypatch):
+    monkeypatch.setenv('streaming', 'true')
+    src_bucket = 'my-bucket'
+    s3_key = f'prefix/{src_bucket}/2024-10-25-13-08-56-some_string-string.log'
+    body = io.BytesIO(b'some data')
+    monkeypatch.setattr(S3Client, 'get_object_body', lambda _, bucket, key: body)
+    monkeypatch.setattr(S3Client, 'download', lambda *_: pytest.fail('data should not be downloaded'))
+    with tempfile.NamedTemporaryFile() as f:
+        config = Config({}, f.name)
+        retriever = S3AccessLogsRetriever(config, src_bucket, s3_key)
+        assert retriever.get_stream() is None
+        retriever.get_data()
+        assert retriever.get_stream() is body
+        retriever.close()
+        assert body.closed
+
+
+def test_s3_retrievers_share_s3_client():
+    with tempfile.NamedTemporaryFile() as f:
+        config = Config({}, f.name)
+        retriever1 = S3AccessLogsRetriever(config, 'my-bucket', 'prefix/my-bucket/some_file.log')
+        retriever2 = S3AccessLogsRetriever(config, 'my-bucket', 'prefix/my-bucket/some_other_file.log')
+        assert retriever1.s3_client.client is retriever2.s3_client.client
+        assert retriever1.s3_client.client is get_s3_client()
+
+
+def test_s3_retriever_object_version():
+    event = {'Records': [{'s3': {'bucket': {'name': 'my-bucket'},
+                                 'object': {'key': 'prefix/my-bucket/some_file.log', 'eTag': 'some-etag'}}},
+                         {'s3': {'bucket': {'name': 'my-bucket'}, 'object': {'key': 'prefix/my-bucket/other_file.log'}}}]}
+    with tempfile.NamedTemporaryFile() as f:
+        config = Config(event, f.name)
+        retrievers = DataRetrieverFactory.get_data_retrievers(config, DestinationConfig())
+        assert retrievers[0].get_object_version() == ('s3://my-bucket/prefix/my-bucket/some_file.log', 'some-etag')
+        assert retrievers[1].get_object_version() is None
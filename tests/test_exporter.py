@@ -1,12 +1,20 @@
+import gzip
+import json
+import random
 import tempfile
+import threading
+import time
 import pytest
 from typing import List
 
-from exporter import BrontoExporter
+from exporter import BrontoExporter, PipelinedBrontoExporter
 from clients import BrontoClient, Batch
 from logfile import LogFileFactory
 from parser import ParserFactory
 from aggregator import JavaStackTraceAggregator, NoopAggregator
+from checkpoint import LocalFileCheckpointStore, ObjectCheckpointer
+from exceptions import ExportInterruptedException
+from retry import Deadline
 
 
 class TestBrontoExporter:
@@ -38,11 +46,11 @@ class TestBrontoExporter:
 
     @pytest.fixture()
     def batch(self):
-        return Batch(2)
+        return Batch(2, attributes={'key': 'value', 'service': 'test'})
 
-    @pytest.fixture()
-    def attributes(self, parser, batch, java_stacktrace_aggregator, client):
-        return {'key': 'value', 'service': 'test'}
+    @staticmethod
+    def get_logs(batch: Batch) -> List[str]:
+        return [json.loads(line)['log'] for line in batch.get_formatted_data().splitlines()]
 
     @staticmethod
     def add_lines_to_file(lines: List[str], filename):
@@ -50,64 +58,157 @@ class TestBrontoExporter:
             for line in lines:
                 f.write(line + '\n')
 
-    def test_export_no_lines(self, parser, batch, java_stacktrace_aggregator, client, attributes, monkeypatch):
-        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator, attributes)
+    def test_export_no_lines(self, parser, batch, java_stacktrace_aggregator, client, monkeypatch):
+        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator)
         sent_batches = []
         monkeypatch.setattr(BrontoClient, 'send_data', lambda b: sent_batches.append(b))
         exporter.export()
 
         assert sent_batches == []
 
-    def test_export_as_many_lines_as_max_batch_size(self, parser, batch, java_stacktrace_aggregator, client, attributes, monkeypatch):
+    def test_export_as_many_lines_as_max_batch_size(self, parser, batch, java_stacktrace_aggregator, client, monkeypatch):
         input_lines = [f'log line {i}' for i in range(0, batch.max_size)]
-        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator, attributes)
+        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator)
         TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
         sent_lines = []
-        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b, __: sent_lines.extend(b.get_data()))
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
         exporter.export()
         assert sent_lines == [input_line.rstrip('\n') for input_line in input_lines]
 
-    def test_export_less_lines_than_max_batch_size(self, parser, batch, java_stacktrace_aggregator, client, attributes, monkeypatch):
+    def test_export_less_lines_than_max_batch_size(self, parser, batch, java_stacktrace_aggregator, client, monkeypatch):
         input_lines = [f'log line {i}' for i in range(0, batch.max_size - 1)]
-        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator, attributes)
+        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator)
         TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
         sent_lines = []
-        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b, __: sent_lines.extend(b.get_data()))
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
         exporter.export()
         assert sent_lines == [input_line.rstrip('\n') for input_line in input_lines]
 
-    def test_export_more_lines_then_max_batch_size(self, parser, batch, java_stacktrace_aggregator, client, attributes, monkeypatch):
+    def test_export_more_lines_then_max_batch_size(self, parser, batch, java_stacktrace_aggregator, client, monkeypatch):
         input_lines = [f'log line {i}' for i in range(0, batch.max_size + 1)]
-        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator, attributes)
+        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator)
         TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
         sent_lines = []
-        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b, __: sent_lines.extend(b.get_data()))
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
         exporter.export()
         assert sent_lines == [input_line.rstrip('\n') for input_line in input_lines]
 
-    def test_export_with_stack_trace(self, parser, batch, java_stacktrace_aggregator, client, attributes, monkeypatch):
+    def test_export_with_stack_trace(self, parser, batch, java_stacktrace_aggregator, client, monkeypatch):
         input_lines = ['line.with.SomeException', 'at some.more.specific.line:123']
-        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator, attributes)
+        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator)
         TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
         sent_lines = []
-        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b, __: sent_lines.extend(b.get_data()))
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
         exporter.export()
         assert sent_lines == [f'{input_lines[0].rstrip('\n')}\\n{input_lines[1]}']
 
-    def test_export_with_stack_trace_with_return(self, parser, batch, java_stacktrace_aggregator, client, attributes, monkeypatch):
+    def test_export_with_stack_trace_with_return(self, parser, batch, java_stacktrace_aggregator, client, monkeypatch):
         input_lines = ['line.with.SomeException\n', 'at some.more.specific.line:123']
-        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator, attributes)
+        exporter = BrontoExporter(client, parser, batch, java_stacktrace_aggregator)
         TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
         sent_lines = []
-        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b, __: sent_lines.extend(b.get_data()))
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
         exporter.export()
         assert sent_lines == [f'{input_lines[0].rstrip('\n')}\\n{input_lines[1]}']
 
-    def test_export_with_noop_aggregator(self, parser, batch, noop_aggregator, client, attributes, monkeypatch):
+    def test_export_with_noop_aggregator(self, parser, batch, noop_aggregator, client, monkeypatch):
         input_lines = [f'log line {i}' for i in range(0, batch.max_size)]
-        exporter = BrontoExporter(client, parser, batch, noop_aggregator, attributes)
+        exporter = BrontoExporter(client, parser, batch, noop_aggregator)
         TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
         sent_lines = []
-        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b, __: sent_lines.extend(b.get_data()))
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
         exporter.export()
         assert sent_lines == [input_line.rstrip('\n') for input_line in input_lines]
+
+    def test_pipelined_export(self, parser, batch, noop_aggregator, client, monkeypatch):
+        input_lines = [f'log line {i}' for i in range(0, 20)]
+        exporter = PipelinedBrontoExporter(client, parser, batch, noop_aggregator, 4)
+        TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
+        sent_lines = []
+        lock = threading.Lock()
+
+        def send_compressed_data(_, compressed_data):
+            with lock:
+                sent_lines.extend(json.loads(line)['log'] for line in gzip.decompress(compressed_data).splitlines())
+
+        monkeypatch.setattr(BrontoClient, 'send_compressed_data', send_compressed_data)
+        exporter.export()
+        assert sorted(sent_lines) == sorted(input_lines)
+
+    def test_pipelined_export_overlaps_sends(self, parser, batch, noop_aggregator, client, monkeypatch):
+        input_lines = [f'log line {i}' for i in range(0, 8)]
+        exporter = PipelinedBrontoExporter(client, parser, batch, noop_aggregator, 4)
+        TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
+        monkeypatch.setattr(BrontoClient, 'send_compressed_data', lambda *_: time.sleep(0.1))
+        start = time.monotonic()
+        exporter.export()
+        assert time.monotonic() - start < 0.1 * len(input_lines)
+
+    def test_pipelined_export_failure(self, parser, batch, noop_aggregator, client, monkeypatch):
+        input_lines = [f'log line {i}' for i in range(0, 20)]
+        exporter = PipelinedBrontoExporter(client, parser, batch, noop_aggregator, 2)
+        TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
+
+        def send_compressed_data(*_):
+            raise ValueError('some error')
+
+        monkeypatch.setattr(BrontoClient, 'send_compressed_data', send_compressed_data)
+        with pytest.raises(ValueError):
+            exporter.export()
+
+    @pytest.fixture()
+    def checkpointer(self, tmp_path):
+        return ObjectCheckpointer(LocalFileCheckpointStore(str(tmp_path)), 's3://my-bucket/my-key', 'etag')
+
+    def test_export_resumes_from_checkpoint(self, parser, batch, java_stacktrace_aggregator, client, checkpointer,
+                                            monkeypatch):
+        input_lines = ['line.with.SomeException', 'at some.more.specific.line:123', 'log line 2', 'log line 3',
+                       'log line 4']
+        TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
+        sent_lines = []
+
+        def send_data(_, b):
+            if len(sent_lines) == 2:
+                raise ValueError('some error')
+            sent_lines.extend(TestBrontoExporter.get_logs(b))
+
+        monkeypatch.setattr(BrontoClient, 'send_data', send_data)
+        with pytest.raises(ValueError):
+            BrontoExporter(client, parser, batch, java_stacktrace_aggregator, checkpointer).export()
+        assert sent_lines == ['line.with.SomeException\\nat some.more.specific.line:123', 'log line 2']
+        assert checkpointer.get_line_offset() == 3
+
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
+        # the retried invocation reads the object again
+        parser = ParserFactory.get_parser('cloudwatch_log',
+                                          LogFileFactory.get_log_file('cloudwatch_log', parser.input_file.filepath))
+        BrontoExporter(client, parser, batch.new_batch(), JavaStackTraceAggregator(), checkpointer).export()
+        assert sent_lines == ['line.with.SomeException\\nat some.more.specific.line:123', 'log line 2',
+                              'log line 3', 'log line 4']
+        # the export is complete
+        assert checkpointer.get_line_offset() == 0
+
+    def test_export_stops_when_out_of_time(self, parser, batch, noop_aggregator, client, checkpointer, monkeypatch):
+        input_lines = [f'log line {i}' for i in range(0, 5)]
+        TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
+        sent_lines = []
+        monkeypatch.setattr(BrontoClient, 'send_data', lambda _, b: sent_lines.extend(TestBrontoExporter.get_logs(b)))
+        exporter = BrontoExporter(client, parser, batch, noop_aggregator, checkpointer, Deadline(10),
+                                  min_remaining_sec=20)
+        with pytest.raises(ExportInterruptedException):
+            exporter.export()
+        assert sent_lines == ['log line 0']
+        assert checkpointer.get_line_offset() == 1
+
+    def test_pipelined_export_checkpoints_acknowledged_batches(self, parser, batch, noop_aggregator, client,
+                                                               checkpointer, monkeypatch):
+        input_lines = [f'log line {i}' for i in range(0, 20)]
+        exporter = PipelinedBrontoExporter(client, parser, batch, noop_aggregator, 4, checkpointer)
+        TestBrontoExporter.add_lines_to_file(input_lines, parser.input_file.filepath)
+        line_offsets = []
+        monkeypatch.setattr(ObjectCheckpointer, 'acknowledge', lambda _, line_offset: line_offsets.append(line_offset))
+        # batches get acknowledged out of order
+        monkeypatch.setattr(BrontoClient, 'send_compressed_data', lambda *_: time.sleep(random.uniform(0, 0.01)))
+        exporter.export()
+        assert line_offsets == sorted(line_offsets)
+        assert line_offsets[-1] == len(input_lines)
@@ -0,0 +1,137 @@
+import base64
+import gzip
+import json
+import threading
+import time
+
+import pytest
+
+import forward
+from clients import BrontoClient
+from config import Config, DestinationConfig, VPC_FLOW_LOG_TYPE
+from data_retriever import DataRetriever, DataRetrieverFactory
+from sharding import ShardedBrontoExporter
+
+
+def _records(count):
+    return {'Records': [{'s3': {'bucket': {'name': 'my_bucket'}, 'object': {'key': f'key_{i}'}}}
+                        for i in range(0, count)]}
+
+
+def test_records_are_processed_concurrently(monkeypatch):
+    monkeypatch.setenv('max_concurrency', '4')
+    retrievers = [object() for _ in range(0, 4)]
+    monkeypatch.setattr(DataRetrieverFactory, 'get_data_retrievers', lambda *_: retrievers)
+    processed = []
+    lock = threading.Lock()
+
+    def _process_retriever(data_retriever, config, dest_config):
+        time.sleep(0.2)
+        with lock:
+            processed.append(data_retriever)
+
+    monkeypatch.setattr(forward, '_process_retriever', _process_retriever)
+    start = time.monotonic()
+    forward.process(_records(len(retrievers)))
+    assert time.monotonic() - start < 0.2 * len(retrievers)
+    assert sorted(map(id, processed)) == sorted(map(id, retrievers))
+
+
+@pytest.mark.parametrize('max_concurrency', ['1', None])
+def test_records_are_processed_sequentially_when_concurrency_is_one(monkeypatch, max_concurrency):
+    # records are processed one after the other by default
+    if max_concurrency is not None:
+        monkeypatch.setenv('max_concurrency', max_concurrency)
+    else:
+        monkeypatch.delenv('max_concurrency', raising=False)
+    retrievers = [object() for _ in range(0, 3)]
+    monkeypatch.setattr(DataRetrieverFactory, 'get_data_retrievers', lambda *_: retrievers)
+    processed = []
+    monkeypatch.setattr(forward, '_process_retriever',
+                        lambda r, *_: processed.append((r, threading.current_thread())))
+    forward.process(_records(len(retrievers)))
+    assert processed == [(r, threading.current_thread()) for r in retrievers]
+
+
+def test_profiled_records_are_processed_sequentially(monkeypatch, tmp_path):
+    monkeypatch.setenv('max_concurrency', '4')
+    monkeypatch.setenv('profiling_directory', str(tmp_path))
+    retrievers = [object() for _ in range(0, 3)]
+    monkeypatch.setattr(DataRetrieverFactory, 'get_data_retrievers', lambda *_: retrievers)
+    threads = set()
+
+    def _process_retriever(data_retriever, config, dest_config):
+        threads.add(threading.current_thread())
+
+    monkeypatch.setattr(forward, '_process_retriever', _process_retriever)
+    forward.process(dict(_records(len(retrievers)), profile=True))
+    assert threads == {threading.current_thread()}
+
+
+def test_record_failure_is_raised_after_other_records_complete(monkeypatch):
+    monkeypatch.setenv('max_concurrency', '4')
+    retrievers = ['ok', 'failing', 'ok']
+    monkeypatch.setattr(DataRetrieverFactory, 'get_data_retrievers', lambda *_: retrievers)
+    processed = []
+
+    def _process_retriever(data_retriever, config, dest_config):
+        if data_retriever == 'failing':
+            raise ValueError('some error')
+        processed.append(data_retriever)
+
+    monkeypatch.setattr(forward, '_process_retriever', _process_retriever)
+    with pytest.raises(ValueError):
+        forward.process(_records(len(retrievers)))
+    assert processed == ['ok', 'ok']
+
+
+class _LocalDataRetriever(DataRetriever):
+
+    def __init__(self, data_id, data: bytes):
+        self.data_id = data_id
+        self.data = data
+
+    def get_collection_type(self):
+        return 's3'
+
+    def get_data(self):
+        with open(self.filepath, 'wb') as f:
+            f.write(self.data)
+
+    def get_data_id(self):
+        return self.data_id
+
+
+def test_gzip_vpc_flow_logs_are_sharded(monkeypatch):
+    monkeypatch.setenv('parsing_processes', '2')
+    monkeypatch.setenv('structured_records', 'true')
+    monkeypatch.setenv('emit_metrics', 'true')
+    raw_config = {'vpc': {'log_type': VPC_FLOW_LOG_TYPE, 'dataset': 'my_dataset', 'collection': 'my_collection'}}
+    monkeypatch.setenv('destination_config', base64.b64encode(json.dumps(raw_config).encode()).decode())
+    lines = ['srcaddr dstaddr action'] + [f'10.0.0.{i % 256} 10.0.1.1 ACCEPT' for i in range(0, 1000)] + \
+        ['not a flow log']
+    data_retriever = _LocalDataRetriever('vpc', gzip.compress(('\n'.join(lines) + '\n').encode()))
+    exporters = []
+    export = ShardedBrontoExporter.export
+
+    def export_shards(exporter):
+        exporters.append(exporter)
+        export(exporter)
+
+    monkeypatch.setattr(ShardedBrontoExporter, 'export', export_shards)
+    sent_logs = []
+    lock = threading.Lock()
+
+    def send_compressed_data(_, compressed_data):
+        with lock:
+            sent_logs.extend(json.loads(line)['log'] for line in gzip.decompress(compressed_data).splitlines())
+
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', send_compressed_data)
+    config = Config({})
+    forward._process_retriever(data_retriever, config, DestinationConfig())
+
+    assert len(exporters) == 1
+    assert len(sent_logs) == 1001
+    assert sum(set(log) == {'srcaddr', 'dstaddr', 'action'} for log in sent_logs if isinstance(log, dict)) == 1000
+    document = config.invocation_metrics.get_documents(timestamp_ms=0)[0]
+    assert document['ParseMisses'] == 1
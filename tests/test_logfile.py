@@ -1,7 +1,12 @@
+import io
 import os
 import gzip
 
-from logfile import PlaintextFile, GZipFile
+import pytest
+
+from config import ALB_ACCESS_LOG_TYPE, S3_ACCESS_LOG_TYPE
+from logfile import (PlaintextFile, GZipFile, PlaintextStream, GZipStream, LogFileFactory,
+                     PlaintextFileRange, _read_line_blocks, _read_mapped_line_blocks, chunk_lines)
 
 
 def test_plaintext(tmp_path):
@@ -26,3 +31,76 @@ def test_gzip(tmp_path):
             f.write((entry + '\n').encode())
     my_file = GZipFile(filepath)
     assert list(my_file.get_lines()) == entries
+
+
+def test_plaintext_stream():
+    entries = ['some entry 1', '  at some entry 2', 'some entry 3']
+    stream = io.BytesIO(('\n'.join(entries) + '\n').encode())
+    my_file = LogFileFactory.get_log_stream(S3_ACCESS_LOG_TYPE, stream)
+    assert isinstance(my_file, PlaintextStream)
+    assert list(my_file.get_lines()) == entries
+    assert stream.closed
+
+
+def test_gzip_stream():
+    entries = ['some entry 1', 'some entry 2']
+    stream = io.BytesIO(gzip.compress(('\n'.join(entries) + '\n').encode()))
+    my_file = LogFileFactory.get_log_stream(ALB_ACCESS_LOG_TYPE, stream)
+    assert isinstance(my_file, GZipStream)
+    assert list(my_file.get_lines()) == entries
+    assert stream.closed
+
+
+def test_stream_lines_spanning_chunks():
+    entries = [f'entry {i}' for i in range(0, 100)]
+    stream = io.BytesIO('\n'.join(entries).encode())
+    assert [line for lines in _read_line_blocks(stream, chunk_size=7) for line in lines] == entries
+
+
+def test_stream_line_spanning_several_chunks():
+    entries = ['a' * 20, 'é' * 10, '', 'b']
+    stream = io.BytesIO('\n'.join(entries).encode())
+    assert [line for lines in _read_line_blocks(stream, chunk_size=3) for line in lines] == entries
+
+
+def test_plaintext_empty_file(tmp_path):
+    filepath = os.path.join(tmp_path, 'some_file')
+    open(filepath, 'w').close()
+    assert list(PlaintextFile(filepath).get_lines()) == []
+
+
+@pytest.mark.parametrize('block_size', [1, 5, 16, 1024])
+def test_mapped_line_blocks(tmp_path, block_size):
+    filepath = os.path.join(tmp_path, 'some_file')
+    entries = [f'entry {i}' for i in range(0, 50)] + ['', '  indented entry', 'é' * 20, 'last']
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(entries))
+    with open(filepath, 'rb') as f:
+        assert [line for lines in _read_mapped_line_blocks(f, block_size=block_size) for line in lines] == entries
+        middle = f.read().index(b'\n', os.path.getsize(filepath) // 2) + 1
+        lines = [line for lines in _read_mapped_line_blocks(f, 0, middle, block_size) for line in lines]
+        lines += [line for lines in _read_mapped_line_blocks(f, middle, block_size=block_size) for line in lines]
+    assert lines == entries
+
+
+def test_plaintext_file_range(tmp_path):
+    filepath = os.path.join(tmp_path, 'some_file')
+    entries = ['entry 1  ', '  entry 2', 'entry 3\r']
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(entries) + '\n')
+    start = len(entries[0]) + 1
+    assert list(PlaintextFileRange(filepath, start, os.path.getsize(filepath)).get_lines()) == ['  entry 2', 'entry 3']
+    assert list(PlaintextFile(filepath).get_lines()) == ['entry 1', '  entry 2', 'entry 3']
+
+
+def test_chunk_lines():
+    assert list(chunk_lines(iter(range(0, 5)), size=2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunk_lines([], size=2)) == []
+
+
+def test_line_chunks(tmp_path):
+    filepath = os.path.join(tmp_path, 'some_file')
+    entries = [f'  entry {i}  ' for i in range(0, 10)]
+    with gzip.open(filepath, 'wt') as f:
+        f.write('\n'.join(entries) + '\n')
+    assert list(GZipFile(filepath).get_line_chunks()) == [[entry.strip() for entry in entries]]
@@ -0,0 +1,154 @@
+import io
+import json
+import tempfile
+
+import metrics
+from aggregator import NoopAggregator
+from clients import BrontoClient, Batch
+from exporter import BrontoExporter
+from logfile import LogFileFactory, PlaintextFile, TimedLogFile
+from metrics import ExportMetrics, InvocationMetrics, NoopInvocationMetrics
+from parser import ParserFactory
+
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_nested_stages_are_timed_exclusively(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(metrics, 'perf_counter', clock)
+    export_metrics = ExportMetrics()
+    with export_metrics.time('parse'):
+        clock.now += 1
+        with export_metrics.time('decompress'):
+            clock.now += 2
+        clock.now += 3
+    clock.now += 4
+    export_metrics.finish()
+
+    durations = export_metrics.get_durations()
+    assert durations['parse'] == 4
+    assert durations['decompress'] == 2
+    assert durations['send'] == 0
+    assert export_metrics.get_export_duration() == 10
+
+
+def test_timed_iterable(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(metrics, 'perf_counter', clock)
+    export_metrics = ExportMetrics()
+
+    def items():
+        for item in range(0, 3):
+            clock.now += 1
+            yield item
+
+    received = []
+    for item in export_metrics.timed('parse', items()):
+        # time spent consuming items is not counted
+        clock.now += 10
+        received.append(item)
+    assert received == [0, 1, 2]
+    assert export_metrics.get_durations()['parse'] == 3
+
+
+def test_counts():
+    export_metrics = ExportMetrics()
+    export_metrics.count('lines', 3)
+    export_metrics.count('lines', 2)
+    export_metrics.count('batches')
+    counts = export_metrics.get_counts()
+    assert counts['lines'] == 5
+    assert counts['batches'] == 1
+    assert counts['parse_misses'] == 0
+
+
+def test_documents_are_grouped_by_log_type_and_dataset(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(metrics, 'perf_counter', clock)
+    invocation_metrics = InvocationMetrics('MyNamespace')
+    for log_type, dataset, lines in [('alb_access_log', 'alb', 10), ('alb_access_log', 'alb', 30), (None, None, 5)]:
+        export_metrics = invocation_metrics.new_export_metrics()
+        export_metrics.set_dimensions(log_type, dataset)
+        with export_metrics.time('send'):
+            clock.now += 0.5
+        export_metrics.count('lines', lines)
+        export_metrics.finish()
+
+    documents = {(document['log_type'], document['dataset']): document
+                 for document in invocation_metrics.get_documents(timestamp_ms=1000)}
+    assert set(documents) == {('alb_access_log', 'alb'), ('default', 'default')}
+    document = documents[('alb_access_log', 'alb')]
+    assert document['_aws']['Timestamp'] == 1000
+    directive = document['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'MyNamespace'
+    assert directive['Dimensions'] == [['log_type', 'dataset']]
+    assert {'Name': 'SendTime', 'Unit': 'Milliseconds'} in directive['Metrics']
+    # every metric of the directive has a value
+    assert all(metric['Name'] in document for metric in directive['Metrics'])
+    assert document['Records'] == 2
+    assert document['Lines'] == 40
+    assert document['SendTime'] == 1000
+    assert document['ExportTime'] == 1000
+    assert document['LinesPerSecond'] == 40
+    assert documents[('default', 'default')]['Lines'] == 5
+
+
+def test_emit_writes_a_json_document_per_line():
+    invocation_metrics = InvocationMetrics()
+    invocation_metrics.new_export_metrics().set_dimensions('alb_access_log', 'alb')
+    invocation_metrics.new_export_metrics().set_dimensions('s3_access_log', 's3')
+    output = io.StringIO()
+    invocation_metrics.emit(output)
+    documents = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [document['dataset'] for document in documents] == ['alb', 's3']
+
+
+def test_noop_invocation_metrics_emit_nothing():
+    invocation_metrics = NoopInvocationMetrics()
+    export_metrics = invocation_metrics.new_export_metrics()
+    with export_metrics.time('parse'):
+        export_metrics.count('lines', 10)
+    assert list(export_metrics.timed('parse', [1, 2])) == [1, 2]
+    output = io.StringIO()
+    invocation_metrics.emit(output)
+    assert output.getvalue() == ''
+    assert export_metrics.get_counts()['lines'] == 0
+
+
+def test_export_is_measured(monkeypatch):
+    filepath = tempfile.NamedTemporaryFile(delete=True, delete_on_close=True).name
+    with open(filepath, 'w') as f:
+        f.write('not an access log\n')
+        for i in range(0, 9):
+            f.write(f'log line {i}\n')
+    export_metrics = ExportMetrics()
+    log_file = TimedLogFile(LogFileFactory.get_log_file('cloudwatch_log', filepath), export_metrics)
+    parser = ParserFactory.get_parser('cloudwatch_log', log_file)
+    client = BrontoClient('api_key', 'endpoint', 'my_dataset', 'my_collection', None, {}, metrics=export_metrics)
+    monkeypatch.setattr(BrontoClient, '_send_batch', lambda *_: None)
+    # each line gets a batch of its own
+    BrontoExporter(client, parser, Batch(16), NoopAggregator(), metrics=export_metrics).export()
+
+    counts = export_metrics.get_counts()
+    assert counts['lines'] == 10
+    assert counts['batches'] == 10
+    assert counts['raw_bytes'] > 0
+    assert counts['compressed_bytes'] > 0
+    durations = export_metrics.get_durations()
+    assert all(durations[stage] > 0 for stage in ['decompress', 'parse', 'format', 'compress'])
+
+
+def test_parse_misses_are_counted():
+    filepath = tempfile.NamedTemporaryFile(delete=True, delete_on_close=True).name
+    with open(filepath, 'w') as f:
+        f.write('not an access log\n')
+    parser = ParserFactory.get_parser('alb_access_log', PlaintextFile(filepath))
+    assert list(parser.get_parsed_lines()) == ['not an access log']
+    assert parser.parse_misses == 1
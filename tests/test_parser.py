@@ -1,9 +1,13 @@
+import io
 import json
-from parser import ParserFactory
+import pytest
+from logfile import PlaintextStream
+from parser import ParserFactory, Parser, TokenizedParser
+from record import StructuredRecord
 
 from config import (CLOUDFRONT_REALTIME_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_TYPE, NLB_ACCESS_LOG_TYPE,
                     CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, CLASSIC_LB_ACCESS_LOG_TYPE, CLOUDTRAIL_LOG_TYPE,
-                    S3_ACCESS_LOG_TYPE, CLOUDWATCH_LOG_TYPE)
+                    S3_ACCESS_LOG_TYPE, CLOUDWATCH_LOG_TYPE, VPC_FLOW_LOG_TYPE)
 
 # https://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html#access-log-entry-examples
 ALB_ACCESS_LOG_SAMPLE = 'https 2018-07-02T22:23:00.186641Z app/my-loadbalancer/50dc6c495c0c9188 192.168.131.39:2817 10.0.0.1:80 0.086 0.048 0.037 200 200 0 57 "GET https://www.example.com:443/ HTTP/1.1" "curl/7.46.0" ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 arn:aws:elasticloadbalancing:us-east-2:123456789012:targetgroup/my-targets/73e2d6bc24d8a067 "Root=1-58337281-1d84f3d73c47ec4e58577259" "www.example.com" "arn:aws:acm:us-east-2:123456789012:certificate/12345678-1234-1234-1234-123456789012" 1 2018-07-02T22:22:48.364000Z "authenticate,forward" "-" "-" "10.0.0.1:80" "200" "-" "-" TID_1234567890'
@@ -237,3 +241,153 @@ def test_cloudtrail_log_parser():
     parsed = parser.parse(CLOUDTRAIL_LOG_SAMPLE)
     data = json.loads(parsed)
     assert data['Records'][0]['eventName'] == 'StartInstances'
+
+
+# Variants of the samples above with missing, empty or optional fields, which must be parsed the same way by the
+# tokenizer and by the regular expressions
+TOKENIZED_LOG_SAMPLES = [
+    (S3_ACCESS_LOG_TYPE, S3_ACCESS_LOG_SAMPLE),
+    (S3_ACCESS_LOG_TYPE, 'owner bucket [06/Feb/2019:00:00:38 +0000] 192.0.2.3 - 3E57427F3EXAMPLE REST.GET.OBJECT '
+                         'key.txt - - - - 0 - - - - - -'),
+    (S3_ACCESS_LOG_TYPE, 'owner bucket [06/Feb/2019:00:00:38 +0000] 2001:db8::1 requester ID WEBSITE.GET.OBJECT key '
+                         '"-" 404 NoSuchKey 348 - 11 - "https://example.com/ref" "Mozilla/5.0 (X11; Linux x86_64)" '
+                         'version host SigV4 - QueryString bucket.s3.amazonaws.com TLSv1.3'),
+    (S3_ACCESS_LOG_TYPE, 'owner bucket [06/Feb/2019:00:00:38 +0000] 192.0.2.3 requester ID REST.PUT.OBJECT a/b '
+                         '"PUT /bucket/a/b?partNumber=1 HTTP/1.1" 200 - - 5242880 130 44 "" "aws-cli/2.0" - -'),
+    (ALB_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_SAMPLE),
+    (ALB_ACCESS_LOG_TYPE, 'http 2018-07-02T22:23:00.186641Z app/my-lb/50dc6c495c0c9188 [2001:db8::1]:2817 - -1 -1 -1 '
+                          '503 - 34 366 "GET http://www.example.com:80-?a=b HTTP/1.1" "" - - '
+                          'arn:aws:elasticloadbalancing:us-east-2:123456789012:targetgroup/my-targets/73e2d6bc24d8a067 '
+                          '"Root=1-58337364-23a8c76965a2ef7629b185e3" "-" "-" 0 2018-07-02T22:22:48.364000Z '
+                          '"forward" "-" "LambdaInvalidResponse" "-" "-"'),
+    (ALB_ACCESS_LOG_TYPE, 'h2 2018-07-02T22:23:00.186641Z app/my-lb/50dc6c495c0c9188 10.0.1.252:48160 10.0.0.66:9000 '
+                          '0.000 0.002 0.000 200 200 5 257 "POST https://[2001:db8::1]:443/api HTTP/2.0" "curl 7.46.0" ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 '
+                          'arn:aws:elasticloadbalancing:us-east-2:123456789012:targetgroup/my-targets/73e2d6bc24d8a067 '
+                          '"Root=1-58337327-72bd00b0343d75b906739c42" "-" "-" 1 2018-07-02T22:22:48.364000Z '
+                          '"redirect" "https://example.com:80/" "-" "10.0.0.66:9000" "200" "Ambiguous" '
+                          '"UndefinedContentLengthSemantics" TID_1234'),
+    (NLB_ACCESS_LOG_TYPE, NLB_ACCESS_LOG_SAMPLE),
+    (NLB_ACCESS_LOG_TYPE, 'tls 2.0 2018-12-20T02:59:40 net/my-network-loadbalancer/c6e77e28c25b2234 g3d4b5e8bb8464cd '
+                          '2001:db8::1:28783 10.0.0.1:443 5 - - 246 - - - - - - - - - -'),
+    (CLASSIC_LB_ACCESS_LOG_TYPE, CLB_ACCESS_LOG_SAMPLE),
+    (CLASSIC_LB_ACCESS_LOG_TYPE, '2015-05-13T23:39:43.945958Z my-loadbalancer 192.168.131.39:2817 - -1 -1 -1 504 0 0 0 '
+                                 '"GET http://www.example.com:80/path/to?q=1&b HTTP/1.1" - - -'),
+    (CLASSIC_LB_ACCESS_LOG_TYPE, '2015-05-13T23:39:43.945958Z my-loadbalancer 192.168.131.39:2817 10.0.0.1:80 0.001069 '
+                                 '0.000028 0.000041 - - 82 305 "- - - " "Mozilla/5.0 (Windows NT 10.0)" - -'),
+]
+
+
+@pytest.mark.parametrize('log_type, line', TOKENIZED_LOG_SAMPLES)
+def test_tokenized_parsers_match_regex(log_type, line):
+    parser = ParserFactory.get_parser(log_type, None)
+    assert isinstance(parser, TokenizedParser)
+    fields = parser.tokenize_fields(line)
+    assert fields is not None
+    assert fields == Parser.match(parser, line)
+
+
+@pytest.mark.parametrize('log_type, line', [
+    (S3_ACCESS_LOG_TYPE, 'owner bucket [06/Feb/2019:00:00:38 +0000] 192.0.2.3 requester ID REST.GET.OBJECT key '
+                         '"GET /key HTTP/1.1" 200 - 1 - 7 - "-" "agent with "quotes" inside" -'),
+    (ALB_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_SAMPLE.replace('curl/7.46.0', 'curl/7.46.0 \u00e9')),
+    (CLASSIC_LB_ACCESS_LOG_TYPE, CLB_ACCESS_LOG_SAMPLE.replace('"curl/7.38.0"', '"curl "7.38.0""')),
+    (ALB_ACCESS_LOG_TYPE, ALB_ACCESS_LOG_SAMPLE.replace('GET https://www.example.com:443/ HTTP/1.1', '- - - ')),
+    (NLB_ACCESS_LOG_TYPE, 'not an nlb log'),
+])
+def test_tokenized_parsers_fall_back_to_regex(log_type, line):
+    parser = ParserFactory.get_parser(log_type, None)
+    assert parser.match(line) == Parser.match(parser, line)
+
+
+VPC_FLOW_LOG_DEFAULT_HEADER = ('version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes '
+                               'start end action log-status')
+VPC_FLOW_LOG_SAMPLE = ('2 123456789010 eni-1235b8ca123456789 172.31.16.139 172.31.16.21 20641 22 6 20 4249 1418530010 '
+                       '1418530070 ACCEPT OK')
+
+
+def _parse_lines(log_type, lines):
+    stream = PlaintextStream(io.BytesIO(''.join(line + '\n' for line in lines).encode()))
+    return list(ParserFactory.get_parser(log_type, stream).get_parsed_lines())
+
+
+def test_vpc_flow_log_parser_skips_default_header():
+    parsed = _parse_lines(VPC_FLOW_LOG_TYPE, [VPC_FLOW_LOG_DEFAULT_HEADER, VPC_FLOW_LOG_SAMPLE])
+    assert len(parsed) == 1
+    parser = ParserFactory.get_parser(VPC_FLOW_LOG_TYPE, None)
+    assert json.loads(parsed[0]) == Parser.match(parser, VPC_FLOW_LOG_SAMPLE)
+
+
+def test_vpc_flow_log_parser_custom_format():
+    parsed = _parse_lines(VPC_FLOW_LOG_TYPE, ['interface-id vpc-id srcaddr pkt-srcaddr flow-direction action',
+                                              'eni-1235b8ca123456789 vpc-abcdefab012345678 10.0.0.5 203.0.113.5 '
+                                              'ingress ACCEPT',
+                                              'eni-1235b8ca123456789 - - - - REJECT'])
+    assert [json.loads(line) for line in parsed] == [
+        {'interface_id': 'eni-1235b8ca123456789', 'vpc_id': 'vpc-abcdefab012345678', 'srcaddr': '10.0.0.5',
+         'pkt_srcaddr': '203.0.113.5', 'flow_direction': 'ingress', 'action': 'ACCEPT'},
+        {'interface_id': 'eni-1235b8ca123456789', 'vpc_id': '-', 'srcaddr': '-', 'pkt_srcaddr': '-',
+         'flow_direction': '-', 'action': 'REJECT'}]
+
+
+def test_vpc_flow_log_parser_without_header():
+    parsed = _parse_lines(VPC_FLOW_LOG_TYPE, [VPC_FLOW_LOG_SAMPLE, VPC_FLOW_LOG_SAMPLE])
+    assert len(parsed) == 2
+    assert json.loads(parsed[1])['log_status'] == 'OK'
+
+
+def test_cf_standard_access_log_parser_uses_fields_directive():
+    parsed = _parse_lines(CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, [
+        '#Version: 1.0', '#Fields: date time cs(Host) cs-uri-stem sc-status cs(User-Agent)',
+        '2019-12-04\t21:02:31\td111111abcdef8.cloudfront.net\t/index.html\t200\tcurl/7.68.0', '',
+        # a row not matching the directive
+        '2019-12-04\t21:02:31\td111111abcdef8.cloudfront.net'])
+    assert json.loads(parsed[0]) == {'date': '2019-12-04', 'time': '21:02:31',
+                                     'cs_host': 'd111111abcdef8.cloudfront.net', 'cs_uri_stem': '/index.html',
+                                     'sc_status': '200', 'cs_user_agent': 'curl/7.68.0'}
+    assert parsed[1] == '2019-12-04\t21:02:31\td111111abcdef8.cloudfront.net'
+
+
+def test_cf_standard_access_log_parser_default_fields_directive():
+    fields = ('date time x-edge-location sc-bytes c-ip cs-method cs(Host) cs-uri-stem sc-status cs(Referer) '
+              'cs(User-Agent) cs-uri-query cs(Cookie) x-edge-result-type x-edge-request-id x-host-header cs-protocol '
+              'cs-bytes time-taken x-forwarded-for ssl-protocol ssl-cipher x-edge-response-result-type '
+              'cs-protocol-version fle-status fle-encrypted-fields c-port time-to-first-byte '
+              'x-edge-detailed-result-type sc-content-type sc-content-len sc-range-start sc-range-end')
+    parsed = _parse_lines(CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, ['#Version: 1.0', f'#Fields: {fields}',
+                                                                CF_STANDARD_ACCESS_LOG_SAMPLE])
+    parser = ParserFactory.get_parser(CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, None)
+    assert json.loads(parsed[0]) == Parser.match(parser, CF_STANDARD_ACCESS_LOG_SAMPLE)
+
+
+@pytest.mark.parametrize('log_type,line', TOKENIZED_LOG_SAMPLES)
+def test_structured_records(log_type, line):
+    parser = ParserFactory.get_parser(log_type, None, structured_records=True)
+    record = parser.parse(line)
+    assert isinstance(record, StructuredRecord)
+    assert record == ParserFactory.get_parser(log_type, None).parse(line)
+    assert not isinstance(parser.parse('not a log line'), StructuredRecord)
+
+
+def test_structured_records_with_custom_columns():
+    stream = PlaintextStream(io.BytesIO(b'interface-id action\neni-1235b8ca123456789 ACCEPT\n'))
+    parser = ParserFactory.get_parser(VPC_FLOW_LOG_TYPE, stream, structured_records=True)
+    assert list(parser.get_parsed_lines()) == ['{"interface_id": "eni-1235b8ca123456789", "action": "ACCEPT"}']
+
+
+def test_cloudtrail_structured_records():
+    stream = PlaintextStream(io.BytesIO(CLOUDTRAIL_LOG_SAMPLE.replace('\n', '').encode() + b'\n'))
+    parser = ParserFactory.get_parser(CLOUDTRAIL_LOG_TYPE, stream, structured_records=True)
+    records = list(parser.get_parsed_lines())
+    assert all(isinstance(record, StructuredRecord) for record in records)
+    assert json.loads(records[0])['eventName'] == 'StartInstances'
+
+
+@pytest.mark.parametrize('log_type, lines', [
+    (S3_ACCESS_LOG_TYPE, [S3_ACCESS_LOG_SAMPLE, 'malformed', '', S3_ACCESS_LOG_SAMPLE]),
+    (VPC_FLOW_LOG_TYPE, [VPC_FLOW_LOG_DEFAULT_HEADER, VPC_FLOW_LOG_SAMPLE, VPC_FLOW_LOG_SAMPLE]),
+    (CLOUDWATCH_LOG_TYPE, ['some line', '  indented line']),
+])
+def test_parsed_chunks_like_parsed_lines(log_type, lines):
+    stream = PlaintextStream(io.BytesIO(''.join(line + '\n' for line in lines).encode()))
+    chunks = list(ParserFactory.get_parser(log_type, stream).get_parsed_chunks())
+    assert [line for chunk in chunks for line in chunk] == _parse_lines(log_type, lines)
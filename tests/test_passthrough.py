@@ -0,0 +1,154 @@
+import gzip
+import os
+import zlib
+from types import SimpleNamespace
+
+import pytest
+
+import passthrough
+from clients import BrontoClient, Batch, CompressedBatch
+from logfile import GZipFileRange
+from passthrough import GZipPassthroughExporter, Member, scan_members
+
+LINES = [f'{{"message": "line {i:03}", "value": {i * 7:04}}}' for i in range(0, 200)]
+
+
+def _members(lines, lines_per_member):
+    return [gzip.compress(''.join(line + '\n' for line in lines[i:i + lines_per_member]).encode())
+            for i in range(0, len(lines), lines_per_member)]
+
+
+def _write(tmp_path, members):
+    filepath = os.path.join(tmp_path, 'some_file.gz')
+    with open(filepath, 'wb') as f:
+        for member in members:
+            f.write(member)
+    return filepath
+
+
+@pytest.fixture()
+def client():
+    return BrontoClient('api_key', 'endpoint', 'my_dataset', 'my_collection', 'fluentd', {})
+
+
+@pytest.fixture()
+def sent_payloads(monkeypatch):
+    sent_payloads = []
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', lambda _, data: sent_payloads.append(bytes(data)))
+    return sent_payloads
+
+
+def _sent_lines(sent_payloads):
+    return [line for payload in sent_payloads for line in gzip.decompress(payload).decode().splitlines()]
+
+
+def test_scan_members():
+    members = [gzip.compress(b'a\nb\n'), gzip.compress(b'c'), gzip.compress(b'')]
+    data = b''.join(members) + b'\x00\x00'
+    assert list(scan_members(data, chunk_size=3)) == [
+        Member(0, len(members[0]), 4, True),
+        Member(len(members[0]), len(members[0]) + len(members[1]), 1, False),
+        Member(len(members[0]) + len(members[1]), len(data) - 2, 0, True),
+    ]
+
+
+def test_scan_members_up_to_max_size():
+    members = [gzip.compress(b'a\n'), gzip.compress(b'b' * 100 + b'\n'), gzip.compress(b'c\n')]
+    assert list(scan_members(b''.join(members), chunk_size=3, max_size=10)) == [
+        Member(0, len(members[0]), 2, True),
+        Member(len(members[0]), None, None, False),
+    ]
+
+
+def test_scan_truncated_member():
+    with pytest.raises(EOFError):
+        list(scan_members(gzip.compress(b'a\nb\n')[:-5]))
+
+
+def test_scan_garbage():
+    with pytest.raises(gzip.BadGzipFile):
+        list(scan_members(gzip.compress(b'a\n') + b'garbage'))
+
+
+def test_members_sent_as_they_are(tmp_path, client, sent_payloads):
+    members = _members(LINES, 10)
+    filepath = _write(tmp_path, members)
+    max_size = 3 * len(gzip.decompress(members[0])) + 10
+    GZipPassthroughExporter(client, filepath, Batch(max_size, True)).export()
+    assert _sent_lines(sent_payloads) == LINES
+    # payloads are made of whole members, which are not compressed again
+    assert b''.join(sent_payloads) == b''.join(members)
+    assert len(sent_payloads) == 7
+
+
+def test_max_compressed_size(tmp_path, client, sent_payloads):
+    members = _members(LINES, 10)
+    filepath = _write(tmp_path, members)
+    max_compressed_size = 2 * max(len(member) for member in members)
+    GZipPassthroughExporter(client, filepath, Batch(1000000, True), max_compressed_size).export()
+    assert b''.join(sent_payloads) == b''.join(members)
+    assert all(len(payload) <= max_compressed_size for payload in sent_payloads)
+    assert len(sent_payloads) == 10
+
+
+def test_lines_spanning_members(tmp_path, client, sent_payloads):
+    data = ''.join(line + '\n' for line in LINES).encode()
+    # members end in the middle of lines
+    members = [gzip.compress(data[i:i + 100]) for i in range(0, len(data), 100)]
+    filepath = _write(tmp_path, members)
+    # lines end at the end of members every 3900 bytes
+    GZipPassthroughExporter(client, filepath, Batch(4000, True)).export()
+    assert _sent_lines(sent_payloads) == LINES
+    assert b''.join(sent_payloads) == b''.join(members)
+    assert len(sent_payloads) == 2
+
+
+def test_large_member_split_into_lines(tmp_path, client, sent_payloads):
+    members = _members(LINES[:10], 10) + _members(LINES[10:190], 180) + _members(LINES[190:], 10)
+    filepath = _write(tmp_path, members)
+    max_size = len(gzip.decompress(members[0])) + 1
+    GZipPassthroughExporter(client, filepath, CompressedBatch(max_size, 1000000, True)).export()
+    assert _sent_lines(sent_payloads) == LINES
+    assert sent_payloads[0] == members[0]
+    # members following the large one are split along with it, as they are not scanned
+    assert members[-1] not in sent_payloads
+    assert all(len(gzip.decompress(payload)) <= max_size for payload in sent_payloads)
+
+
+def test_large_member_decompressed_once(tmp_path, client, sent_payloads, monkeypatch):
+    filepath = _write(tmp_path, _members(LINES, len(LINES)))
+    inflated_sizes = []
+
+    class _Decompressor:
+
+        def __init__(self, decompressor):
+            self.decompressor = decompressor
+
+        def __getattr__(self, name):
+            return getattr(self.decompressor, name)
+
+        def decompress(self, data, max_length=0):
+            output = self.decompressor.decompress(data, max_length)
+            inflated_sizes.append(len(output))
+            return output
+
+    decompressobj = zlib.decompressobj
+    monkeypatch.setattr(passthrough, 'zlib', SimpleNamespace(decompressobj=lambda *args: _Decompressor(
+        decompressobj(*args))))
+    GZipPassthroughExporter(client, filepath, Batch(1000, True)).export()
+    assert _sent_lines(sent_payloads) == LINES
+    # the member is inflated no further than it takes to know it does not fit in a payload
+    assert sum(inflated_sizes) == 1001
+
+
+def test_empty_file(tmp_path, client, sent_payloads):
+    GZipPassthroughExporter(client, _write(tmp_path, []), Batch(1000, True)).export()
+    assert sent_payloads == []
+
+
+def test_gzip_file_range(tmp_path):
+    members = _members(LINES, 50)
+    filepath = _write(tmp_path, members)
+    start = len(members[0])
+    end = start + len(members[1]) + len(members[2])
+    assert list(GZipFileRange(filepath, start, end).get_lines()) == LINES[50:150]
@@ -0,0 +1,100 @@
+import os
+import pstats
+import tempfile
+import tracemalloc
+
+import profiling
+from config import Config
+from metrics import InvocationMetrics, MemoryTrackingExportMetrics, NoopInvocationMetrics
+from profiling import (InvocationProfiler, InvocationProfilerFactory, LocalFileProfileStore, NoopInvocationProfiler,
+                       ProfileStore, S3ProfileStore)
+
+
+class _LambdaContext:
+
+    aws_request_id = 'my-request-id'
+
+
+class _FailingProfileStore(ProfileStore):
+
+    def save(self, filename: str, data: bytes):
+        raise OSError('No space left on device')
+
+
+def _work():
+    return [bytearray(1000) for _ in range(0, 1000)]
+
+
+def test_profile_is_saved():
+    with tempfile.TemporaryDirectory() as directory:
+        profiler = InvocationProfilerFactory.get_profiler(True, profiling_directory=directory,
+                                                          context=_LambdaContext())
+        invocation_metrics = InvocationMetrics(track_memory=True)
+        profiler.start()
+        export_metrics = invocation_metrics.new_export_metrics()
+        export_metrics.set_dimensions('alb_access_log', 'alb')
+        with export_metrics.time('parse'):
+            held = _work()
+        profiler.stop()
+        profiler.save(invocation_metrics)
+
+        filenames = sorted(os.listdir(directory))
+        assert len(filenames) == 2
+        assert filenames[0].endswith('-my-request-id.pstats')
+        assert filenames[1] == filenames[0].replace('.pstats', '.txt')
+        stats = pstats.Stats(os.path.join(directory, filenames[0]))
+        assert any(function == '_work' for _, _, function in stats.stats)
+        with open(os.path.join(directory, filenames[1])) as f:
+            report = f.read()
+        assert 'log_type=alb_access_log, dataset=alb: download=0.000, decompress=0.000, parse=' in report
+        assert 'test_profiling.py' in report
+        assert len(held) == 1000
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_saving_failure_does_not_fail_invocation():
+    profiler = InvocationProfiler(_FailingProfileStore(), 'name')
+    profiler.start()
+    profiler.stop()
+    profiler.save(InvocationMetrics())
+
+
+def test_profiler_store():
+    assert isinstance(InvocationProfilerFactory.get_profiler(False), NoopInvocationProfiler)
+    assert isinstance(InvocationProfilerFactory.get_profiler(True).store, LocalFileProfileStore)
+
+
+def test_s3_profile_store(monkeypatch):
+    monkeypatch.setattr(profiling, 'get_s3_client', lambda: None)
+    store = InvocationProfilerFactory.get_profiler(True, profiling_s3_uri='s3://my-bucket/profiles').store
+    assert isinstance(store, S3ProfileStore)
+    assert store.bucket_name == 'my-bucket'
+    assert store.prefix == 'profiles/'
+
+
+def test_peak_memory_of_stages():
+    tracemalloc.start()
+    try:
+        export_metrics = MemoryTrackingExportMetrics()
+        with export_metrics.time('parse'):
+            data = bytearray(5 * 1000 * 1000)
+            with export_metrics.time('decompress'):
+                pass
+        del data
+        with export_metrics.time('send'):
+            pass
+    finally:
+        tracemalloc.stop()
+    peak_memory = export_metrics.get_peak_memory()
+    assert peak_memory['parse'] >= 5 * 1000 * 1000
+    assert peak_memory['send'] < 5 * 1000 * 1000
+
+
+def test_profiling_config(monkeypatch):
+    assert not Config({}).profiling
+    assert isinstance(Config({}).invocation_metrics, NoopInvocationMetrics)
+    assert Config({'profile': True}).profiling
+    monkeypatch.setenv('profiling_rate', '1')
+    config = Config({})
+    assert config.profiling
+    assert isinstance(config.invocation_metrics.new_export_metrics(), MemoryTrackingExportMetrics)
@@ -0,0 +1,86 @@
+import gzip
+import io
+import threading
+import time
+
+import pytest
+
+from logfile import GZipStream
+from ranged_reader import RangedReader
+
+
+class _S3Client:
+
+    def __init__(self, data: bytes, etag='etag', delay_sec=0.0):
+        self.data = data
+        self.etag = etag
+        self.delay_sec = delay_sec
+        self.ranges = []
+        self.concurrent_requests = 0
+        self.max_concurrent_requests = 0
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        assert IfMatch == self.etag
+        start, end = (int(bound) for bound in Range.replace('bytes=', '').split('-'))
+        with self.lock:
+            self.ranges.append((start, end))
+            self.concurrent_requests += 1
+            self.max_concurrent_requests = max(self.max_concurrent_requests, self.concurrent_requests)
+        time.sleep(self.delay_sec)
+        with self.lock:
+            self.concurrent_requests -= 1
+        return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+
+def _reader(client, part_size, max_concurrency):
+    return RangedReader(client, 'bucket', 'key', len(client.data), client.etag, part_size, max_concurrency)
+
+
+@pytest.mark.parametrize('size,part_size', [(100, 10), (101, 10), (5, 10), (0, 10)])
+def test_parts_are_reassembled_in_order(size, part_size):
+    client = _S3Client(bytes(i % 251 for i in range(0, size)))
+    with _reader(client, part_size, 3) as reader:
+        assert reader.read() == client.data
+    assert sorted(client.ranges) == [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def test_small_reads():
+    client = _S3Client(b'0123456789' * 10)
+    reader = _reader(client, 7, 2)
+    chunks = []
+    while True:
+        chunk = reader.read(3)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert b''.join(chunks) == client.data
+    assert max(len(chunk) for chunk in chunks) == 3
+
+
+def test_parts_are_downloaded_concurrently():
+    client = _S3Client(b'x' * 80, delay_sec=0.05)
+    start = time.monotonic()
+    with _reader(client, 10, 4) as reader:
+        assert reader.read() == client.data
+    assert client.max_concurrent_requests == 4
+    assert time.monotonic() - start < 8 * 0.05
+
+
+def test_parts_are_requested_once_read():
+    client = _S3Client(b'x' * 100)
+    reader = _reader(client, 10, 4)
+    assert client.ranges == []
+    assert reader.executor is None
+    reader.close()
+    with pytest.raises(ValueError):
+        reader.read()
+    assert reader.executor is None
+
+
+def test_decompressed_on_the_fly():
+    entries = [f'some entry {i}' for i in range(0, 1000)]
+    client = _S3Client(gzip.compress(('\n'.join(entries) + '\n').encode()))
+    reader = _reader(client, 100, 4)
+    assert list(GZipStream(reader).get_lines()) == entries
+    assert reader.closed
@@ -0,0 +1,17 @@
+import json
+
+from record import RecordSerializer, StructuredRecord
+
+
+def test_serialize_like_json_dumps():
+    serializer = RecordSerializer(['name', 'quoted'])
+    fields = {'name': 'value', 'quoted': 'a "quoted" \\ value\twith\ncontrol characters and ünicode'}
+    record = serializer.serialize(fields)
+    assert isinstance(record, StructuredRecord)
+    assert record == json.dumps(fields)
+
+
+def test_serialize_unknown_fields():
+    serializer = RecordSerializer()
+    assert serializer.serialize({'cs(User-Agent)': 'curl', 'é': ''}) == json.dumps({'cs(User-Agent)': 'curl', 'é': ''})
+    assert serializer.serialize({}) == '{}'
@@ -0,0 +1,58 @@
+import time
+from email.utils import formatdate
+
+from retry import Deadline, RetryPolicy
+
+
+class _LambdaContext:
+
+    def __init__(self, remaining_time_in_millis):
+        self.remaining_time_in_millis = remaining_time_in_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_time_in_millis
+
+
+def test_deadline_from_lambda_context():
+    deadline = Deadline.from_lambda_context(_LambdaContext(10000), safety_margin_sec=2)
+    assert 7.9 < deadline.get_remaining_sec() <= 8
+    assert Deadline.from_lambda_context(_LambdaContext(1000), safety_margin_sec=2).get_remaining_sec() == 0
+
+
+def test_deadline_without_lambda_context():
+    assert Deadline.from_lambda_context(None).get_remaining_sec() == float('inf')
+    assert Deadline.from_lambda_context(object()).get_remaining_sec() == float('inf')
+
+
+def test_delay_is_exponential_with_jitter():
+    policy = RetryPolicy(base_delay_sec=1, max_delay_sec=5)
+    for attempt, max_delay_sec in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+        delays = [policy.get_delay_sec(attempt) for _ in range(0, 100)]
+        assert all(0 <= delay <= max_delay_sec for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_delay_honours_retry_after():
+    policy = RetryPolicy(base_delay_sec=1, max_delay_sec=5)
+    assert policy.get_delay_sec(1, retry_after_sec=3) == 3
+
+
+def test_retry_after_is_capped():
+    policy = RetryPolicy(base_delay_sec=1, max_delay_sec=5)
+    assert policy.get_delay_sec(1, retry_after_sec=3600) == 5
+    far_off_date = formatdate(time.time() + 24 * 3600, usegmt=True)
+    assert policy.get_delay_sec(1, RetryPolicy.parse_retry_after(far_off_date)) == 5
+
+
+def test_parse_retry_after():
+    assert RetryPolicy.parse_retry_after(None) is None
+    assert RetryPolicy.parse_retry_after('120') == 120
+    assert 55 < RetryPolicy.parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert RetryPolicy.parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0
+    assert RetryPolicy.parse_retry_after('soon') is None
+
+
+def test_retryable_statuses():
+    policy = RetryPolicy()
+    assert all(policy.is_retryable_status(status) for status in [429, 500, 503])
+    assert not any(policy.is_retryable_status(status) for status in [400, 401, 403, 413])
@@ -0,0 +1,60 @@
+import pytest
+
+from router import PathRouter, literal_prefix
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('logs/app/(?P<dest_config_id>[^/]+)', 'logs/app/'),
+    ('^logs/(?P<dest_config_id>[^/]+)', 'logs/'),
+    ('logs\\.v2/(?P<dest_config_id>[^/]+)', 'logs.v2/'),
+    ('logsx?/(?P<dest_config_id>[^/]+)', 'logs'),
+    ('logs+/(?P<dest_config_id>[^/]+)', 'logs'),
+    ('logs\\d/(?P<dest_config_id>[^/]+)', 'logs'),
+    ('[^/]*/(?P<dest_config_id>[^/]+)', ''),
+    ('a/(?P<dest_config_id>[^/]+)|b/(?P<other>[^/]+)', ''),
+])
+def test_literal_prefix(pattern, expected):
+    assert literal_prefix(pattern) == expected
+
+
+def test_route_no_rules():
+    assert PathRouter([]).route('some/key') is None
+
+
+def test_route_extracts_dest_config_id():
+    router = PathRouter([{'pattern': '[^/]*/(?P<dest_config_id>[^/]+)'}])
+    assert router.route('some_prefix/my_config_id/some_suffix') == (0, 'my_config_id')
+    assert router.route('no_slash') is None
+
+
+def test_route_first_matching_rule_wins():
+    router = PathRouter([{'pattern': 'logs/(?P<dest_config_id>app)/'},
+                         {'pattern': '[^/]*/(?P<dest_config_id>[^/]+)/'},
+                         {'pattern': 'logs/app/(?P<dest_config_id>[^/]+)'}])
+    assert router.route('logs/app/service') == (0, 'app')
+    assert router.route('logs/web/service') == (1, 'web')
+    assert router.route('other/web/service') == (1, 'web')
+
+
+def test_route_prefers_configuration_order_over_prefix_length():
+    router = PathRouter([{'pattern': '(?P<dest_config_id>[^/]+)/'},
+                         {'pattern': 'logs/app/(?P<dest_config_id>[^/]+)'}])
+    assert router.route('logs/app/service') == (0, 'logs')
+
+
+def test_route_with_rules_that_cannot_be_combined():
+    router = PathRouter([{'pattern': '(?i)LOGS/(?P<dest_config_id>[^/]+)'},
+                         {'pattern': '(?P<dest_config_id>[^/]+)/\\1/'},
+                         {'pattern': '(?P<dest_config_id>[^/]+)/(?P=dest_config_id)-'}])
+    assert router.route('logs/app/') == (0, 'app')
+    assert router.route('app/app/') == (1, 'app')
+    assert router.route('app/app-') == (2, 'app')
+    assert router.route('app/web/') is None
+
+
+def test_route_with_many_rules():
+    paths_regex = [{'pattern': f'tenant-{i}/(?P<dest_config_id>[^/]+)/'} for i in range(0, 1000)]
+    router = PathRouter(paths_regex)
+    assert router.route('tenant-999/my_config_id/file.log') == (999, 'my_config_id')
+    assert router.route('tenant-1/my_config_id/file.log') == (1, 'my_config_id')
+    assert router.route('tenant-1000/my_config_id/file.log') is None
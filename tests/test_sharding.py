@@ -0,0 +1,171 @@
+import gzip
+import json
+import os
+import threading
+
+import pytest
+
+from clients import BrontoClient, Batch
+from config import CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, S3_ACCESS_LOG_TYPE, VPC_FLOW_LOG_TYPE
+from logfile import PlaintextFileRange
+from metrics import ExportMetrics
+from sharding import ParsingProcessPool, ShardedBrontoExporter, split_shards
+
+S3_ACCESS_LOG_LINE = ('owner bucket [06/Feb/2019:00:00:38 +0000] 192.0.2.3 requester ID REST.GET.OBJECT key{} '
+                      '"GET /bucket/key{} HTTP/1.1" 200 - 113 - 7 - "-" "S3Console/0.4" -')
+
+
+@pytest.fixture()
+def filepath(tmp_path):
+    filepath = os.path.join(tmp_path, 'some_file')
+    with open(filepath, 'w') as f:
+        for i in range(0, 1000):
+            f.write(S3_ACCESS_LOG_LINE.format(i, i) + '\n')
+    return filepath
+
+
+@pytest.fixture(scope='module')
+def pool():
+    return ParsingProcessPool(3)
+
+
+@pytest.fixture()
+def client():
+    return BrontoClient('api_key', 'endpoint', 'my_dataset', 'my_collection', None, {})
+
+
+def test_split_shards_at_line_boundaries(filepath):
+    shards = split_shards(filepath, 4, min_shard_size=1)
+    assert len(shards) == 4
+    assert shards[0][0] == 0
+    assert shards[-1][1] == os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    for (_, end), (start, _) in zip(shards[:-1], shards[1:]):
+        assert end == start
+        assert data[start - 1:start] == b'\n'
+
+
+def test_split_shards_min_shard_size(filepath):
+    assert split_shards(filepath, 4) == [(0, os.path.getsize(filepath))]
+    assert len(split_shards(filepath, 4, min_shard_size=os.path.getsize(filepath) // 2)) == 2
+
+
+def test_split_small_file(tmp_path):
+    filepath = os.path.join(tmp_path, 'some_file')
+    with open(filepath, 'w') as f:
+        f.write('a\nb')
+    assert split_shards(filepath, 8, min_shard_size=1) == [(0, 2), (2, 3)]
+    open(filepath, 'w').close()
+    assert split_shards(filepath, 8, min_shard_size=1) == [(0, 0)]
+
+
+def test_split_shards_after_headers(filepath):
+    with open(filepath, 'rb') as f:
+        start = len(f.readline())
+    shards = split_shards(filepath, 4, min_shard_size=1, start=start)
+    assert shards[0][0] == start
+    assert shards[-1][1] == os.path.getsize(filepath)
+
+
+def test_plaintext_file_range(filepath):
+    lines = []
+    for start, end in split_shards(filepath, 3, min_shard_size=1):
+        lines.extend(PlaintextFileRange(filepath, start, end).get_lines())
+    with open(filepath) as f:
+        assert lines == f.read().splitlines()
+
+
+def test_sharded_export(filepath, pool, client, monkeypatch):
+    sent_logs = []
+    lock = threading.Lock()
+
+    def send_compressed_data(_, compressed_data):
+        with lock:
+            sent_logs.extend(json.loads(line) for line in gzip.decompress(compressed_data).splitlines())
+
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', send_compressed_data)
+    ShardedBrontoExporter(client, filepath, S3_ACCESS_LOG_TYPE, True, Batch(10000, attributes={'service': 'test'}),
+                          pool, min_shard_size=1).export()
+    assert sorted(log['log']['Key'] for log in sent_logs) == sorted(f'key{i}' for i in range(0, 1000))
+    assert all(log['service'] == 'test' for log in sent_logs)
+
+
+def test_sharded_export_send_failure(filepath, pool, client, monkeypatch):
+    def send_compressed_data(*_):
+        raise ValueError('some error')
+
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', send_compressed_data)
+    with pytest.raises(ValueError):
+        ShardedBrontoExporter(client, filepath, S3_ACCESS_LOG_TYPE, False, Batch(10000), pool).export()
+    # processes are ready for other shards
+    sent_batches = []
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', lambda _, data: sent_batches.append(data))
+    ShardedBrontoExporter(client, filepath, S3_ACCESS_LOG_TYPE, False, Batch(10000), pool).export()
+    assert len(sent_batches) > 0
+
+
+def test_sharded_export_parsing_failure(tmp_path, pool, client, monkeypatch):
+    filepath = os.path.join(tmp_path, 'some_file')
+    with open(filepath, 'wb') as f:
+        f.write(b'\xff\xfe\n')
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', lambda *_: None)
+    with pytest.raises(Exception, match='UnicodeDecodeError'):
+        ShardedBrontoExporter(client, filepath, S3_ACCESS_LOG_TYPE, False, Batch(10000), pool).export()
+
+
+def _sent_logs(monkeypatch):
+    sent_logs = []
+    lock = threading.Lock()
+
+    def send_compressed_data(_, compressed_data):
+        with lock:
+            sent_logs.extend(json.loads(line)['log'] for line in gzip.decompress(compressed_data).splitlines())
+
+    monkeypatch.setattr(BrontoClient, 'send_compressed_data', send_compressed_data)
+    return sent_logs
+
+
+def test_sharded_export_with_header(tmp_path, pool, client, monkeypatch):
+    filepath = os.path.join(tmp_path, 'some_file')
+    with open(filepath, 'w') as f:
+        # a custom format, whose rows are only parsed with the columns of the header
+        f.write('srcaddr dstaddr action\n')
+        for i in range(0, 1000):
+            f.write(f'10.0.0.{i % 256} 10.0.1.1 ACCEPT\n')
+    sent_logs = _sent_logs(monkeypatch)
+    ShardedBrontoExporter(client, filepath, VPC_FLOW_LOG_TYPE, True, Batch(10000), pool, min_shard_size=1).export()
+    assert len(sent_logs) == 1000
+    assert all(set(log) == {'srcaddr', 'dstaddr', 'action'} for log in sent_logs)
+
+
+def test_sharded_export_with_header_lines(tmp_path, pool, client, monkeypatch):
+    filepath = os.path.join(tmp_path, 'some_file')
+    with open(filepath, 'w') as f:
+        f.write('#Version: 1.0\n#Fields: date time sc-status\n')
+        for i in range(0, 1000):
+            f.write(f'2024-01-01\t00:00:{i % 60:02}\t200\n')
+    sent_logs = _sent_logs(monkeypatch)
+    ShardedBrontoExporter(client, filepath, CLOUDFRONT_STANDARD_ACCESS_LOG_TYPE, True, Batch(10000), pool,
+                          min_shard_size=1).export()
+    assert len(sent_logs) == 1000
+    assert all(log['sc_status'] == '200' for log in sent_logs)
+
+
+def test_sharded_export_of_gzip_file(tmp_path, pool, client, monkeypatch):
+    filepath = os.path.join(tmp_path, 'some_file')
+    with gzip.open(filepath, 'wt') as f:
+        f.write('srcaddr dstaddr action\n')
+        for i in range(0, 1000):
+            # lines of gzip files are stripped
+            f.write(f' 10.0.0.{i % 256} 10.0.1.1 ACCEPT\n')
+        f.write('not a flow log\n')
+    sent_logs = _sent_logs(monkeypatch)
+    export_metrics = ExportMetrics()
+    ShardedBrontoExporter(client, filepath, VPC_FLOW_LOG_TYPE, True, Batch(10000), pool, min_shard_size=1,
+                          compressed=True, metrics=export_metrics).export()
+    assert len(sent_logs) == 1001
+    assert sum(isinstance(log, dict) and log['srcaddr'].startswith('10.0.0.') for log in sent_logs) == 1000
+    assert export_metrics.get_counts()['parse_misses'] == 1
+    # the decompressed spool file is removed
+    assert os.listdir(tmp_path) == ['some_file']